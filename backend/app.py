@@ -1,38 +1,114 @@
-from flask import Flask, request, jsonify
+import copy
+import csv
+import io
+
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
+from sqlalchemy import insert, select, and_
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 from datetime import datetime
 
 from config import Config
 from models import (
     db,
-    Mold, Task, Report,
-    Material, Inventory, Product, BOMItem, StockMove,
-    TaskMaterialRequirement
+    Mold, Task,
+    Material, Inventory, Product, BOMItem,
+    TaskMaterialRequirement, ImportJob, InventorySnapshot
 )
+from serializers import eager_query, dump_list
+from pagination import list_response, NEXT_CURSOR_HEADER
+from bom_import import import_rows, iter_text_rows, iter_xlsx_rows
+from jobs import job_queue
+from bom_explode import bom_exploder, BomCycleError
+from mrp import run_mrp
+import dbutil
+from dbutil import retry_on_busy
+import migrations
+import stock
+import rollups
+import snapshots
+from snapshots import snapshot_scheduler
+from production import apply_report, ingest_report_batch
+import events
+from events import emit, event_bus, task_payload
+from httpcache import cached_get, response_cache
+import search
+import task_numbers
+import mold_life
+import scheduler
+import where_used
+import bom_edit
+import stock_import
+from metrics import metrics
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
     app.config["JSON_AS_ASCII"] = False
-    CORS(app, resources={r"/api/*": {"origins": "*"}})
+    CORS(app, resources={r"/api/*": {"origins": "*"}}, expose_headers=[NEXT_CURSOR_HEADER])
     db.init_app(app)
+    dbutil.init_app(app)
+    job_queue.init_app(app)
+    snapshot_scheduler.init_app(app)
+    event_bus.init_app(app)
+    response_cache.init_app(app)
+    metrics.init_app(app)
 
     @app.get("/api/health")
     def health():
         return {"ok": True, "time": datetime.utcnow().isoformat()}
 
+    @app.get("/api/metrics")
+    def prometheus_metrics():
+        """各路由延迟直方图、请求数、SQL 条数/耗时、慢查询数（Prometheus 文本格式）"""
+        return Response(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+    @app.get("/api/search")
+    def search_all():
+        """
+        编码/名称/图号搜索（输入联想用）：?q=关键字&types=material,mold,product&limit=20
+        结果按 编码完全相同 > 编码前缀 > 全文相关度 排序
+        """
+        q = request.args.get("q", "").strip()
+        types = [t.strip() for t in request.args.get("types", "").split(",") if t.strip()]
+        bad = [t for t in types if t not in search.KINDS]
+        if bad:
+            return jsonify({"error": f"types 可选：{','.join(search.KINDS)}"}), 400
+        try:
+            limit = max(1, min(int(request.args.get("limit", 20) or 20), 100))
+        except ValueError:
+            return jsonify({"error": "limit 必须为整数"}), 400
+        return jsonify(search.search(q, types or None, limit))
+
+    @app.get("/api/events")
+    def event_stream():
+        """
+        SSE 变更推送，替代前端轮询：?types=task,stock.move 按类型前缀过滤（默认全部）
+        断线重连时浏览器自动带 Last-Event-ID；收到 reset 事件说明有事件已丢失，客户端应重新拉列表
+        """
+        types = [t.strip() for t in request.args.get("types", "").split(",") if t.strip()]
+        last_id = request.headers.get("Last-Event-ID") or request.args.get("last_event_id")
+        gen = events.stream(last_id, types, app.config["EVENTS_HEARTBEAT_SECONDS"],
+                            app.config["EVENTS_STREAM_SECONDS"])
+        return Response(gen, mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
     # =========================
     # Phase 1: Molds CRUD
     # =========================
     @app.get("/api/molds")
+    @cached_get(Mold)
     def list_molds():
         q = request.args.get("q", "").strip()
         query = Mold.query
         if q:
-            query = query.filter((Mold.mold_code.contains(q)) | (Mold.mold_name.contains(q)))
-        molds = query.order_by(Mold.id.desc()).all()
-        return jsonify([m.to_dict() for m in molds])
+            ids = search.matching_ids("mold", q)
+            if ids is not None:
+                query = query.filter(Mold.id.in_(ids))
+            else:
+                query = query.filter((Mold.mold_code.contains(q)) | (Mold.mold_name.contains(q)))
+        return list_response(query, Mold)
 
     @app.post("/api/molds")
     def create_mold():
@@ -48,10 +124,12 @@ def create_app():
             return jsonify({"error": "mold_code 和 mold_name 必填"}), 400
         db.session.add(m)
         try:
-            db.session.commit()
+            db.session.flush()
         except IntegrityError:
             db.session.rollback()
             return jsonify({"error": "模具编号已存在"}), 409
+        emit("mold.created", m.to_dict())
+        db.session.commit()
         return jsonify(m.to_dict()), 201
 
     @app.put("/api/molds/<int:mold_id>")
@@ -65,26 +143,48 @@ def create_app():
             if k in data and data[k] is not None:
                 setattr(m, k, int(data[k] or 0))
         try:
-            db.session.commit()
+            db.session.flush()
         except IntegrityError:
             db.session.rollback()
             return jsonify({"error": "模具编号已存在"}), 409
+        emit("mold.updated", m.to_dict())
+        db.session.commit()
         return jsonify(m.to_dict())
 
     @app.delete("/api/molds/<int:mold_id>")
     def delete_mold(mold_id):
         m = Mold.query.get_or_404(mold_id)
         db.session.delete(m)
+        emit("mold.deleted", {"id": mold_id})
         db.session.commit()
         return "", 204
 
+    @app.get("/api/molds/life")
+    def molds_life():
+        """寿命预测，按 到寿 / 预警 / 正常 和预计到寿日排序；?level=预警 只看某一级"""
+        level = request.args.get("level", "").strip() or None
+        if level is not None and level not in mold_life.LEVELS:
+            return jsonify({"error": f"level 可选：{','.join(mold_life.LEVELS)}"}), 400
+        try:
+            limit = int(request.args.get("limit", 0) or 0) or None
+        except ValueError:
+            return jsonify({"error": "limit 必须为整数"}), 400
+        return jsonify(mold_life.forecast(level=level, limit=limit))
+
+    @app.get("/api/molds/<int:mold_id>/life")
+    def mold_life_detail(mold_id):
+        m = Mold.query.get_or_404(mold_id)
+        if m.total_life <= 0:
+            return jsonify({"error": "模具未设置总寿命"}), 404
+        return jsonify(mold_life.forecast([mold_id])[0])
+
     # =========================
     # Phase 2: Materials CRUD
     # =========================
     @app.get("/api/materials")
+    @cached_get(Material)
     def list_materials():
-        mats = Material.query.order_by(Material.id.desc()).all()
-        return jsonify([m.to_dict() for m in mats])
+        return list_response(Material.query, Material)
 
     @app.post("/api/materials")
     def create_material():
@@ -113,7 +213,8 @@ def create_app():
         # 自动建库存行
         if not Inventory.query.filter_by(material_id=m.id).first():
             db.session.add(Inventory(material_id=m.id, on_hand=0, reserved=0))
-            db.session.commit()
+        emit("material.created", m.to_dict())
+        db.session.commit()
 
         return jsonify(m.to_dict()), 201
 
@@ -141,29 +242,51 @@ def create_app():
             m.safety_stock = int(data["safety_stock"] or 0)
 
         try:
-            db.session.commit()
+            db.session.flush()
         except IntegrityError:
             db.session.rollback()
             return jsonify({"error": "物料编码已存在"}), 409
+        emit("material.updated", m.to_dict())
+        db.session.commit()
         return jsonify(m.to_dict())
 
     @app.delete("/api/materials/<int:material_id>")
     def delete_material(material_id):
         m = Material.query.get_or_404(material_id)
+        usage = where_used.usage_counts(m.id)
+        if usage["bom_items"] or usage["open_requirements"]:
+            return jsonify({"error": "物料仍被 BOM 或进行中任务引用，影响范围见 where_used", **usage}), 409
         inv = Inventory.query.filter_by(material_id=m.id).first()
         if inv:
             db.session.delete(inv)
         db.session.delete(m)
+        emit("material.deleted", {"id": material_id})
         db.session.commit()
         return "", 204
 
+    @app.get("/api/materials/<int:material_id>/where_used")
+    def material_where_used(material_id):
+        """
+        反查：用到该物料的产品/半成品（逐层向上）及受影响的进行中任务。
+        ?levels=all（默认）或 N：只向上查 N 层，1 = 直接引用它的 BOM
+        """
+        Material.query.get_or_404(material_id)
+        levels = request.args.get("levels", "all").strip()
+        if levels == "all":
+            max_levels = where_used.MAX_LEVELS
+        elif levels.isdigit() and int(levels) > 0:
+            max_levels = min(int(levels), where_used.MAX_LEVELS)
+        else:
+            return jsonify({"error": "levels 为 all 或正整数"}), 400
+        return jsonify(where_used.where_used(material_id, max_levels))
+
     # =========================
     # Phase 2: Products CRUD
     # =========================
     @app.get("/api/products")
+    @cached_get(Product)
     def list_products():
-        items = Product.query.order_by(Product.id.desc()).all()
-        return jsonify([p.to_dict() for p in items])
+        return list_response(Product.query, Product)
 
     @app.post("/api/products")
     def create_product():
@@ -180,10 +303,12 @@ def create_app():
         )
         db.session.add(p)
         try:
-            db.session.commit()
+            db.session.flush()
         except IntegrityError:
             db.session.rollback()
             return jsonify({"error": "产品编码已存在"}), 409
+        emit("product.created", p.to_dict())
+        db.session.commit()
         return jsonify(p.to_dict()), 201
 
     @app.put("/api/products/<int:product_id>")
@@ -198,10 +323,12 @@ def create_app():
             v = str(data.get("version", "")).strip()
             p.version = v or None
         try:
-            db.session.commit()
+            db.session.flush()
         except IntegrityError:
             db.session.rollback()
             return jsonify({"error": "产品编码已存在"}), 409
+        emit("product.updated", p.to_dict())
+        db.session.commit()
         return jsonify(p.to_dict())
 
     @app.delete("/api/products/<int:product_id>")
@@ -209,6 +336,7 @@ def create_app():
         p = Product.query.get_or_404(product_id)
         BOMItem.query.filter_by(product_id=p.id).delete()
         db.session.delete(p)
+        emit("product.deleted", {"id": product_id})
         db.session.commit()
         return "", 204
 
@@ -216,10 +344,41 @@ def create_app():
     # Phase 2: BOM (product bom)
     # =========================
     @app.get("/api/products/<int:product_id>/bom")
+    @cached_get(Product, BOMItem, Material)
     def get_product_bom(product_id):
         Product.query.get_or_404(product_id)
-        items = BOMItem.query.filter_by(product_id=product_id).all()
-        return jsonify([x.to_dict() for x in items])
+        items = eager_query(BOMItem).filter_by(product_id=product_id).all()
+        return jsonify(dump_list(items))
+
+    @app.get("/api/products/<int:product_id>/bom/exploded")
+    def get_product_bom_exploded(product_id):
+        """多层展开到叶子物料，?qty= 成品数量（默认 1）"""
+        Product.query.get_or_404(product_id)
+        try:
+            qty = int(request.args.get("qty", 1) or 1)
+        except ValueError:
+            return jsonify({"error": "qty 必须为整数"}), 400
+        if qty <= 0:
+            return jsonify({"error": "qty 必须 >0"}), 400
+        try:
+            flat = bom_exploder.explode(product_id)
+        except BomCycleError as e:
+            return jsonify({"error": str(e)}), 409
+
+        mats = {m.id: m for m in Material.query.filter(Material.id.in_(list(flat))).all()} if flat else {}
+        items = []
+        for mid, per_unit in flat.items():
+            m = mats.get(mid)
+            items.append({
+                "material_id": mid,
+                "material_code": m.material_code if m else None,
+                "material_name": m.material_name if m else None,
+                "unit": m.unit if m else None,
+                "qty_per_unit": per_unit,
+                "required_qty": per_unit * qty,
+            })
+        items.sort(key=lambda x: x["material_code"] or "")
+        return jsonify(items)
 
     @app.post("/api/products/<int:product_id>/bom")
     def upsert_product_bom(product_id):
@@ -237,13 +396,52 @@ def create_app():
             item.qty_per_unit = qty_per_unit
         else:
             db.session.add(BOMItem(product_id=product_id, material_id=material_id, qty_per_unit=qty_per_unit))
+        emit("bom.updated", {"product_id": product_id})
         db.session.commit()
         return jsonify({"ok": True})
 
+    @app.put("/api/products/<int:product_id>/bom")
+    @retry_on_busy
+    def replace_product_bom(product_id):
+        """
+        整张 BOM 提交：{"items": [{"material_id" 或 "material_code", "qty_per_unit"}], "dry_run": false}
+        与现有 BOM 比对，一个事务内批量增/改/删，返回 added/updated/removed/unchanged。
+        dry_run（或 ?dry_run=1）只返回差异不写库，供 ECN 评审。
+        """
+        p = Product.query.get_or_404(product_id)
+        data = request.get_json(force=True) or {}
+        if not isinstance(data, dict):
+            return jsonify({"error": "请求体必须为 JSON 对象"}), 400
+        try:
+            dry_run = bom_edit.parse_dry_run(data.get("dry_run"), request.args.get("dry_run"))
+            desired = bom_edit.parse_items(data.get("items"))
+            changes = bom_edit.diff(product_id, desired)
+            bom_edit.check_cycles(p, [r["material_id"] for r in changes["added"]])
+        except bom_edit.BomEditError as e:
+            return jsonify({"error": str(e)}), e.status
+
+        changed = changes["added"] or changes["updated"] or changes["removed"]
+        result = {"product_id": product_id, "dry_run": dry_run, **changes,
+                  "open_tasks": bom_edit.affected_open_tasks(p) if changed else 0}
+        if dry_run or not changed:
+            return jsonify(result)
+
+        try:
+            bom_edit.apply(product_id, changes)
+            emit("bom.updated", {"product_id": product_id, "added": len(changes["added"]),
+                                 "updated": len(changes["updated"]), "removed": len(changes["removed"])})
+            db.session.commit()
+        except (IntegrityError, StaleDataError):
+            # 同一产品的 BOM 正被另一个请求同时修改（重复插入 / 要改的行已被删）
+            db.session.rollback()
+            return jsonify({"error": "BOM 已被其他请求修改，请刷新后重试"}), 409
+        return jsonify(result)
+
     @app.delete("/api/bom_items/<int:item_id>")
     def delete_bom_item(item_id):
         item = BOMItem.query.get_or_404(item_id)
         db.session.delete(item)
+        emit("bom.updated", {"product_id": item.product_id})
         db.session.commit()
         return "", 204
 
@@ -252,10 +450,53 @@ def create_app():
     # =========================
     @app.get("/api/inventory")
     def list_inventory():
-        invs = Inventory.query.order_by(Inventory.id.desc()).all()
-        return jsonify([i.to_dict() for i in invs])
+        """?as_of=ISO 时间（UTC）：on_hand 返回该时刻的结存（最近快照 + 之后的流水），reserved/available 不适用"""
+        query = eager_query(Inventory).join(Material, Inventory.material_id == Material.id)
+        as_of = request.args.get("as_of", "").strip()
+        if not as_of:
+            return list_response(query, Inventory, {"material_type": Material.material_type})
+        try:
+            as_of = datetime.fromisoformat(as_of)
+        except ValueError:
+            return jsonify({"error": "as_of 必须为 ISO 日期/时间"}), 400
+
+        def at_time(rows, items):
+            snap, qty = snapshots.stock_as_of(as_of, [r.material_id for r in rows])
+            for it in items:
+                it.update(on_hand=qty[it["material_id"]], reserved=None, available=None,
+                          as_of=as_of.isoformat(), snapshot_id=snap.id if snap else None)
+            return items
+        return list_response(query, Inventory, {"material_type": Material.material_type}, transform=at_time)
+
+    @app.get("/api/inventory/snapshots")
+    def list_inventory_snapshots():
+        return list_response(InventorySnapshot.query, InventorySnapshot)
+
+    @app.post("/api/inventory/snapshots")
+    def create_inventory_snapshot():
+        """手动取快照：{"cutoff": "可选 ISO 时间（UTC）"}，默认取到当前时间前 settle 秒"""
+        data = request.get_json(force=True, silent=True) or {}
+        try:
+            cutoff = datetime.fromisoformat(str(data["cutoff"])) if data.get("cutoff") else None
+            cutoff = snapshots.check_cutoff(cutoff, app.config)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        try:
+            snap = snapshots.take_snapshot(cutoff)
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            return jsonify({"error": "该时刻的快照正在生成，请稍后重试"}), 409
+        return jsonify(snap.to_dict()), 201
+
+    @app.get("/api/inventory/reconcile")
+    def reconcile_inventory():
+        """库存对账：?full=1 从头累加全部流水，默认从最近快照开始"""
+        full = request.args.get("full", "").strip() in ("1", "true")
+        return jsonify(snapshots.reconcile(full))
 
     @app.post("/api/inventory/in")
+    @retry_on_busy
     def inventory_in():
         data = request.get_json(force=True)
         material_id = int(data.get("material_id") or 0)
@@ -263,22 +504,110 @@ def create_app():
         if material_id <= 0 or qty <= 0:
             return jsonify({"error": "material_id/qty 必填且 qty>0"}), 400
 
+        try:
+            stock.receive(material_id, qty)
+        except stock.StockError as e:
+            db.session.rollback()
+            return jsonify({"error": str(e)}), e.status
+        db.session.commit()
         inv = Inventory.query.filter_by(material_id=material_id).first()
-        if not inv:
-            return jsonify({"error": "库存行不存在"}), 404
+        return jsonify(inv.to_dict())
 
-        inv.on_hand += qty
-        db.session.add(StockMove(material_id=material_id, qty=qty, move_type="IN", ref_type="MANUAL", ref_id=None))
+    @app.post("/api/inventory/moves")
+    @retry_on_busy
+    def inventory_moves():
+        """
+        批量出入库：{"moves": [{"material_id" 或 "material_code", "move_type", "qty", "ref_id"}], "ref_type": "MANUAL"}
+        move_type：IN / OUT（qty > 0）、ADJUST（qty 为带符号差额；给 counted 时按盘点数调整）
+        全有或全无：任何一行不合法或出库后库存为负，整批不写入，返回 errors
+        """
+        data = request.get_json(force=True) or {}
+        items = data.get("moves")
+        if not isinstance(items, list) or not items:
+            return jsonify({"error": "moves 必须为非空数组"}), 400
+        if len(items) > app.config["STOCK_MOVES_BATCH_MAX"]:
+            return jsonify({"error": f"单批最多 {app.config['STOCK_MOVES_BATCH_MAX']} 条，更多请用 CSV 导入"}), 400
+        ref_type = str(data.get("ref_type") or "MANUAL").strip()[:32]
+        importer = stock_import.import_moves(items, ref_type, app.config["IMPORT_BATCH_SIZE"])
+        return _finish_stock_import(importer)
+
+    @app.post("/api/inventory/import_csv")
+    def import_inventory_csv():
+        """
+        收货 / 盘点 CSV（或 TSV）导入，表头含 物料编码、数量，可选 单号：
+        ?mode=in 收货（数量为入库数，默认）/ ?mode=count 盘点（数量为实盘数，按差额记 ADJUST）
+        multipart 上传 file 字段按行流式解析、分批写库，或 JSON {"csv": "..."}；可选 ?encoding=gbk
+        """
+        mode = request.args.get("mode", "in").strip() or "in"
+        if mode not in stock_import.CSV_MODES:
+            return jsonify({"error": f"mode 可选：{','.join(stock_import.CSV_MODES)}"}), 400
+        encoding = request.args.get("encoding", "utf-8-sig").strip() or "utf-8-sig"
+        f = request.files.get("file")
+        if f:
+            rows = iter_text_rows(f.stream, encoding)
+        else:
+            data = request.get_json(force=True, silent=True) or {}
+            text = str(data.get("csv", "")).strip()
+            if not text:
+                return jsonify({"error": "请上传 file 或提交 csv 文本"}), 400
+            rows = iter_text_rows(io.BytesIO(text.encode("utf-8")))
+        try:
+            importer = stock_import.import_csv_rows(rows, mode, app.config["IMPORT_BATCH_SIZE"])
+        except UnicodeDecodeError:
+            db.session.rollback()
+            return jsonify({"error": "文件编码错误，可通过 ?encoding=gbk 指定"}), 400
+        except (ValueError, csv.Error) as e:
+            db.session.rollback()
+            return jsonify({"error": str(e)}), 400
+        return _finish_stock_import(importer)
+
+    def _finish_stock_import(importer):
+        summary = importer.summary()
+        if importer.failed:
+            db.session.rollback()
+            return jsonify({"error": f"{importer.failed} 行有误，未写入", "errors": importer.errors, **summary}), 400
+        emit("stock.imported", summary)
         db.session.commit()
-        return jsonify(inv.to_dict())
+        return jsonify(summary)
 
     # =========================
     # Tasks + requirements (MRP-lite)
     # =========================
     @app.get("/api/tasks")
     def list_tasks():
-        tasks = Task.query.order_by(Task.id.desc()).all()
-        return jsonify([t.to_dict() for t in tasks])
+        return list_response(eager_query(Task), Task)
+
+    @app.get("/api/tasks/open")
+    def open_tasks():
+        """
+        手机报工下拉：进行中的任务，只返回单号、进度和模具/产品摘要，按 id 倒序。
+        ?operator=张三 只看某个操作工；?q=T-2026 按单号前缀过滤
+        """
+        cap = app.config["OPEN_TASKS_LIMIT"]
+        try:
+            limit = max(1, min(int(request.args.get("limit", cap) or cap), cap))
+        except ValueError:
+            return jsonify({"error": "limit 必须为整数"}), 400
+        q = (
+            select(Task.id, Task.task_no, Task.operator_name, Task.target_qty, Task.done_qty,
+                   Mold.id, Mold.mold_code, Mold.mold_name, Product.product_code, Product.product_name)
+            .join(Mold, Mold.id == Task.mold_id)
+            .outerjoin(Product, Product.id == Task.product_id)
+            .where(Task.status == "进行中")
+            .order_by(Task.id.desc())
+            .limit(limit)
+        )
+        operator = request.args.get("operator", "").strip()
+        if operator:
+            q = q.where(Task.operator_name == operator)
+        prefix = request.args.get("q", "").strip()
+        if prefix:
+            q = q.where(Task.task_no >= prefix, Task.task_no < prefix + "\U0010ffff")
+        return jsonify([{
+            "id": tid, "task_no": no, "operator_name": op, "target_qty": target, "done_qty": done,
+            "mold_id": mid, "mold_code": mcode, "mold_name": mname,
+            "product_code": pcode, "product_name": pname,
+        } for tid, no, op, target, done, mid, mcode, mname, pcode, pname in db.session.execute(q)])
 
     @app.post("/api/tasks")
     def create_task():
@@ -291,16 +620,37 @@ def create_app():
         product_id = data.get("product_id")
         product_id = int(product_id) if product_id else None
 
-        if not task_no or mold_id <= 0 or not operator_name or target_qty <= 0:
-            return jsonify({"error": "task_no/mold_id/operator_name 必填且 target_qty>0"}), 400
+        try:
+            due_date = scheduler.parse_due(data.get("due_date"))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+        if mold_id <= 0 or not operator_name or target_qty <= 0:
+            return jsonify({"error": "mold_id/operator_name 必填且 target_qty>0"}), 400
 
         mold = Mold.query.get(mold_id)
         if not mold:
             return jsonify({"error": "模具不存在"}), 404
+        if mold.status == "维修":
+            return jsonify({"error": "模具维修中，不能派工"}), 409
 
         if product_id is not None and not Product.query.get(product_id):
             return jsonify({"error": "产品不存在"}), 404
 
+        # 绑定产品：按多层 BOM 展开到叶子物料生成需求
+        flat = {}
+        if product_id is not None:
+            try:
+                flat = bom_exploder.explode(product_id)
+            except BomCycleError as e:
+                return jsonify({"error": str(e)}), 409
+
+        # 不填单号则自动分配；手填的符合自动格式时推进计数器，避免之后撞号
+        if task_no:
+            task_numbers.observe(task_no)
+        else:
+            task_no = task_numbers.allocate()
+
         t = Task(
             task_no=task_no,
             mold_id=mold_id,
@@ -309,39 +659,85 @@ def create_app():
             target_qty=target_qty,
             done_qty=0,
             status="进行中",
+            due_date=due_date,
         )
         db.session.add(t)
         mold.status = "使用中"
 
         try:
-            db.session.commit()
+            db.session.flush()
         except IntegrityError:
             db.session.rollback()
             return jsonify({"error": "任务单号已存在"}), 409
 
-        # 绑定产品：按 BOM 自动生成需求
-        if t.product_id:
-            bom = BOMItem.query.filter_by(product_id=t.product_id).all()
-            for bi in bom:
-                required = bi.qty_per_unit * t.target_qty
-                exist = TaskMaterialRequirement.query.filter_by(task_id=t.id, material_id=bi.material_id).first()
-                if exist:
-                    exist.required_qty = required
-                else:
-                    db.session.add(TaskMaterialRequirement(
-                        task_id=t.id, material_id=bi.material_id, required_qty=required, issued_qty=0
-                    ))
-            db.session.commit()
+        rollups.bump_task_status({t.status: 1})
+        emit("task.created", task_payload(t))
+        emit("mold.updated", mold.to_dict())
+        if flat:
+            db.session.execute(insert(TaskMaterialRequirement), [
+                {"task_id": t.id, "material_id": mid, "required_qty": per_unit * target_qty, "issued_qty": 0}
+                for mid, per_unit in flat.items()
+            ])
+        db.session.commit()
 
         return jsonify(t.to_dict()), 201
 
+    @app.get("/api/tasks/by_no/<task_no>/summary")
+    def task_summary_by_no(task_no):
+        """
+        手机扫码/选单后的确认信息：任务进度、模具剩余寿命、产品、本任务缺料。
+        任务 + 模具 + 产品 + 未发完的用料需求 + 库存一次 JOIN 查出，每行一个需求物料。
+        缺料 = 未发数量 - (在库 - 预留) 大于 0 的物料
+        """
+        req = TaskMaterialRequirement
+        outstanding = req.required_qty - req.issued_qty
+        rows = db.session.execute(
+            select(
+                Task.id, Task.task_no, Task.status, Task.operator_name, Task.target_qty, Task.done_qty,
+                Mold.id, Mold.mold_code, Mold.mold_name, Mold.status, Mold.total_life, Mold.used_count,
+                Product.product_code, Product.product_name,
+                Material.material_code, Material.material_name, Material.unit, outstanding,
+                Inventory.on_hand - Inventory.reserved,
+            )
+            .join(Mold, Mold.id == Task.mold_id)
+            .outerjoin(Product, Product.id == Task.product_id)
+            .outerjoin(req, and_(req.task_id == Task.id, req.required_qty > req.issued_qty))
+            .outerjoin(Material, Material.id == req.material_id)
+            .outerjoin(Inventory, Inventory.material_id == req.material_id)
+            .where(Task.task_no == task_no)
+        ).all()
+        if not rows:
+            return jsonify({"error": "任务单号不存在"}), 404
+
+        (tid, no, status, operator, target, done, mid, mcode, mname, mstatus, life, used,
+         pcode, pname) = rows[0][:14]
+        shortages = []
+        for code, name, unit, need, available in (r[14:] for r in rows):
+            if code is None:
+                continue
+            available = available or 0
+            if need > available:
+                shortages.append({"material_code": code, "material_name": name, "unit": unit,
+                                  "outstanding_qty": need, "available": available,
+                                  "shortage_qty": need - available})
+        return jsonify({
+            "id": tid, "task_no": no, "status": status, "operator_name": operator,
+            "target_qty": target, "done_qty": done, "remaining_qty": max(target - done, 0),
+            "mold": {"id": mid, "code": mcode, "name": mname, "status": mstatus,
+                     "total_life": life, "used_count": used,
+                     "remaining_life": max(life - used, 0) if life > 0 else None},
+            "product": {"code": pcode, "name": pname} if pcode else None,
+            "shortages": sorted(shortages, key=lambda x: -x["shortage_qty"]),
+        })
+
     @app.get("/api/tasks/<int:task_id>/materials")
     def task_materials(task_id):
         Task.query.get_or_404(task_id)
-        items = TaskMaterialRequirement.query.filter_by(task_id=task_id).all()
-        return jsonify([x.to_dict() for x in items])
+        items = eager_query(TaskMaterialRequirement).filter_by(task_id=task_id).all()
+        return jsonify(dump_list(items))
 
     @app.post("/api/tasks/<int:task_id>/issue")
+    @retry_on_busy
     def issue_to_task(task_id):
         data = request.get_json(force=True)
         material_id = int(data.get("material_id") or 0)
@@ -350,20 +746,15 @@ def create_app():
             return jsonify({"error": "material_id/qty 必填且 qty>0"}), 400
 
         t = Task.query.get_or_404(task_id)
-        inv = Inventory.query.filter_by(material_id=material_id).first()
-        if not inv:
-            return jsonify({"error": "库存行不存在"}), 404
-        if inv.on_hand < qty:
-            return jsonify({"error": "库存不足"}), 400
+        try:
+            stock.issue_to_task(t, material_id, qty)
+        except stock.StockError as e:
+            db.session.rollback()
+            return jsonify({"error": str(e)}), e.status
+        db.session.commit()
 
+        inv = Inventory.query.filter_by(material_id=material_id).first()
         req = TaskMaterialRequirement.query.filter_by(task_id=t.id, material_id=material_id).first()
-        if not req:
-            return jsonify({"error": "该任务未生成此物料需求"}), 400
-
-        inv.on_hand -= qty
-        req.issued_qty += qty
-        db.session.add(StockMove(material_id=material_id, qty=-qty, move_type="OUT", ref_type="TASK", ref_id=t.task_no))
-        db.session.commit()
         return jsonify({"inventory": inv.to_dict(), "requirement": req.to_dict()})
     
     @app.delete("/api/tasks/<int:task_id>")
@@ -374,17 +765,65 @@ def create_app():
             mold = Mold.query.get(task.mold_id)
             if mold and mold.status == "使用中":
                 mold.status = "空闲"
+                emit("mold.updated", mold.to_dict())
         # 删除关联的用料需求（如果有外键级联可省略）
         TaskMaterialRequirement.query.filter_by(task_id=task.id).delete()
+        rollups.bump_task_status({task.status: -1})
+        emit("task.deleted", {"id": task_id, "task_no": task.task_no})
         db.session.delete(task)
         db.session.commit()
         return "", 204
 
 
+    @app.get("/api/schedule")
+    def schedule():
+        """
+        进行中任务的排产建议（不写库）：?objective=makespan|tardiness，?reassign=0 不换模具
+        """
+        objective = request.args.get("objective", "makespan").strip()
+        reassign = request.args.get("reassign", "1").strip() not in ("0", "false")
+        try:
+            return jsonify(scheduler.plan(scheduler.load_state(), objective, reassign))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    @app.post("/api/schedule/what_if")
+    def schedule_what_if():
+        """
+        假设分析，只在内存里改输入再排一次，不写库：
+        {"objective": "tardiness", "reassign": true,
+         "molds": {"3": {"status": "维修"}}, "due_dates": {"T-...": "2026-03-01T18:00"},
+         "exclude": ["T-..."], "tasks": [{"mold_id": 1, "product_id": 2, "qty": 500, "due_date": "..."}]}
+        返回 {"plan": 假设后的排产, "baseline": 当前排产的汇总指标}
+        """
+        data = request.get_json(force=True) or {}
+        if not isinstance(data, dict):
+            return jsonify({"error": "请求体必须为 JSON 对象"}), 400
+        objective = str(data.get("objective", "makespan"))
+        reassign = bool(data.get("reassign", True))
+        try:
+            state = scheduler.load_state()
+            baseline = scheduler.plan(state, objective, reassign)
+            result = scheduler.plan(scheduler.apply_overrides(copy.deepcopy(state), data), objective, reassign)
+        except (TypeError, ValueError) as e:
+            return jsonify({"error": str(e)}), 400
+        keys = ("makespan_hours", "finish_at", "total_tardiness_hours", "late_tasks", "moved_tasks")
+        return jsonify({
+            "plan": result,
+            "baseline": {k: baseline[k] for k in keys} | {"unscheduled": len(baseline["unscheduled"])},
+        })
+
+    @app.get("/api/mrp/run")
+    def mrp_run():
+        """汇总所有进行中任务的缺料与采购建议；?all=1 同时返回不缺料的物料"""
+        include_all = request.args.get("all", "").strip() in ("1", "true")
+        return jsonify(run_mrp(include_all))
+
     # =========================
     # Phase 1: Mobile report
     # =========================
     @app.post("/api/report")
+    @retry_on_busy
     def report_work():
         data = request.get_json(force=True)
         task_no = str(data.get("task_no", "")).strip()
@@ -396,22 +835,67 @@ def create_app():
         if not t:
             return jsonify({"error": "任务单号不存在"}), 404
 
-        mold = Mold.query.get(t.mold_id)
-        if not mold:
+        if not Mold.query.get(t.mold_id):
             return jsonify({"error": "关联模具不存在"}), 500
 
-        t.done_qty += qty
-        mold.used_count += qty
-
-        if t.done_qty >= t.target_qty:
-            t.done_qty = min(t.done_qty, t.target_qty)
-            t.status = "已完成"
-            mold.status = "空闲"
-
-        db.session.add(Report(task_id=t.id, qty=qty))
+        t, mold = apply_report(t, qty)
         db.session.commit()
         return jsonify({"task": t.to_dict(), "mold": mold.to_dict()}), 201
 
+    @app.post("/api/reports/batch")
+    @retry_on_busy
+    def report_batch():
+        """
+        离线终端批量补报，一个事务内入账：
+        {"reports": [{"key": "终端生成的唯一键", "task_no": "...", "qty": 10, "reported_at": "可选 ISO 时间"}]}
+        每条返回 status = ok / duplicate / error
+        """
+        data = request.get_json(force=True)
+        items = data.get("reports") if isinstance(data, dict) else data
+        if not isinstance(items, list) or not items:
+            return jsonify({"error": "reports 必须为非空数组"}), 400
+        if len(items) > app.config["REPORT_BATCH_MAX"]:
+            return jsonify({"error": f"单批最多 {app.config['REPORT_BATCH_MAX']} 条"}), 400
+
+        try:
+            results = ingest_report_batch(items)
+            db.session.commit()
+        except IntegrityError:
+            # 并发提交了相同的 key：回滚后重跑一次，已入账的会识别为 duplicate
+            db.session.rollback()
+            results = ingest_report_batch(items)
+            db.session.commit()
+
+        summary = {s: sum(1 for r in results if r["status"] == s) for s in ("ok", "duplicate", "error")}
+        return jsonify({"results": results, **summary})
+
+    # =========================
+    # 生产看板（读汇总表，见 rollups.py）
+    # =========================
+    @app.get("/api/dashboard")
+    def dashboard():
+        """
+        ?from=YYYY-MM-DD&to=YYYY-MM-DD（生产日，默认最近 7 天）
+        产量按 日/班次/操作员/模具，出入库按日，任务完成率，模具剩余寿命，低于安全库存的物料
+        """
+        try:
+            day_from, day_to = rollups.parse_range(request.args)
+        except ValueError:
+            return jsonify({"error": "from/to 格式应为 YYYY-MM-DD，且 from 不晚于 to"}), 400
+        return jsonify(rollups.dashboard(day_from, day_to))
+
+    @app.get("/api/dashboard/production")
+    def dashboard_production():
+        """产量明细：?group_by=day,shift,operator,mold 任意组合（默认 day），from/to 同 /api/dashboard"""
+        group_by = [g.strip() for g in request.args.get("group_by", "day").split(",") if g.strip()]
+        if not group_by or any(g not in rollups.DIMENSIONS for g in group_by):
+            return jsonify({"error": f"group_by 可选：{','.join(rollups.DIMENSIONS)}"}), 400
+        try:
+            day_from, day_to = rollups.parse_range(request.args)
+        except ValueError:
+            return jsonify({"error": "from/to 格式应为 YYYY-MM-DD，且 from 不晚于 to"}), 400
+        return jsonify(rollups.production(day_from, day_to, tuple(dict.fromkeys(group_by))))
+
     # =========================
     # Tree BOM Import (TSV)
     # =========================
@@ -424,113 +908,92 @@ def create_app():
         层级：0 / .1 / ..2 / ...3 通过前导 '.' 个数确定 depth
         规则：每一行会 upsert Material；并将每个节点也 upsert 为 Product（用于展开）
              BOM：父节点(Product) -> 子节点(Material)，qty_per_unit=数量
+        整个导入在一个事务内按批批量写入，见 bom_import.BomTreeImporter
         """
         data = request.get_json(force=True)
         tsv = str(data.get("tsv", "")).strip()
         if not tsv:
             return jsonify({"error": "tsv 不能为空"}), 400
 
-        lines = [ln for ln in tsv.splitlines() if ln.strip()]
-        if len(lines) < 2:
-            return jsonify({"error": "至少包含表头+1行数据"}), 400
-
-        header = [h.strip() for h in lines[0].split("\t")]
-        expected = ["层级", "物料编码", "名称", "图号", "数量", "单位", "类型", "备注"]
-        if header[:8] != expected:
-            return jsonify({"error": f"表头必须为：{expected}"}), 400
-
-        created_bom, updated_bom, skipped = 0, 0, 0
-        stack = {}  # depth -> Product
-
-        for ln in lines[1:]:
-            cols = [c.strip() for c in ln.split("\t")]
-            if len(cols) < 8:
-                skipped += 1
-                continue
-
-            level_str, code, name, drawing_no, qty_str, unit, typ, remark = cols[:8]
-            if not code or not name:
-                skipped += 1
-                continue
-
-            # depth = leading '.' count
-            depth = 0
-            for ch in level_str:
-                if ch == ".":
-                    depth += 1
-                else:
-                    break
-
-            try:
-                qty = int(float(qty_str))
-            except:
-                skipped += 1
-                continue
-            if qty <= 0:
-                skipped += 1
-                continue
-
-            # upsert material
-            m = Material.query.filter_by(material_code=code).first()
-            if not m:
-                m = Material(
-                    material_code=code,
-                    material_name=name,
-                    drawing_no=drawing_no or None,
-                    material_type=typ or None,
-                    remark=remark or None,
-                    unit=unit or "pcs",
-                    safety_stock=0
-                )
-                db.session.add(m)
-                db.session.flush()
-                # create inventory row
-                if not Inventory.query.filter_by(material_id=m.id).first():
-                    db.session.add(Inventory(material_id=m.id, on_hand=0, reserved=0))
-            else:
-                m.material_name = name
-                m.drawing_no = drawing_no or None
-                m.material_type = typ or None
-                m.remark = remark or None
-                m.unit = unit or m.unit
-
-            # upsert product node (every node to allow expansion)
-            p = Product.query.filter_by(product_code=code).first()
-            if not p:
-                p = Product(product_code=code, product_name=name, version=None)
-                db.session.add(p)
-                db.session.flush()
-            else:
-                p.product_name = name
-
-            if depth == 0:
-                stack[0] = p
-                # clear deeper
-                for k in list(stack.keys()):
-                    if k > 0:
-                        del stack[k]
-                continue
+        try:
+            importer = import_rows((ln.split("\t") for ln in tsv.splitlines()),
+                                   app.config["IMPORT_BATCH_SIZE"])
+        except ValueError as e:
+            db.session.rollback()
+            return jsonify({"error": str(e)}), 400
+        emit("bom.imported", importer.summary())
+        db.session.commit()
+        return jsonify(importer.summary())
 
-            parent = stack.get(depth - 1)
-            if not parent:
-                skipped += 1
-                continue
+    @app.post("/api/bom/import_csv")
+    def import_bom_csv():
+        """
+        树形 BOM 文件导入（CSV 或 TSV，表头同 import_tree）：
+        - multipart/form-data 上传 file 字段，按行流式解析、分批写库
+        - 或 JSON {"csv": "..."} 直接提交文本
+        可选 ?encoding=gbk 指定文件编码，默认 UTF-8（兼容 BOM 头）
+        """
+        encoding = request.args.get("encoding", "utf-8-sig").strip() or "utf-8-sig"
+        f = request.files.get("file")
+        if f:
+            rows = iter_text_rows(f.stream, encoding)
+        else:
+            data = request.get_json(force=True, silent=True) or {}
+            text = str(data.get("csv", "")).strip()
+            if not text:
+                return jsonify({"error": "请上传 file 或提交 csv 文本"}), 400
+            rows = iter_text_rows(io.BytesIO(text.encode("utf-8")))
+        return _run_file_import(rows)
+
+    @app.post("/api/bom/import_xlsx")
+    def import_bom_xlsx():
+        """树形 BOM Excel 导入：multipart 上传 file 字段，读取第一个工作表"""
+        f = request.files.get("file")
+        if not f:
+            return jsonify({"error": "请上传 file"}), 400
+        return _run_file_import(iter_xlsx_rows(f.stream))
+
+    def _run_file_import(rows):
+        try:
+            importer = import_rows(rows, app.config["IMPORT_BATCH_SIZE"])
+        except UnicodeDecodeError:
+            db.session.rollback()
+            return jsonify({"error": "文件编码错误，可通过 ?encoding=gbk 指定"}), 400
+        except (ValueError, csv.Error) as e:
+            db.session.rollback()
+            return jsonify({"error": str(e)}), 400
+        emit("bom.imported", importer.summary())
+        db.session.commit()
+        return jsonify(importer.summary())
 
-            item = BOMItem.query.filter_by(product_id=parent.id, material_id=m.id).first()
-            if item:
-                item.qty_per_unit = qty
-                updated_bom += 1
+    # =========================
+    # 后台导入任务（大文件不占用请求线程）
+    # =========================
+    @app.post("/api/jobs/bom_import")
+    def submit_bom_import_job():
+        """
+        提交树形 BOM 导入任务，立即返回 202 + 任务信息，之后轮询 GET /api/jobs/<id>
+        - multipart 上传 file 字段（.csv / .tsv / .txt / .xlsx），可选 ?encoding=gbk
+        - 或 JSON {"tsv": "..."}
+        """
+        f = request.files.get("file")
+        try:
+            if f:
+                encoding = request.args.get("encoding", "utf-8-sig").strip() or "utf-8-sig"
+                job = job_queue.submit_file(f, f.filename, encoding)
             else:
-                db.session.add(BOMItem(product_id=parent.id, material_id=m.id, qty_per_unit=qty))
-                created_bom += 1
-
-            stack[depth] = p
-            for k in list(stack.keys()):
-                if k > depth:
-                    del stack[k]
-
-        db.session.commit()
-        return jsonify({"bom_created": created_bom, "bom_updated": updated_bom, "skipped": skipped})
+                data = request.get_json(force=True, silent=True) or {}
+                tsv = str(data.get("tsv", "")).strip()
+                if not tsv:
+                    return jsonify({"error": "请上传 file 或提交 tsv 文本"}), 400
+                job = job_queue.submit_text(tsv)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        return jsonify(job.to_dict()), 202
+
+    @app.get("/api/jobs/<int:job_id>")
+    def get_job(job_id):
+        return jsonify(ImportJob.query.get_or_404(job_id).to_dict())
 
     return app
 
@@ -539,4 +1002,5 @@ if __name__ == "__main__":
     app = create_app()
     with app.app_context():
         db.create_all()
+        migrations.upgrade(db.engine)
     app.run(host="0.0.0.0", port=5001, debug=True)
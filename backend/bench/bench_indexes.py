@@ -0,0 +1,206 @@
+"""
+索引迁移前后对比：造一个大库（去掉迁移建的索引），跑热点查询记录查询计划和耗时，
+执行 migrations.upgrade 后再跑一遍。
+
+    cd backend && python bench/bench_indexes.py --tasks 50000 --moves 500000
+    python bench/bench_indexes.py --json result.json
+
+只支持 SQLite（查询计划用 EXPLAIN QUERY PLAN）。
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 只建索引的迁移版本，对比前先把它们建的索引删掉
+INDEX_MIGRATIONS = (1, 2)
+
+# 热点查询：名称 -> (SQL, 参数生成)
+QUERIES = {
+    "reports by task": (
+        "SELECT * FROM reports WHERE task_id = :tid ORDER BY created_at DESC",
+        lambda s: {"tid": random.randint(1, s["tasks"])},
+    ),
+    "stock_moves by material + date range": (
+        "SELECT * FROM stock_moves WHERE material_id = :mid AND created_at >= :since",
+        lambda s: {"mid": random.randint(1, s["materials"]), "since": s["t0"] + timedelta(days=300)},
+    ),
+    "stock_moves by task ref": (
+        "SELECT * FROM stock_moves WHERE ref_type = 'TASK' AND ref_id = :ref",
+        lambda s: {"ref": f"T{random.randint(1, s['tasks'])}"},
+    ),
+    "stock_moves by date range": (
+        "SELECT count(*), sum(qty) FROM stock_moves WHERE created_at >= :since AND created_at < :until",
+        lambda s: {"since": s["t0"] + timedelta(days=100), "until": s["t0"] + timedelta(days=101)},
+    ),
+    "requirements by task": (
+        "SELECT * FROM task_material_requirements WHERE task_id = :tid",
+        lambda s: {"tid": random.randint(1, s["tasks"])},
+    ),
+    "requirements by material": (
+        "SELECT task_id, required_qty - issued_qty FROM task_material_requirements WHERE material_id = :mid",
+        lambda s: {"mid": random.randint(1, s["materials"])},
+    ),
+    "open tasks page": (
+        "SELECT * FROM tasks WHERE status = '进行中' ORDER BY id DESC LIMIT 200",
+        lambda s: {},
+    ),
+    "tasks by mold": (
+        "SELECT * FROM tasks WHERE mold_id = :mold ORDER BY id DESC LIMIT 200",
+        lambda s: {"mold": random.randint(1, s["molds"])},
+    ),
+    "tasks created in a day": (
+        "SELECT * FROM tasks WHERE created_at >= :since AND created_at < :until",
+        lambda s: {"since": s["t0"] + timedelta(days=200), "until": s["t0"] + timedelta(days=201)},
+    ),
+    "bom where-used": (
+        "SELECT product_id FROM bom_items WHERE material_id = :mid",
+        lambda s: {"mid": random.randint(1, s["materials"])},
+    ),
+}
+
+
+def seed(engine, scale):
+    from sqlalchemy import insert
+    from models import Mold, Material, Inventory, Product, BOMItem, Task, TaskMaterialRequirement, Report, StockMove
+
+    t0 = datetime(2025, 1, 1)
+    span = 365 * 24 * 3600
+
+    def at(i, n):
+        return t0 + timedelta(seconds=span * i // n)
+
+    with engine.begin() as conn:
+        conn.execute(insert(Mold), [{"mold_code": f"M{i}", "mold_name": "模具", "total_life": 100000,
+                                     "used_count": 0, "status": "空闲", "created_at": t0}
+                                    for i in range(1, scale["molds"] + 1)])
+        conn.execute(insert(Material), [{"material_code": f"X{i}", "material_name": "物料", "unit": "pcs",
+                                         "safety_stock": 0, "material_type": random.choice(["自制", "外购", "标准件"])}
+                                        for i in range(1, scale["materials"] + 1)])
+        conn.execute(insert(Inventory), [{"material_id": i, "on_hand": 1000, "reserved": 0}
+                                         for i in range(1, scale["materials"] + 1)])
+        conn.execute(insert(Product), [{"product_code": f"P{i}", "product_name": "产品"}
+                                       for i in range(1, scale["products"] + 1)])
+        bom = set()
+        while len(bom) < scale["products"] * 20:
+            bom.add((random.randint(1, scale["products"]), random.randint(1, scale["materials"])))
+        conn.execute(insert(BOMItem), [{"product_id": p, "material_id": m, "qty_per_unit": 2} for p, m in bom])
+
+        n = scale["tasks"]
+        conn.execute(insert(Task), [{
+            "task_no": f"T{i}", "mold_id": random.randint(1, scale["molds"]),
+            "product_id": random.randint(1, scale["products"]), "operator_name": f"op{i % 50}",
+            "target_qty": 1000, "done_qty": 0, "status": "进行中" if i > n * 0.95 else "已完成",
+            "created_at": at(i, n),
+        } for i in range(1, n + 1)])
+        conn.execute(insert(TaskMaterialRequirement), [
+            {"task_id": t, "material_id": m, "required_qty": 100, "issued_qty": 50}
+            for t in range(1, n + 1) for m in random.sample(range(1, scale["materials"] + 1), 10)
+        ])
+        r = scale["reports"]
+        conn.execute(insert(Report), [{"task_id": random.randint(1, n), "qty": 10, "created_at": at(i, r)}
+                                      for i in range(r)])
+        mv = scale["moves"]
+        conn.execute(insert(StockMove), [{
+            "material_id": random.randint(1, scale["materials"]), "qty": random.choice([50, -10]),
+            "move_type": "OUT", "ref_type": "TASK", "ref_id": f"T{random.randint(1, n)}", "created_at": at(i, mv),
+        } for i in range(mv)])
+    scale["t0"] = t0
+
+
+def drop_migrated_indexes(engine):
+    from sqlalchemy import text
+    import migrations
+
+    names = []
+    for version, _, fn in migrations.MIGRATIONS:
+        if version not in INDEX_MIGRATIONS:
+            continue
+        class Capture:
+            def execute(self, stmt):
+                sql = str(stmt)
+                if sql.startswith("CREATE INDEX IF NOT EXISTS "):
+                    names.append(sql.split()[5])
+        fn(Capture())
+    with engine.begin() as conn:
+        for name in names:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        conn.execute(text("DELETE FROM schema_migrations"))
+        conn.execute(text("ANALYZE"))
+
+
+def run_queries(engine, scale, repeat):
+    from sqlalchemy import text
+
+    out = {}
+    with engine.connect() as conn:
+        for name, (sql, params) in QUERIES.items():
+            plan = [r[-1] for r in conn.execute(text("EXPLAIN QUERY PLAN " + sql), params(scale))]
+            times = []
+            for _ in range(repeat):
+                p = params(scale)
+                t = time.perf_counter()
+                conn.execute(text(sql), p).fetchall()
+                times.append((time.perf_counter() - t) * 1000)
+            times.sort()
+            out[name] = {"plan": plan, "median_ms": round(times[len(times) // 2], 3), "max_ms": round(times[-1], 3)}
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--molds", type=int, default=200)
+    ap.add_argument("--materials", type=int, default=20000)
+    ap.add_argument("--products", type=int, default=2000)
+    ap.add_argument("--tasks", type=int, default=50000)
+    ap.add_argument("--reports", type=int, default=500000)
+    ap.add_argument("--moves", type=int, default=500000)
+    ap.add_argument("--repeat", type=int, default=20)
+    ap.add_argument("--seed", type=int, default=42)
+    ap.add_argument("--json", help="结果写入 JSON 文件")
+    args = ap.parse_args()
+    random.seed(args.seed)
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix="mes-bench-"), "bench.sqlite3")
+    os.environ["MES_DATABASE_URL"] = "sqlite:///" + db_path
+    from db_init import create_app
+    from models import db
+    import migrations
+
+    scale = {k: getattr(args, k) for k in ("molds", "materials", "products", "tasks", "reports", "moves")}
+    app = create_app()
+    with app.app_context():
+        engine = db.engine
+        db.create_all()
+        t = time.perf_counter()
+        seed(engine, scale)
+        print(f"seeded {scale} in {time.perf_counter() - t:.1f}s -> {db_path}")
+        drop_migrated_indexes(engine)
+
+        before = run_queries(engine, scale, args.repeat)
+        t = time.perf_counter()
+        applied = migrations.upgrade(engine)
+        print(f"migrations {applied} applied in {time.perf_counter() - t:.1f}s")
+        after = run_queries(engine, scale, args.repeat)
+
+    print(f"\n{'query':<40}{'before ms':>12}{'after ms':>12}{'speedup':>10}")
+    for name in QUERIES:
+        b, a = before[name]["median_ms"], after[name]["median_ms"]
+        print(f"{name:<40}{b:>12.3f}{a:>12.3f}{(b / a if a else float('inf')):>9.1f}x")
+        print(f"    before: {' | '.join(before[name]['plan'])}")
+        print(f"    after:  {' | '.join(after[name]['plan'])}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"scale": scale | {"t0": scale["t0"].isoformat()}, "before": before, "after": after},
+                      f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
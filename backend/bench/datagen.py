@@ -0,0 +1,257 @@
+"""
+可复现的工厂模拟数据：同一个 --seed 和规模生成完全相同的数据。
+
+  - 多层 BOM 树：按 bom_import 的 TSV 格式（层级 0 / .1 / ..2）生成，走导入引擎落库；
+    子装配件在多个产品间共用，第一次出现时展开整棵子树，之后只写一行引用
+  - 模具、任务（按 BOM 展开生成用料需求）、报工、出入库流水，时间分布在最近 --days 天，
+    任务完成数 / 模具次数 / 库存 与 报工、流水合计一致，看板汇总表由 rollups.rebuild 回填
+
+    cd backend && python bench/datagen.py --scale medium --db /tmp/plant.sqlite3
+    python bench/datagen.py --scale small --tsv bom.tsv          # 只输出 BOM 树 TSV
+    python bench/datagen.py --scale large --tasks 100000 --db x.sqlite3
+
+run_bench.py 用同一个生成器造库后跑场景。
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# 规模预设，命令行同名参数可单独覆盖
+#   products    顶层产品数           assemblies  每层子装配件池大小
+#   depth       BOM 层数（不含顶层） fanout      每个装配件的子项数
+#   materials   叶子物料（外购/标准件）数
+SCALES = {
+    "small": {"molds": 20, "materials": 500, "products": 20, "assemblies": 40, "depth": 3, "fanout": 5,
+              "tasks": 500, "reports": 5000, "moves": 10000, "days": 30},
+    "medium": {"molds": 200, "materials": 5000, "products": 200, "assemblies": 400, "depth": 4, "fanout": 6,
+               "tasks": 5000, "reports": 100000, "moves": 100000, "days": 180},
+    "large": {"molds": 1000, "materials": 20000, "products": 1000, "assemblies": 2000, "depth": 5, "fanout": 8,
+              "tasks": 50000, "reports": 1000000, "moves": 1000000, "days": 365},
+}
+
+OPERATORS = 50
+# 进行中任务的目标数：足够大，压测报工不会把任务做完
+OPEN_TARGET = 10 ** 9
+LEAF_TYPES = ("外购", "标准件")
+UNITS = ("pcs", "pcs", "pcs", "kg", "m", "套")
+
+
+def scale_from(args):
+    """--scale 预设 + 命令行覆盖项"""
+    scale = dict(SCALES[args.scale])
+    for k in scale:
+        v = getattr(args, k, None)
+        if v is not None:
+            scale[k] = v
+    return scale
+
+
+def add_scale_args(ap):
+    ap.add_argument("--scale", choices=SCALES, default="small")
+    for k in SCALES["small"]:
+        ap.add_argument("--" + k, type=int, help=f"覆盖预设的 {k}")
+    ap.add_argument("--seed", type=int, default=42)
+
+
+# ---------- BOM 树 ----------
+
+def bom_tree_tsv(rng, scale, prefix="B"):
+    """
+    生成 TSV 文本（含表头），顶层产品 {prefix}P00001...，第 k 层装配件 {prefix}A{k}-0001...，
+    叶子物料 {prefix}X000001...。装配件只引用下一层的装配件或叶子物料，不会成环。
+    """
+    depth, fanout = scale["depth"], scale["fanout"]
+    n_asm, n_mat = scale["assemblies"], scale["materials"]
+    lines = ["\t".join(["层级", "物料编码", "名称", "图号", "数量", "单位", "类型", "备注"])]
+    expanded = set()
+
+    def leaf(level):
+        i = rng.randint(1, n_mat)
+        lines.append("\t".join([
+            "." * level + str(level), f"{prefix}X{i:06d}", f"物料{i}", f"DWG-X{i}",
+            str(rng.choice((1, 1, 2, 4, 8))), UNITS[i % len(UNITS)], LEAF_TYPES[i % 2], "",
+        ]))
+
+    def assembly(level, code, name, qty):
+        lines.append("\t".join(["." * level + str(level), code, name, f"DWG-{code}", str(qty), "pcs", "自制", ""]))
+        if code in expanded:
+            return
+        expanded.add(code)
+        for _ in range(fanout):
+            # 末层只挂叶子；其余约三分之一为下一层装配件
+            if level + 1 < depth and rng.random() < 1 / 3:
+                j = rng.randint(1, n_asm)
+                assembly(level + 1, f"{prefix}A{level + 1}-{j:04d}", f"装配件{level + 1}-{j}", rng.randint(1, 3))
+            else:
+                leaf(level + 1)
+
+    for i in range(1, scale["products"] + 1):
+        assembly(0, f"{prefix}P{i:05d}", f"产品{i}", 1)
+    return "\n".join(lines) + "\n"
+
+
+# ---------- 落库 ----------
+
+def seed(app, scale, seed_value=42, log=print):
+    """在 app 的库里生成全部数据并提交；返回场景要用的 id 信息"""
+    from sqlalchemy import select, insert, update, func
+    from bom_explode import bom_exploder
+    from bom_import import import_rows
+    from dbutil import chunks
+    from models import db, Mold, Material, Inventory, Product, Task, TaskMaterialRequirement, Report, StockMove
+    import rollups
+
+    rng = random.Random(seed_value)
+    now = datetime.utcnow().replace(microsecond=0)
+    t0 = now - timedelta(days=scale["days"])
+    span = int((now - t0).total_seconds())
+
+    def at():
+        return t0 + timedelta(seconds=rng.randrange(span))
+
+    with app.app_context():
+        t = time.perf_counter()
+        tsv = bom_tree_tsv(rng, scale)
+        importer = import_rows((ln.split("\t") for ln in tsv.splitlines()), app.config["IMPORT_BATCH_SIZE"])
+        db.session.commit()
+        log(f"  bom: {importer.rows} rows ({time.perf_counter() - t:.1f}s)")
+
+        t = time.perf_counter()
+        db.session.execute(insert(Mold), [{
+            "mold_code": f"BM{i:04d}", "mold_name": f"模具{i}", "total_life": 10 ** 9,
+            "used_count": 0, "status": "空闲", "created_at": t0,
+        } for i in range(1, scale["molds"] + 1)])
+        mold_ids = db.session.scalars(select(Mold.id).order_by(Mold.id)).all()
+        product_ids = db.session.scalars(
+            select(Product.id).where(Product.product_code.like("BP%")).order_by(Product.id)
+        ).all()
+
+        # 任务：约 10% 进行中，其余按报工合计定完成数
+        n = scale["tasks"]
+        tasks = []
+        for i in range(1, n + 1):
+            tasks.append({
+                "task_no": f"BT{i:07d}", "mold_id": rng.choice(mold_ids), "product_id": rng.choice(product_ids),
+                "operator_name": f"操作员{rng.randrange(OPERATORS):02d}", "done_qty": 0,
+                "open": i > n * 0.9, "created_at": t0 + timedelta(seconds=span * (i - 1) // n),
+            })
+        reports = []
+        for _ in range(scale["reports"]):
+            k = rng.randrange(n)
+            qty = rng.randint(1, 50)
+            tasks[k]["done_qty"] += qty
+            reports.append({"task_id": k + 1, "qty": qty, "created_at": max(at(), tasks[k]["created_at"])})
+        used, busy = dict.fromkeys(mold_ids, 0), set()
+        for tk in tasks:
+            tk["target_qty"] = OPEN_TARGET if tk.pop("open") else max(tk["done_qty"], 1)
+            tk["status"] = "已完成" if tk["done_qty"] >= tk["target_qty"] else "进行中"
+            used[tk["mold_id"]] += tk["done_qty"]
+            if tk["status"] == "进行中":
+                busy.add(tk["mold_id"])
+        first = db.session.scalar(select(func.coalesce(func.max(Task.id), 0))) + 1
+        db.session.execute(insert(Task), tasks)
+        db.session.execute(insert(Report), [dict(r, task_id=r["task_id"] + first - 1) for r in reports])
+        db.session.execute(
+            update(Mold).execution_options(synchronize_session=False),
+            [{"id": mid, "used_count": qty, "status": "使用中" if mid in busy else "空闲"}
+             for mid, qty in used.items()],
+        )
+
+        requirements = []
+        per_product = {}
+        for i, tk in enumerate(tasks, first):
+            flat = per_product.get(tk["product_id"])
+            if flat is None:
+                flat = per_product[tk["product_id"]] = bom_exploder.explode(tk["product_id"])
+            done = tk["status"] == "已完成"
+            base = tk["done_qty"] if tk["target_qty"] == OPEN_TARGET else tk["target_qty"]
+            for mid, per_unit in flat.items():
+                required = per_unit * max(base, 100)
+                requirements.append({"task_id": i, "material_id": mid, "required_qty": required,
+                                     "issued_qty": required if done else required // 2})
+        for chunk in chunks(requirements, 5000):
+            db.session.execute(insert(TaskMaterialRequirement), chunk)
+        log(f"  tasks/reports/requirements: {n}/{len(reports)}/{len(requirements)} "
+            f"({time.perf_counter() - t:.1f}s)")
+
+        # 流水：约四成入库、其余按任务出库；库存 = 流水合计，保证不为负
+        t = time.perf_counter()
+        material_ids = db.session.scalars(select(Material.id).where(Material.material_code.like("BX%")).order_by(Material.id)).all()
+        on_hand = dict.fromkeys(material_ids, 0)
+        moves = []
+        for _ in range(scale["moves"]):
+            mid = rng.choice(material_ids)
+            if rng.random() < 0.4:
+                qty, typ, ref_type, ref = rng.randint(100, 1000), "IN", "RECEIPT", f"PO{rng.randrange(10 ** 6):06d}"
+            else:
+                qty, typ, ref_type, ref = -rng.randint(1, 50), "OUT", "TASK", f"BT{rng.randint(1, n):07d}"
+                if on_hand[mid] + qty < 0:
+                    qty, typ, ref_type, ref = -qty * 20, "IN", "RECEIPT", f"PO{rng.randrange(10 ** 6):06d}"
+            on_hand[mid] += qty
+            moves.append({"material_id": mid, "qty": qty, "move_type": typ, "ref_type": ref_type,
+                          "ref_id": ref, "created_at": at()})
+        for chunk in chunks(moves, 5000):
+            db.session.execute(insert(StockMove), chunk)
+        have = set(db.session.scalars(select(Inventory.material_id)))
+        missing = [{"material_id": mid, "on_hand": 0, "reserved": 0} for mid in on_hand if mid not in have]
+        if missing:
+            db.session.execute(insert(Inventory), missing)
+        inv_ids = dict(db.session.execute(select(Inventory.material_id, Inventory.id)).all())
+        db.session.execute(
+            update(Inventory).execution_options(synchronize_session=False),
+            [{"id": inv_ids[mid], "on_hand": qty} for mid, qty in on_hand.items()],
+        )
+        rollups.rebuild(db.session.connection())
+        db.session.commit()
+        log(f"  stock moves: {len(moves)} ({time.perf_counter() - t:.1f}s)")
+
+        open_tasks = [(i, tk["task_no"], tk["product_id"]) for i, tk in enumerate(tasks, first)
+                      if tk["status"] == "进行中"]
+        return {
+            "mold_ids": mold_ids,
+            "product_ids": product_ids,
+            "material_ids": material_ids,
+            "open_tasks": open_tasks,
+            "requirements": {i: list(per_product[p]) for i, _, p in open_tasks},
+        }
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    add_scale_args(ap)
+    ap.add_argument("--db", help="生成到这个 SQLite 文件（必须不存在）")
+    ap.add_argument("--tsv", help="BOM 树 TSV 写到这个文件")
+    args = ap.parse_args()
+    if not args.db and not args.tsv:
+        ap.error("至少指定 --db 或 --tsv")
+    scale = scale_from(args)
+
+    if args.tsv:
+        with open(args.tsv, "w", encoding="utf-8") as f:
+            f.write(bom_tree_tsv(random.Random(args.seed), scale))
+        print(f"BOM tree -> {args.tsv}")
+    if args.db:
+        if os.path.exists(args.db):
+            ap.error(f"{args.db} 已存在")
+        os.environ["MES_DATABASE_URL"] = "sqlite:///" + os.path.abspath(args.db)
+        from db_init import create_app
+        from models import db
+        import migrations
+
+        app = create_app()
+        with app.app_context():
+            db.create_all()
+            migrations.upgrade(db.engine)
+        t = time.perf_counter()
+        print(f"seeding {args.scale} {scale} seed={args.seed}")
+        seed(app, scale, args.seed)
+        print(f"done in {time.perf_counter() - t:.1f}s -> {args.db}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,303 @@
+"""
+场景基准：datagen 按 --seed / --scale 造一个临时库，通过 Flask test client 跑各场景，
+记录吞吐、延迟分位数和每个请求的 SQL 条数（取自 metrics 写的 Server-Timing 响应头），结果写 JSON，
+不同提交之间对比 JSON 即可发现性能回退。
+
+    cd backend && python bench/run_bench.py --scale small --json before.json
+    git checkout <新提交> && python bench/run_bench.py --scale small --json after.json --compare before.json
+    python bench/run_bench.py --scale medium --only report_work,issue_to_task --threads 16
+
+场景：
+  list:*          各列表接口顺序请求（主数据列表有响应缓存，首个请求之后走缓存）
+  import_bom_tree POST /api/bom/import_tree，每次导入一棵新编码的 BOM 树
+  report_work     多线程并发 POST /api/report
+  issue_to_task   多线程并发 POST /api/tasks/<id>/issue（库存不足是正常业务拒绝，不算错误）
+  create_task     POST /api/tasks 绑定产品，按多层 BOM 展开生成用料需求
+
+--compare 时 p50 延迟变慢超过 --threshold 或每请求 SQL 条数增加的场景记为回退，以非 0 退出码结束。
+使用临时 SQLite 文件库，不会动 mes.sqlite3。
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import datagen
+
+LIST_ENDPOINTS = (
+    "/api/molds", "/api/materials", "/api/products", "/api/inventory",
+    "/api/tasks", "/api/tasks/open", "/api/dashboard",
+)
+
+QUERIES_RE = re.compile(r'desc="(\d+) queries"')
+
+
+def build_app(db_path):
+    os.environ["MES_DATABASE_URL"] = "sqlite:///" + db_path
+    # 定时快照线程会在跑场景时抢写锁，关掉以保证结果可复现
+    os.environ["MES_INVENTORY_SNAPSHOT_HOURS"] = "0"
+    from app import create_app
+    from models import db
+    import migrations
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        migrations.upgrade(db.engine)
+    return app
+
+
+# ---------- 计时 ----------
+
+class Recorder:
+    """收集一个场景的 (毫秒, SQL 条数, 是否出错)，线程安全"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = []
+        self.errors = []
+
+    def call(self, client, method, url, ok=(200,), json_body=None):
+        t = time.perf_counter()
+        r = client.open(url, method=method, json=json_body)
+        ms = (time.perf_counter() - t) * 1000
+        m = QUERIES_RE.search(r.headers.get("Server-Timing", ""))
+        failed = not (r.status_code in ok if not callable(ok) else ok(r))
+        with self._lock:
+            self.samples.append((ms, int(m.group(1)) if m else None))
+            if failed:
+                self.errors.append(f"{method} {url} -> {r.status_code} {r.get_data(as_text=True)[:200]}")
+        return r
+
+    def stats(self, elapsed):
+        ms = sorted(s[0] for s in self.samples)
+        queries = [s[1] for s in self.samples if s[1] is not None]
+        n = len(ms)
+        if not n:
+            return {"requests": 0, "errors": len(self.errors)}
+        return {
+            "requests": n,
+            "errors": len(self.errors),
+            "seconds": round(elapsed, 3),
+            "req_per_s": round(n / elapsed, 1) if elapsed else None,
+            "mean_ms": round(sum(ms) / n, 3),
+            "p50_ms": _pct(ms, 50),
+            "p95_ms": _pct(ms, 95),
+            "p99_ms": _pct(ms, 99),
+            "max_ms": round(ms[-1], 3),
+            "queries_per_req": round(sum(queries) / len(queries), 2) if queries else None,
+            "queries_max": max(queries) if queries else None,
+        }
+
+
+def _pct(sorted_ms, p):
+    return round(sorted_ms[min(len(sorted_ms) - 1, int(len(sorted_ms) * p / 100))], 3)
+
+
+def run_threads(app, threads, fn):
+    """threads 个线程各用一个 test client 执行 fn(client, rng)，返回墙钟秒数"""
+    workers = [threading.Thread(target=lambda i=i: fn(app.test_client(), random.Random(i)))
+               for i in range(threads)]
+    t = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return time.perf_counter() - t
+
+
+# ---------- 场景 ----------
+
+def scenario_list(app, ctx, args, url):
+    rec = Recorder()
+    client = app.test_client()
+    t = time.perf_counter()
+    for _ in range(args.repeat):
+        rec.call(client, "GET", url)
+    return rec, time.perf_counter() - t
+
+
+def scenario_import_bom_tree(app, ctx, args):
+    rec = Recorder()
+    client = app.test_client()
+    tree = dict(ctx["scale"], products=args.import_products)
+    rng = random.Random(args.seed)
+    payloads = [datagen.bom_tree_tsv(rng, tree, prefix=f"R{i}") for i in range(args.imports)]
+    t = time.perf_counter()
+    for tsv in payloads:
+        rec.call(client, "POST", "/api/bom/import_tree", json_body={"tsv": tsv})
+    return rec, time.perf_counter() - t
+
+
+def scenario_report_work(app, ctx, args):
+    rec = Recorder()
+    task_nos = [no for _, no, _ in ctx["open_tasks"]]
+
+    def work(client, rng):
+        for _ in range(args.requests):
+            rec.call(client, "POST", "/api/report", ok=(201,),
+                     json_body={"task_no": rng.choice(task_nos), "qty": rng.randint(1, 5)})
+    return rec, run_threads(app, args.threads, work)
+
+
+def scenario_issue_to_task(app, ctx, args):
+    rec = Recorder()
+    tasks = [(tid, ctx["requirements"][tid]) for tid, _, _ in ctx["open_tasks"] if ctx["requirements"][tid]]
+
+    def ok(r):
+        return r.status_code == 200 or (r.status_code == 400 and r.get_json().get("error") == "库存不足")
+
+    def work(client, rng):
+        for _ in range(args.requests):
+            tid, materials = rng.choice(tasks)
+            rec.call(client, "POST", f"/api/tasks/{tid}/issue", ok=ok,
+                     json_body={"material_id": rng.choice(materials), "qty": rng.randint(1, 3)})
+    return rec, run_threads(app, args.threads, work)
+
+
+def scenario_create_task(app, ctx, args):
+    rec = Recorder()
+    client = app.test_client()
+    rng = random.Random(args.seed)
+    t = time.perf_counter()
+    for _ in range(args.creates):
+        rec.call(client, "POST", "/api/tasks", ok=(201,), json_body={
+            "mold_id": rng.choice(ctx["mold_ids"]), "product_id": rng.choice(ctx["product_ids"]),
+            "operator_name": "基准测试", "target_qty": rng.randint(100, 5000),
+        })
+    return rec, time.perf_counter() - t
+
+
+SCENARIOS = {"list:" + url: (lambda app, ctx, args, url=url: scenario_list(app, ctx, args, url))
+             for url in LIST_ENDPOINTS}
+SCENARIOS.update({
+    "import_bom_tree": scenario_import_bom_tree,
+    "report_work": scenario_report_work,
+    "issue_to_task": scenario_issue_to_task,
+    "create_task": scenario_create_task,
+})
+
+
+# ---------- 元信息 / 对比 ----------
+
+def environment():
+    import sqlite3
+    from importlib.metadata import version
+
+    def git(*cmd):
+        try:
+            return subprocess.run(["git", *cmd], capture_output=True, text=True, timeout=10,
+                                  cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+        except (OSError, subprocess.SubprocessError):
+            return None
+
+    return {
+        "git_commit": git("rev-parse", "HEAD"),
+        "git_dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "sqlalchemy": version("sqlalchemy"),
+        "flask": version("flask"),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def compare(base, result, threshold):
+    """打印逐场景对比，返回回退的场景名"""
+    regressions = []
+    print(f"\n{'scenario':<26}{'p50 ms':>18}{'req/s':>20}{'queries/req':>18}")
+    for name, cur in result["scenarios"].items():
+        old = base.get("scenarios", {}).get(name)
+        if not old or not old.get("requests") or not cur.get("requests"):
+            print(f"{name:<26}{'(no baseline)':>18}")
+            continue
+        slower = old["p50_ms"] and (cur["p50_ms"] - old["p50_ms"]) / old["p50_ms"]
+        more_sql = (cur["queries_per_req"] or 0) - (old["queries_per_req"] or 0)
+        flag = slower > threshold or more_sql > 0.5
+        if flag:
+            regressions.append(name)
+        print(f"{name:<26}{old['p50_ms']:>8.2f} -> {cur['p50_ms']:<7.2f}"
+              f"{old['req_per_s'] or 0:>9.0f} -> {cur['req_per_s'] or 0:<8.0f}"
+              f"{old['queries_per_req'] or 0:>7.1f} -> {cur['queries_per_req'] or 0:<7.1f}"
+              f"{'  REGRESSION' if flag else ''}")
+    if base.get("meta", {}).get("scale") != result["meta"]["scale"]:
+        print("注意：两次结果的数据规模不同，对比仅供参考")
+    return regressions
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    datagen.add_scale_args(ap)
+    ap.add_argument("--only", help="只跑这些场景，逗号分隔（可写前缀，如 list）")
+    ap.add_argument("--repeat", type=int, default=50, help="列表场景每个接口请求次数")
+    ap.add_argument("--threads", type=int, default=8, help="并发场景线程数")
+    ap.add_argument("--requests", type=int, default=100, help="并发场景每个线程的请求数")
+    ap.add_argument("--imports", type=int, default=5, help="BOM 树导入次数")
+    ap.add_argument("--import-products", type=int, default=5, help="每次导入的顶层产品数")
+    ap.add_argument("--creates", type=int, default=200, help="建任务次数")
+    ap.add_argument("--json", help="结果写入 JSON 文件")
+    ap.add_argument("--compare", help="与之前的结果 JSON 对比")
+    ap.add_argument("--threshold", type=float, default=0.25, help="p50 变慢多少比例算回退")
+    args = ap.parse_args()
+
+    names = list(SCENARIOS)
+    if args.only:
+        wanted = [w.strip() for w in args.only.split(",") if w.strip()]
+        names = [n for n in names if any(n == w or n.startswith(w) for w in wanted)]
+        if not names:
+            ap.error(f"没有匹配的场景，可选：{', '.join(SCENARIOS)}")
+
+    scale = datagen.scale_from(args)
+    db_path = os.path.join(tempfile.mkdtemp(prefix="mes-bench-"), "bench.sqlite3")
+    app = build_app(db_path)
+    print(f"seeding {args.scale} {scale} seed={args.seed} -> {db_path}")
+    t = time.perf_counter()
+    ctx = datagen.seed(app, scale, args.seed)
+    ctx["scale"] = scale
+    seed_seconds = time.perf_counter() - t
+
+    result = {
+        "meta": dict(environment(), scale_name=args.scale, scale=scale, seed=args.seed,
+                     threads=args.threads, started_at=datetime.now().isoformat(timespec="seconds"),
+                     seed_seconds=round(seed_seconds, 2)),
+        "scenarios": {},
+    }
+    print(f"\n{'scenario':<26}{'reqs':>7}{'err':>5}{'req/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'sql/req':>9}")
+    failed = False
+    for name in names:
+        rec, elapsed = SCENARIOS[name](app, ctx, args)
+        s = result["scenarios"][name] = rec.stats(elapsed)
+        failed |= bool(rec.errors)
+        if s["requests"]:
+            print(f"{name:<26}{s['requests']:>7}{s['errors']:>5}{s['req_per_s'] or 0:>9.0f}{s['p50_ms']:>9.2f}"
+                  f"{s['p95_ms']:>9.2f}{s['p99_ms']:>9.2f}{s['queries_per_req'] or 0:>9.1f}")
+        for e in rec.errors[:3]:
+            print("    error:", e)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"\nresult -> {args.json}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(json.load(f), result, args.threshold)
+        if regressions:
+            print(f"回退：{', '.join(regressions)}")
+            failed = True
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+"""
+并发报工/出入库压力测试：多个线程同时打 /api/report、/api/inventory/in、/api/tasks/<id>/issue，
+结束后核对 完成数、模具次数、库存、已发数量、看板汇总 是否等于各请求之和。
+
+    cd backend && python bench/stress_concurrency.py --threads 16 --requests 200
+
+不一致时以非 0 退出码结束。使用临时 SQLite 文件库，不会动 mes.sqlite3。
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def build_app(db_path):
+    os.environ["MES_DATABASE_URL"] = "sqlite:///" + db_path
+    # 定时快照线程会在压测中途抢写锁
+    os.environ["MES_INVENTORY_SNAPSHOT_HOURS"] = "0"
+    from app import create_app
+    from models import db
+    import migrations
+
+    app = create_app()
+    with app.app_context():
+        db.create_all()
+        migrations.upgrade(db.engine)
+    return app
+
+
+def seed(client, initial_stock):
+    client.post("/api/molds", json={"mold_code": "STRESS-M", "mold_name": "压测模具", "total_life": 10 ** 9})
+    m = client.post("/api/materials", json={"material_code": "STRESS-X", "material_name": "压测物料"}).get_json()
+    p = client.post("/api/products", json={"product_code": "STRESS-P", "product_name": "压测产品"}).get_json()
+    client.post(f"/api/products/{p['id']}/bom", json={"material_id": m["id"], "qty_per_unit": 1})
+    client.post("/api/inventory/in", json={"material_id": m["id"], "qty": initial_stock})
+    t = client.post("/api/tasks", json={
+        "task_no": "STRESS-T", "mold_id": 1, "operator_name": "压测",
+        "target_qty": 10 ** 9, "product_id": p["id"],
+    }).get_json()
+    return t["id"], m["id"]
+
+
+def worker(app, task_id, material_id, n, totals, lock, errors):
+    client = app.test_client()
+    done = received = issued = 0
+    for _ in range(n):
+        op = random.choice(("report", "in", "issue"))
+        qty = random.randint(1, 5)
+        if op == "report":
+            r = client.post("/api/report", json={"task_no": "STRESS-T", "qty": qty})
+            ok = r.status_code == 201
+            done += qty if ok else 0
+        elif op == "in":
+            r = client.post("/api/inventory/in", json={"material_id": material_id, "qty": qty})
+            ok = r.status_code == 200
+            received += qty if ok else 0
+        else:
+            r = client.post(f"/api/tasks/{task_id}/issue", json={"material_id": material_id, "qty": qty})
+            # 库存不足是合法的业务拒绝，不算错误
+            ok = r.status_code == 200 or (r.status_code == 400 and r.get_json().get("error") == "库存不足")
+            issued += qty if r.status_code == 200 else 0
+        if not ok:
+            errors.append((op, r.status_code, r.get_data(as_text=True)[:200]))
+    with lock:
+        totals["done"] += done
+        totals["received"] += received
+        totals["issued"] += issued
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--threads", type=int, default=16)
+    ap.add_argument("--requests", type=int, default=200, help="每个线程的请求数")
+    ap.add_argument("--initial-stock", type=int, default=500)
+    ap.add_argument("--seed", type=int, default=42)
+    args = ap.parse_args()
+    random.seed(args.seed)
+
+    db_path = os.path.join(tempfile.mkdtemp(prefix="mes-stress-"), "stress.sqlite3")
+    app = build_app(db_path)
+    task_id, material_id = seed(app.test_client(), args.initial_stock)
+
+    totals = {"done": 0, "received": 0, "issued": 0}
+    lock, errors = threading.Lock(), []
+    threads = [
+        threading.Thread(target=worker, args=(app, task_id, material_id, args.requests, totals, lock, errors))
+        for _ in range(args.threads)
+    ]
+    started = time.perf_counter()
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    elapsed = time.perf_counter() - started
+
+    from models import (db, Task, Mold, Inventory, TaskMaterialRequirement, StockMove, Report,
+                        ProductionRollup, StockRollup)
+    with app.app_context():
+        t = db.session.get(Task, task_id)
+        mold = db.session.get(Mold, t.mold_id)
+        inv = Inventory.query.filter_by(material_id=material_id).one()
+        req = TaskMaterialRequirement.query.filter_by(task_id=task_id, material_id=material_id).one()
+        ledger = db.session.query(db.func.sum(StockMove.qty)).filter_by(material_id=material_id).scalar() or 0
+        reported = db.session.query(db.func.sum(Report.qty)).filter_by(task_id=task_id).scalar() or 0
+        rolled_qty = db.session.query(db.func.sum(ProductionRollup.qty)).scalar() or 0
+        rolled_net = db.session.query(
+            db.func.sum(StockRollup.in_qty - StockRollup.out_qty)
+        ).filter_by(material_id=material_id).scalar() or 0
+        checks = {
+            "task.done_qty": (t.done_qty, totals["done"]),
+            "mold.used_count": (mold.used_count, totals["done"]),
+            "sum(reports.qty)": (reported, totals["done"]),
+            "inventory.on_hand": (inv.on_hand, args.initial_stock + totals["received"] - totals["issued"]),
+            "sum(stock_moves.qty)": (ledger, inv.on_hand),
+            "requirement.issued_qty": (req.issued_qty, totals["issued"]),
+            "sum(rollup_production.qty)": (rolled_qty, totals["done"]),
+            "sum(rollup_stock_daily in-out)": (rolled_net, inv.on_hand),
+        }
+
+    total_requests = args.threads * args.requests
+    print(f"{total_requests} requests / {args.threads} threads in {elapsed:.2f}s "
+          f"({total_requests / elapsed:.0f} req/s), unexpected failures: {len(errors)}")
+    failed = bool(errors)
+    for name, (actual, expected) in checks.items():
+        flag = "OK " if actual == expected else "BAD"
+        failed |= actual != expected
+        print(f"  [{flag}] {name}: {actual} (expected {expected})")
+    for e in errors[:10]:
+        print("  error:", e)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+from sqlalchemy import select, insert, update, delete, func
+
+import where_used
+from dbutil import chunks
+from models import db, Material, Product, BOMItem, Task
+
+# =========================
+# 整张 BOM 提交：传入产品的完整目标 BOM，与现有 bom_items 比对后
+# 一个事务内批量 INSERT / UPDATE / DELETE，返回差异；dry_run 只算差异不写库（ECN 评审用）。
+#
+# 校验在写库之前全部做完：物料存在、数量 > 0、同一物料不重复、不形成循环引用
+# （新加的子件若是半成品，且它本身就是本产品或用到了本产品 -> 循环）。
+# =========================
+
+
+class BomEditError(ValueError):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def parse_dry_run(body_value, query_value):
+    """请求体 dry_run 与 ?dry_run= 任一为真即只算差异；只认 true/false、1/0、"1"/"0"、"true"/"false"，其他值报错"""
+    def flag(value, where):
+        if type(value) is int and value in (0, 1):
+            return bool(value)
+        if value is None or value is False or value in ("", "0", "false"):
+            return False
+        if value is True or value in ("1", "true"):
+            return True
+        raise BomEditError(f"{where} 只能为 true/false、1/0 或字符串 \"true\"/\"false\"/\"1\"/\"0\"")
+    return flag(body_value, "dry_run") | flag(query_value, "?dry_run")
+
+
+def parse_items(items):
+    """[{"material_id" 或 "material_code", "qty_per_unit"}] -> {material_id: qty}"""
+    if not isinstance(items, list):
+        raise BomEditError("items 必须为数组")
+    wanted, by_code = [], {}
+    for i, it in enumerate(items, 1):
+        if not isinstance(it, dict):
+            raise BomEditError(f"第 {i} 行格式错误")
+        try:
+            qty = int(it.get("qty_per_unit") or 0)
+            mid = int(it.get("material_id") or 0)
+        except (TypeError, ValueError):
+            raise BomEditError(f"第 {i} 行 material_id/qty_per_unit 必须为整数") from None
+        code = str(it.get("material_code") or "").strip()
+        if qty <= 0 or (mid <= 0 and not code):
+            raise BomEditError(f"第 {i} 行需要 material_id 或 material_code，且 qty_per_unit>0")
+        if mid <= 0:
+            by_code[code] = None
+        wanted.append((i, mid, code, qty))
+
+    for chunk in chunks(by_code):
+        by_code.update(db.session.execute(
+            select(Material.material_code, Material.id).where(Material.material_code.in_(chunk))
+        ).all())
+    ids = {mid for _, mid, _, _ in wanted if mid > 0}
+    known = set()
+    for chunk in chunks(ids):
+        known.update(db.session.execute(select(Material.id).where(Material.id.in_(chunk))).scalars())
+
+    desired = {}
+    for i, mid, code, qty in wanted:
+        if mid <= 0:
+            mid = by_code.get(code)
+            if mid is None:
+                raise BomEditError(f"第 {i} 行物料编码 {code} 不存在", 404)
+        elif mid not in known:
+            raise BomEditError(f"第 {i} 行物料 {mid} 不存在", 404)
+        if mid in desired:
+            raise BomEditError(f"第 {i} 行物料重复")
+        desired[mid] = qty
+    return desired
+
+
+def _material_info(material_ids):
+    info = {}
+    for chunk in chunks(material_ids):
+        for mid, code, name, unit in db.session.execute(
+            select(Material.id, Material.material_code, Material.material_name, Material.unit)
+            .where(Material.id.in_(chunk))
+        ):
+            info[mid] = {"material_id": mid, "material_code": code, "material_name": name, "unit": unit}
+    return info
+
+
+def diff(product_id, desired):
+    current = {mid: (item_id, qty) for item_id, mid, qty in db.session.execute(
+        select(BOMItem.id, BOMItem.material_id, BOMItem.qty_per_unit).where(BOMItem.product_id == product_id)
+    )}
+    added = {mid: qty for mid, qty in desired.items() if mid not in current}
+    updated = {mid: (current[mid], qty) for mid, qty in desired.items()
+               if mid in current and current[mid][1] != qty}
+    removed = {mid: cur for mid, cur in current.items() if mid not in desired}
+
+    info = _material_info(set(added) | set(updated) | set(removed))
+    by_code = lambda row: row["material_code"] or ""  # noqa: E731
+    return {
+        "added": sorted(({**info[m], "qty_per_unit": q} for m, q in added.items()), key=by_code),
+        "updated": sorted(({**info[m], "item_id": cur[0], "old_qty": cur[1], "qty_per_unit": q}
+                           for m, (cur, q) in updated.items()), key=by_code),
+        "removed": sorted(({**info[m], "item_id": cur[0], "qty_per_unit": cur[1]}
+                           for m, cur in removed.items()), key=by_code),
+        "unchanged": len(desired) - len(added) - len(updated),
+    }
+
+
+def check_cycles(product, material_ids):
+    """新加子件中的半成品若就是本产品或用到了本产品，抛 BomEditError(409)"""
+    subassemblies = {}
+    for chunk in chunks(material_ids):
+        subassemblies.update(db.session.execute(
+            select(Product.id, Material.material_code)
+            .join(Material, Material.material_code == Product.product_code)
+            .where(Material.id.in_(chunk))
+        ).all())
+    if not subassemblies:
+        return
+    own_material = db.session.execute(
+        select(Material.id).where(Material.material_code == product.product_code)
+    ).scalar()
+    ancestors = {product.id}
+    if own_material is not None:
+        ancestors.update(where_used.affected_products(own_material))
+    loops = sorted(code for pid, code in subassemblies.items() if pid in ancestors)
+    if loops:
+        raise BomEditError(f"BOM 存在循环引用：{product.product_code} 不能包含 {','.join(loops)}", 409)
+
+
+def affected_open_tasks(product):
+    """本产品及用到本产品的上层产品的进行中任务数（这些任务已生成的用料需求不会随 BOM 变化）"""
+    ids = {product.id}
+    own_material = db.session.execute(
+        select(Material.id).where(Material.material_code == product.product_code)
+    ).scalar()
+    if own_material is not None:
+        ids.update(where_used.affected_products(own_material))
+    n = 0
+    for chunk in chunks(ids):
+        n += db.session.execute(
+            select(func.count()).select_from(Task).where(Task.status == "进行中", Task.product_id.in_(chunk))
+        ).scalar()
+    return n
+
+
+def apply(product_id, changes):
+    """按 diff() 的结果批量写库，只 flush 不 commit"""
+    if changes["added"]:
+        for chunk in chunks(changes["added"], 5000):
+            db.session.execute(insert(BOMItem), [
+                {"product_id": product_id, "material_id": r["material_id"], "qty_per_unit": r["qty_per_unit"]}
+                for r in chunk
+            ])
+    if changes["updated"]:
+        db.session.execute(update(BOMItem), [
+            {"id": r["item_id"], "qty_per_unit": r["qty_per_unit"]} for r in changes["updated"]
+        ])
+    for chunk in chunks([r["item_id"] for r in changes["removed"]]):
+        db.session.execute(
+            delete(BOMItem).where(BOMItem.id.in_(chunk)).execution_options(synchronize_session=False)
+        )
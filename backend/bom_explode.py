@@ -0,0 +1,229 @@
+import threading
+from collections import OrderedDict, defaultdict
+
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from dbutil import chunks
+from httpcache import table_versions
+from models import db, Material, Product, BOMItem
+
+# =========================
+# 多层 BOM 展开
+#
+# 子件的物料编码若同时是某个产品的编码且该产品有 BOM，则视为半成品继续向下展开，
+# 否则视为叶子物料。展开结果为 {叶子 material_id: 每单位成品总用量}。
+#
+# 每个节点的展开结果带依赖集合（子树内所有产品 id）缓存；
+# 子树内任一 BOMItem 变化只失效依赖它的缓存项，物料/产品编码变化（影响父子关联）则全部失效。
+#
+# 上面的失效只看得到本进程的写入。多进程部署（gunicorn -w N）时另一个进程改了 BOM，
+# 本进程靠 httpcache 维护的 table_versions 发现：每次展开先读一次 bom_items/materials/products
+# 的版本号，和缓存建立时的不同就整体清空；缓存项只在版本号一致时写入和命中。
+# =========================
+
+# 版本号变化即清空缓存的表
+VERSION_TABLES = tuple(m.__tablename__ for m in (BOMItem, Material, Product))
+
+
+class BomCycleError(ValueError):
+    pass
+
+
+class BomExploder:
+    def __init__(self, max_entries=10000):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()         # product_id -> (flat, deps)
+        self._dependents = defaultdict(set)  # 子树内 product_id -> 引用它的缓存项
+        self._version = None                 # 缓存内容对应的 VERSION_TABLES 版本号
+
+    # ---------- 缓存 ----------
+    def _sync(self, version):
+        """版本号和缓存的不同（其他进程/未提交事务改过 BOM）时清空缓存"""
+        with self._lock:
+            if version != self._version:
+                self._cache.clear()
+                self._dependents.clear()
+                self._version = version
+
+    def _get(self, pid, version):
+        with self._lock:
+            if version != self._version:
+                return None
+            hit = self._cache.get(pid)
+            if hit is not None:
+                self._cache.move_to_end(pid)
+            return hit
+
+    def _put(self, pid, flat, deps, version):
+        with self._lock:
+            if version != self._version:
+                return  # 展开期间其他线程看到了别的版本，这份结果不入缓存
+            self._cache[pid] = (flat, deps)
+            for d in deps:
+                self._dependents[d].add(pid)
+            while len(self._cache) > self.max_entries:
+                old, (_, old_deps) = self._cache.popitem(last=False)
+                for d in old_deps:
+                    self._dependents[d].discard(old)
+
+    def invalidate(self, product_ids):
+        with self._lock:
+            for pid in product_ids:
+                for root in self._dependents.pop(pid, ()):
+                    entry = self._cache.pop(root, None)
+                    if entry:
+                        for d in entry[1]:
+                            if d != pid:
+                                self._dependents[d].discard(root)
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self._dependents.clear()
+
+    # ---------- 展开 ----------
+    def explode(self, product_id):
+        """返回 {material_id: 每单位用量}；存在循环引用时抛 BomCycleError"""
+        version = table_versions(VERSION_TABLES)
+        self._sync(version)
+        hit = self._get(product_id, version)
+        if hit is not None:
+            return dict(hit[0])
+
+        children = self._load_subtree(product_id, version)
+        memo = {}
+        self._flatten(product_id, children, memo, [], version)
+        return dict(memo[product_id][0])
+
+    def _load_subtree(self, root_id, version):
+        """按层批量读取子树的 BOM：{product_id: [(material_id, 子产品 id 或 None, 数量)]}"""
+        children = {}
+        frontier = {root_id}
+        while frontier:
+            level = defaultdict(list)
+            for chunk in chunks(frontier):
+                rows = db.session.execute(
+                    select(BOMItem.product_id, BOMItem.material_id, Product.id, BOMItem.qty_per_unit)
+                    .join(Material, Material.id == BOMItem.material_id)
+                    .outerjoin(Product, Product.product_code == Material.material_code)
+                    .where(BOMItem.product_id.in_(chunk))
+                )
+                for pid, mid, child_pid, qty in rows:
+                    level[pid].append((mid, child_pid, qty))
+            for pid in frontier:
+                children[pid] = level.get(pid, [])
+            # 已缓存的子节点不必再往下读
+            frontier = {c for items in level.values() for _, c, _ in items
+                        if c is not None and c not in children and self._get(c, version) is None}
+        return children
+
+    def _is_assembly(self, pid, children, version):
+        """该产品节点是否有 BOM（需要继续展开）"""
+        if pid not in children:
+            hit = self._get(pid, version)
+            if hit is not None:
+                return bool(hit[0])
+            # 读子树后缓存被其他线程失效了，补读
+            children.update(self._load_subtree(pid, version))
+        return bool(children[pid])
+
+    def _flatten(self, pid, children, memo, path, version):
+        if pid in memo:
+            return memo[pid]
+        if pid in path:
+            raise BomCycleError(_cycle_message(path[path.index(pid):] + [pid]))
+        hit = self._get(pid, version)
+        if hit is not None:
+            memo[pid] = hit
+            return hit
+
+        path.append(pid)
+        flat, deps = defaultdict(int), {pid}
+        for mid, child_pid, qty in children.get(pid, []):
+            if child_pid is not None and self._is_assembly(child_pid, children, version):
+                sub_flat, sub_deps = self._flatten(child_pid, children, memo, path, version)
+                for leaf, n in sub_flat.items():
+                    flat[leaf] += n * qty
+                deps |= sub_deps
+            else:
+                if child_pid is not None:
+                    deps.add(child_pid)  # 目前无 BOM，将来加了 BOM 要失效
+                flat[mid] += qty
+        path.pop()
+
+        result = (dict(flat), frozenset(deps))
+        memo[pid] = result
+        self._put(pid, *result, version)
+        return result
+
+
+def _cycle_message(ids):
+    codes = dict(db.session.execute(
+        select(Product.id, Product.product_code).where(Product.id.in_(set(ids)))
+    ).all())
+    return "BOM 存在循环引用：" + " -> ".join(codes.get(i, str(i)) for i in ids)
+
+
+bom_exploder = BomExploder()
+
+
+# =========================
+# 缓存失效：flush 时立即失效，commit/rollback 后再失效一次，
+# 避免其他线程在提交前读到旧数据又写回缓存
+# =========================
+_LINK_MODELS = (Material, Product)
+
+
+def _pending(session):
+    return session.info.setdefault("bom_invalidate", set())
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_flush(session, flush_context):
+    pending = _pending(session)
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        if isinstance(obj, BOMItem):
+            pending.add(obj.product_id)
+            hist = inspect(obj).attrs.product_id.history
+            pending.update(v for v in hist.deleted or () if v is not None)
+        elif isinstance(obj, _LINK_MODELS):
+            if obj in session.dirty:
+                code = "material_code" if isinstance(obj, Material) else "product_code"
+                if not inspect(obj).attrs[code].history.has_changes():
+                    continue
+            pending.add(None)  # None 表示全部失效
+    _apply(session, keep=True)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _collect_bulk(orm_execute_state):
+    if orm_execute_state.is_select:
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and mapper.class_ in (BOMItem,) + _LINK_MODELS:
+        _pending(orm_execute_state.session).add(None)
+        _apply(orm_execute_state.session, keep=True)
+
+
+@event.listens_for(Session, "after_commit")
+def _after_commit(session):
+    _apply(session)
+
+
+@event.listens_for(Session, "after_rollback")
+def _after_rollback(session):
+    _apply(session)
+
+
+def _apply(session, keep=False):
+    pending = session.info.get("bom_invalidate")
+    if not pending:
+        return
+    if None in pending:
+        bom_exploder.clear()
+    else:
+        bom_exploder.invalidate(pending)
+    if not keep:
+        pending.clear()
@@ -0,0 +1,270 @@
+import csv
+import io
+import itertools
+import time
+
+from sqlalchemy import select, insert, update
+
+from dbutil import chunks
+from models import db, Material, Inventory, Product, BOMItem
+
+# =========================
+# 树形 BOM 导入引擎
+# =========================
+TREE_HEADER = ["层级", "物料编码", "名称", "图号", "数量", "单位", "类型", "备注"]
+
+# 跳过原因最多记录的条数
+MAX_ERRORS = 100
+
+
+def check_header(cols):
+    header = [_cell(h) for h in cols]
+    if header[:8] != TREE_HEADER:
+        raise ValueError(f"表头必须为：{TREE_HEADER}")
+
+
+def parse_depth(level_str):
+    """层级：0 / .1 / ..2 / ...3 通过前导 '.' 个数确定 depth"""
+    depth = 0
+    for ch in level_str:
+        if ch == ".":
+            depth += 1
+        else:
+            break
+    return depth
+
+
+def _cell(v):
+    return "" if v is None else str(v).strip()
+
+
+class BomTreeImporter:
+    """
+    逐行喂入 TSV/CSV/XLSX 解析出的列，按批批量写库。
+
+    - 启动时把已有 物料编码/产品编码 -> id 一次性读入内存，逐行 upsert 不再查库
+    - 层级栈在内存中按编码解析，父子关系攒到批末统一落库
+    - 每批：新物料/新产品各一条批量 INSERT，已有的各一条批量 UPDATE，
+      BOM 行先按父节点一次查出已有项，再批量 INSERT / UPDATE
+    - 只 flush 不 commit，事务边界由调用方决定；on_flush(importer) 在每批写完后回调
+    """
+
+    def __init__(self, session=None, batch_size=5000, on_flush=None):
+        self.session = session or db.session
+        self.batch_size = batch_size
+        self.on_flush = on_flush
+
+        self.material_ids = dict(self.session.execute(select(Material.material_code, Material.id)).all())
+        self.product_ids = dict(self.session.execute(select(Product.product_code, Product.id)).all())
+
+        self.stack = {}  # depth -> 产品编码
+        self.created_bom, self.updated_bom, self.skipped = 0, 0, 0
+        self.rows = 0
+        self.errors = []  # [{"row": 数据行号, "error": 原因}]，最多 MAX_ERRORS 条
+        self.started = time.perf_counter()
+        self._reset_batch()
+
+    def _reset_batch(self):
+        self._materials = {}  # code -> 字段（同批重复编码后者覆盖）
+        self._products = {}   # code -> 名称
+        self._bom = []        # (父编码, 子编码, 数量)
+        self._pending = 0
+
+    # ---------- 逐行 ----------
+    def add(self, cols):
+        self.rows += 1
+        cols = [_cell(c) for c in cols]
+        if len(cols) < 8:
+            return self._skip("列数不足 8 列")
+
+        level_str, code, name, drawing_no, qty_str, unit, typ, remark = cols[:8]
+        if not code or not name:
+            return self._skip("物料编码/名称为空")
+
+        depth = parse_depth(level_str)
+        try:
+            qty = int(float(qty_str))
+        except (ValueError, OverflowError):
+            return self._skip(f"数量无效：{qty_str}")
+        if qty <= 0:
+            return self._skip(f"数量必须 >0：{qty_str}")
+
+        vals = self._materials.setdefault(code, {"unit": None})
+        vals.update(material_name=name, drawing_no=drawing_no or None,
+                    material_type=typ or None, remark=remark or None)
+        if unit:
+            vals["unit"] = unit
+        # 每个节点也 upsert 为 Product（用于展开）
+        self._products[code] = name
+        self._pending += 1
+
+        if depth == 0:
+            self._set_stack(0, code)
+        else:
+            parent = self.stack.get(depth - 1)
+            if parent is None:
+                self._skip(f"找不到第 {depth - 1} 层父节点")
+            else:
+                self._bom.append((parent, code, qty))
+                self._set_stack(depth, code)
+
+        if self._pending >= self.batch_size:
+            self.flush()
+
+    def _skip(self, reason):
+        self.skipped += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({"row": self.rows, "error": reason})
+
+    def _set_stack(self, depth, code):
+        self.stack[depth] = code
+        for k in [k for k in self.stack if k > depth]:
+            del self.stack[k]
+
+    # ---------- 批量落库 ----------
+    def flush(self):
+        if not self._pending:
+            return
+        self._write_materials()
+        self._write_products()
+        self._write_bom()
+        self.session.flush()
+        self._reset_batch()
+        if self.on_flush:
+            self.on_flush(self)
+
+    def _write_materials(self):
+        new_rows, upd_rows, upd_rows_unit = [], [], []
+        for code, vals in self._materials.items():
+            mid = self.material_ids.get(code)
+            if mid is None:
+                new_rows.append(dict(vals, material_code=code, unit=vals["unit"] or "pcs", safety_stock=0))
+            elif vals["unit"]:
+                upd_rows_unit.append(dict(vals, id=mid))
+            else:
+                upd_rows.append({k: v for k, v in vals.items() if k != "unit"} | {"id": mid})
+
+        if new_rows:
+            res = self.session.execute(
+                insert(Material).returning(Material.id, Material.material_code), new_rows
+            )
+            created = [(mid, code) for mid, code in res]
+            self.material_ids.update((code, mid) for mid, code in created)
+            # 新物料自动建库存行
+            self.session.execute(
+                insert(Inventory),
+                [{"material_id": mid, "on_hand": 0, "reserved": 0} for mid, _ in created],
+            )
+        for rows in (upd_rows, upd_rows_unit):
+            if rows:
+                self.session.execute(update(Material), rows)
+
+    def _write_products(self):
+        new_rows, upd_rows = [], []
+        for code, name in self._products.items():
+            pid = self.product_ids.get(code)
+            if pid is None:
+                new_rows.append({"product_code": code, "product_name": name, "version": None})
+            else:
+                upd_rows.append({"id": pid, "product_name": name})
+
+        if new_rows:
+            res = self.session.execute(
+                insert(Product).returning(Product.id, Product.product_code), new_rows
+            )
+            self.product_ids.update((code, pid) for pid, code in res)
+        if upd_rows:
+            self.session.execute(update(Product), upd_rows)
+
+    def _write_bom(self):
+        if not self._bom:
+            return
+        pairs = [(self.product_ids[p], self.material_ids[m], qty) for p, m, qty in self._bom]
+
+        existing = {}
+        for chunk in chunks({pid for pid, _, _ in pairs}):
+            rows = self.session.execute(
+                select(BOMItem.id, BOMItem.product_id, BOMItem.material_id)
+                .where(BOMItem.product_id.in_(chunk))
+            )
+            existing.update(((pid, mid), item_id) for item_id, pid, mid in rows)
+
+        new_items, upd_items = {}, {}
+        for pid, mid, qty in pairs:
+            key = (pid, mid)
+            if key in existing:
+                upd_items[existing[key]] = qty
+                self.updated_bom += 1
+            elif key in new_items:
+                new_items[key] = qty
+                self.updated_bom += 1
+            else:
+                new_items[key] = qty
+                self.created_bom += 1
+
+        if new_items:
+            self.session.execute(
+                insert(BOMItem),
+                [{"product_id": pid, "material_id": mid, "qty_per_unit": qty}
+                 for (pid, mid), qty in new_items.items()],
+            )
+        if upd_items:
+            self.session.execute(
+                update(BOMItem),
+                [{"id": item_id, "qty_per_unit": qty} for item_id, qty in upd_items.items()],
+            )
+
+    # ---------- 汇总 ----------
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            "bom_created": self.created_bom,
+            "bom_updated": self.updated_bom,
+            "skipped": self.skipped,
+            "rows": self.rows,
+            "elapsed_ms": round(elapsed * 1000, 1),
+            "rows_per_sec": round(self.rows / elapsed, 1) if elapsed > 0 else None,
+        }
+
+
+# =========================
+# 流式读取：逐行产出列，配合 BomTreeImporter 分批写库，内存占用与文件大小无关
+# =========================
+def iter_text_rows(stream, encoding="utf-8-sig"):
+    """CSV / TSV 二进制流 -> 行；按首行是否含制表符判断分隔符"""
+    text = io.TextIOWrapper(stream, encoding=encoding, newline="")
+    first = text.readline()
+    delimiter = "\t" if "\t" in first else ","
+    yield from csv.reader(itertools.chain([first], text), delimiter=delimiter)
+
+
+def iter_xlsx_rows(stream):
+    """XLSX 第一个工作表 -> 行（openpyxl 只读模式，按需解析）"""
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError("服务器未安装 openpyxl，无法导入 xlsx")
+    wb = load_workbook(stream, read_only=True, data_only=True)
+    try:
+        yield from wb.active.iter_rows(values_only=True)
+    finally:
+        wb.close()
+
+
+def import_rows(rows, batch_size=5000, on_flush=None):
+    """
+    首个非空行为表头，其余逐行导入；空行忽略。
+    表头/数据不合法时抛 ValueError，调用方负责 commit / rollback。
+    """
+    rows = (r for r in rows if any(_cell(c) for c in r))
+    header = next(rows, None)
+    first = next(rows, None)
+    if header is None or first is None:
+        raise ValueError("至少包含表头+1行数据")
+    check_header(header)
+
+    importer = BomTreeImporter(batch_size=batch_size, on_flush=on_flush)
+    for r in itertools.chain([first], rows):
+        importer.add(r)
+    importer.flush()
+    return importer
@@ -1,15 +1,19 @@
 from flask import Flask
 from config import Config
 from models import db
+import dbutil
+import migrations
 
 def create_app():
     app = Flask(__name__)
     app.config.from_object(Config)
     db.init_app(app)
+    dbutil.init_app(app)
     return app
 
 if __name__ == "__main__":
     app = create_app()
     with app.app_context():
         db.create_all()
+        migrations.upgrade(db.engine)
     print("DB initialized.")
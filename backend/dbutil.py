@@ -0,0 +1,183 @@
+import random
+import threading
+import time
+from functools import wraps
+
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.exc import OperationalError, DBAPIError
+from sqlalchemy.orm import Session
+
+from models import db
+
+
+# =========================
+# 引擎初始化：SQLite PRAGMA + 单写通道
+# create_app / db_init 都调用 init_app；换成 PostgreSQL 只需改 MES_DATABASE_URL
+# =========================
+def init_app(app):
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name != "sqlite":
+        return
+    event.listen(engine, "connect", _pragma_setter(app.config["SQLITE_PRAGMAS"]))
+    if app.config.get("DB_SERIALIZE_WRITES"):
+        write_lane.enable(app.config.get("DB_WRITE_LANE_TIMEOUT", 30))
+
+
+def side_engine(app, pool_size=2):
+    """
+    同一个库的独立小引擎，给后台线程用：不占请求的连接池，也不挂 db.engine 上的监听器（慢查询日志等）
+    """
+    options = dict(app.config.get("SQLALCHEMY_ENGINE_OPTIONS") or {})
+    if "pool_size" in options:
+        options.update(pool_size=pool_size, max_overflow=0)
+    with app.app_context():
+        url = db.engine.url  # Flask-SQLAlchemy 已把相对路径的 SQLite 解析好
+    engine = create_engine(url, **options)
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", _pragma_setter(app.config["SQLITE_PRAGMAS"]))
+    return engine
+
+
+def _pragma_setter(pragmas):
+    def on_connect(dbapi_connection, connection_record):
+        cur = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cur.execute(f"PRAGMA {name}={value}")
+        cur.close()
+    return on_connect
+
+
+class WriteLane:
+    """
+    进程内写事务串行化：Session 第一次写（flush / 批量 UPDATE 等）时拿锁，
+    事务结束（commit / rollback / close）时放锁。读不拿锁，WAL 下不受影响。
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.enabled = False
+        self.timeout = 30
+
+    def enable(self, timeout):
+        self.enabled = True
+        self.timeout = timeout
+
+    def acquire(self, session):
+        if not self.enabled or session.info.get("write_lane"):
+            return
+        if not self._lock.acquire(timeout=self.timeout):
+            raise OperationalError("write lane", None, Exception("database is locked (write lane timeout)"))
+        session.info["write_lane"] = True
+
+    def release(self, session):
+        if session.info.pop("write_lane", False):
+            self._lock.release()
+
+
+write_lane = WriteLane()
+
+
+@event.listens_for(Session, "before_flush")
+def _lane_before_flush(session, flush_context, instances):
+    write_lane.acquire(session)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _lane_bulk(orm_execute_state):
+    if orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete:
+        write_lane.acquire(orm_execute_state.session)
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _lane_release(session, transaction):
+    if transaction.parent is None:
+        write_lane.release(session)
+
+
+# =========================
+# 写冲突重试：SQLite "database is locked" / PostgreSQL 序列化失败、死锁
+# 被包装的函数必须在 commit 之前可以整体重放（回滚后从头再来）
+# =========================
+
+# SQLite 单条语句的变量数有限，IN 查询按此大小分块
+IN_CHUNK = 500
+
+_BUSY_MESSAGES = ("database is locked", "database table is locked", "database is busy")
+_RETRY_PGCODES = ("40001", "40P01")
+
+
+def is_busy_error(e):
+    if isinstance(e, OperationalError) and any(m in str(e.orig).lower() for m in _BUSY_MESSAGES):
+        return True
+    return isinstance(e, DBAPIError) and getattr(e.orig, "pgcode", None) in _RETRY_PGCODES
+
+
+def retry_on_busy(fn=None, attempts=6, base_delay=0.02):
+    """遇到锁冲突时回滚并指数退避重试，超过次数仍失败则抛出原异常"""
+    if fn is None:
+        return lambda f: retry_on_busy(f, attempts, base_delay)
+
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        for i in range(attempts):
+            try:
+                return fn(*args, **kwargs)
+            except DBAPIError as e:
+                if not is_busy_error(e) or i == attempts - 1:
+                    raise
+                db.session.rollback()
+                time.sleep(base_delay * (2 ** i) * (0.5 + random.random()))
+    return wrapper
+
+
+def upsert(table, dialect_name):
+    """带 on_conflict_do_update 的 INSERT（SQLite / PostgreSQL）"""
+    if dialect_name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect_name == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+    else:
+        raise NotImplementedError(f"不支持 {dialect_name} 的 upsert")
+    return insert(table)
+
+
+def increment_upsert(table, keys, counters, dialect_name):
+    """INSERT ... ON CONFLICT (keys) DO UPDATE SET c = c + excluded.c，计数器类表的原子累加"""
+    stmt = upsert(table, dialect_name)
+    return stmt.on_conflict_do_update(
+        index_elements=list(keys),
+        set_={c: table.c[c] + stmt.excluded[c] for c in counters},
+    )
+
+
+def chunks(seq, size=IN_CHUNK):
+    seq = list(seq)
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+def executemany(session, table, columns, rows):
+    """
+    大批量 INSERT：rows 为按 columns 顺序排列的元组，编译一次后直接交给 DBAPI executemany，
+    省掉 SQLAlchemy 逐行组装参数和类型处理。值必须是驱动能直接接受的类型，
+    带类型转换的列（如 SQLite 下的 DateTime）先用 bind_value 转换。
+    不触发 Session 的 do_orm_execute 事件（写通道、缓存版本号、BOM 展开缓存失效都不处理），
+    只用于临时表，或同一事务里已经由 Session 写过库（已占写通道）且不涉及缓存的表。
+    """
+    conn = session.connection()
+    compiled = insert(table).compile(dialect=conn.dialect, column_keys=list(columns))
+    if compiled.positional:
+        order = [columns.index(k) for k in compiled.positiontup]
+        if order != list(range(len(columns))):
+            rows = [tuple(r[i] for i in order) for r in rows]
+    else:
+        rows = [dict(zip(columns, r)) for r in rows]
+    conn.exec_driver_sql(compiled.string, rows)
+
+
+def bind_value(session, column, value):
+    """按当前方言把 Python 值转换成驱动参数（executemany 用）"""
+    dialect = session.get_bind().dialect
+    proc = column.type.dialect_impl(dialect).bind_processor(dialect)
+    return proc(value) if proc else value
@@ -0,0 +1,252 @@
+import json
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, select, insert, delete, func, inspect, text
+from sqlalchemy.orm import Session
+
+from dbutil import side_engine, write_lane
+from models import db, ChangeEvent
+
+# =========================
+# 变更推送（Server-Sent Events）
+#
+# 业务代码调用 emit() 把事件挂在当前 Session 上，提交时写进 change_events 表（与业务数据同一事务），
+# 回滚则一起丢弃，客户端不会收到没落库的变化。
+#
+# 跨进程分发：每个 worker 进程一个后台线程轮询 change_events（id > 已读位置），追加到进程内环形缓冲区；
+# 本进程提交后立即唤醒轮询，其他进程的事件最多晚 EVENTS_POLL_SECONDS 秒。
+# 表 id 是全局递增序号，直接作为 SSE 的 Last-Event-ID，断线后重连到哪个 worker 都能续传。
+# id 顺序即提交顺序：SQLite 写事务本来就串行；PostgreSQL 写事件前拿事务级 advisory 锁直到提交。
+# 订阅者只记住自己读到的序号，发布是 O(1)（追加 + 唤醒），不给每个订阅者单独排队。
+# 每个 SSE 连接仍占一个请求处理单元；要在一个进程里挂几百个连接，用协程 worker 部署
+# （gunicorn -k gevent，见 requirements.txt），此时线程和 threading.Condition 都换成协程版本，等待不占线程。
+# 超过 EVENTS_RETENTION_HOURS 的事件由轮询线程每小时顺带清理。
+#
+# 事件类型：task.created / task.progress / task.completed / task.deleted
+#           mold.created / mold.updated / mold.deleted / mold.life_reached（报工使模具达到寿命）
+#           stock.move / stock.imported（批量出入库、盘点导入，只推汇总）
+#           material.* / product.* / bom.updated / bom.imported
+# =========================
+
+_POLL_BATCH = 500
+_PRUNE_INTERVAL_SECONDS = 3600
+_PG_LOCK_KEY = 0x4D45531  # 任意常量，只要不与其他 advisory 锁冲突
+
+
+class EventBus:
+    def __init__(self, size=2000):
+        self._cond = threading.Condition()
+        self._buf = deque(maxlen=size)   # (id, type, data JSON 文本)
+        self._seq = 0                    # 已读到的最大事件 id
+        self._floor = 0                  # id <= floor 的事件本进程没有（启动前的、已挤出缓冲区的）
+        self._wake = threading.Event()
+        self._engine = None
+        self._ready = False              # change_events 表已存在
+        self._pruned_at = 0.0
+        self._thread = None
+        self.app = None
+        self.subscribers = 0
+
+    def init_app(self, app):
+        # 轮询用独立小引擎：不占请求连接池；测试里每个用例一个库，最后一次 init_app 生效
+        engine = side_engine(app)
+        start = self._max_id(engine)
+        with self._cond:
+            old, self._engine, self.app = self._engine, engine, app
+            self._buf = deque(maxlen=app.config["EVENTS_BUFFER_SIZE"])
+            self._seq = self._floor = start
+            self._ready = start > 0
+            self._pruned_at = time.monotonic()
+        if old is not None:
+            old.dispose()
+        app.extensions["mes_events"] = self
+        if app.config["EVENTS_POLL_SECONDS"] > 0 and self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="mes-events", daemon=True)
+            self._thread.start()
+
+    @staticmethod
+    def _max_id(engine):
+        with engine.connect() as conn:
+            if not inspect(conn).has_table(ChangeEvent.__tablename__):
+                return 0
+            return conn.scalar(select(func.coalesce(func.max(ChangeEvent.id), 0)))
+
+    def wake(self):
+        self._wake.set()
+
+    def _loop(self):
+        while True:
+            self._wake.wait(self.app.config["EVENTS_POLL_SECONDS"])
+            self._wake.clear()
+            try:
+                self.poll()
+            except Exception:
+                self.app.logger.exception("变更事件轮询失败")
+
+    def poll(self):
+        """读入所有进程新提交的事件（id > 已读位置），返回条数；到时间顺带清理过期事件"""
+        with self._cond:
+            engine, after = self._engine, self._seq
+        if not self._ready:
+            if not inspect(engine).has_table(ChangeEvent.__tablename__):
+                return 0
+            self._ready = True
+        n = 0
+        while True:
+            with engine.connect() as conn:
+                rows = conn.execute(
+                    select(ChangeEvent.id, ChangeEvent.type, ChangeEvent.data)
+                    .where(ChangeEvent.id > after).order_by(ChangeEvent.id).limit(_POLL_BATCH)
+                ).all()
+            if not rows or not self._append(engine, rows):
+                break
+            n += len(rows)
+            after = rows[-1][0]
+            if len(rows) < _POLL_BATCH:
+                break
+        if time.monotonic() - self._pruned_at >= _PRUNE_INTERVAL_SECONDS:
+            self._pruned_at = time.monotonic()
+            cutoff = datetime.utcnow() - timedelta(hours=self.app.config["EVENTS_RETENTION_HOURS"])
+            with engine.begin() as conn:
+                conn.execute(delete(ChangeEvent).where(ChangeEvent.created_at < cutoff))
+        return n
+
+    def _append(self, engine, rows):
+        with self._cond:
+            if engine is not self._engine:
+                return False  # 轮询期间换了库（测试）
+            for seq, type_, data in rows:
+                if seq <= self._seq:
+                    continue
+                if len(self._buf) == self._buf.maxlen:
+                    self._floor = self._buf[0][0]
+                self._buf.append((seq, type_, data))
+                self._seq = seq
+            self._cond.notify_all()
+        return True
+
+    def position(self, last_event_id):
+        """Last-Event-ID -> (起始序号, 是否需要客户端重新拉全量)"""
+        with self._cond:
+            seq, floor, engine = self._seq, self._floor, self._engine
+        if not last_event_id:
+            return seq, False
+        if not last_event_id.isdigit() or int(last_event_id) < floor:
+            return seq, True
+        n = int(last_event_id)
+        # 比本进程读到的还新：可能是其他 worker 已推送、本进程还没轮询到的，到库里确认
+        if n <= seq or n <= self._max_id(engine):
+            return n, False
+        return seq, True
+
+    def wait(self, after, timeout):
+        """返回 (序号 > after 的事件, 是否有事件已被挤出缓冲区)；没有新事件时最多等 timeout 秒"""
+        with self._cond:
+            if self._seq <= after:
+                self._cond.wait(timeout)
+            items = []
+            for item in reversed(self._buf):
+                if item[0] <= after:
+                    break
+                items.append(item)
+            items.reverse()
+            return items, after < self._floor
+
+    def add_subscriber(self, n):
+        with self._cond:
+            self.subscribers += n
+
+    @property
+    def last_seq(self):
+        return self._seq
+
+
+event_bus = EventBus()
+
+
+def emit(type_, data, session=None):
+    """登记一条事件，所在事务提交时落库，提交后各进程轮询发布"""
+    session = session or db.session
+    session.info.setdefault("mes_events", []).append((type_, data))
+
+
+@event.listens_for(Session, "before_commit")
+def _store(session):
+    pending = session.info.pop("mes_events", None)
+    if not pending:
+        return
+    write_lane.acquire(session)
+    conn = session.connection()
+    if conn.dialect.name == "postgresql":
+        # 序列号在 INSERT 时分配，提交顺序可能不同；锁到提交为止，按 id 轮询不会漏掉晚提交的小 id
+        conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {"key": _PG_LOCK_KEY})
+    now = datetime.utcnow()
+    conn.execute(insert(ChangeEvent.__table__), [
+        {"type": type_, "data": json.dumps(data, ensure_ascii=False), "created_at": now}
+        for type_, data in pending
+    ])
+    session.info["mes_events_stored"] = True
+
+
+@event.listens_for(Session, "after_commit")
+def _publish(session):
+    if session.info.pop("mes_events_stored", False):
+        event_bus.wake()
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard(session):
+    session.info.pop("mes_events", None)
+    session.info.pop("mes_events_stored", None)
+
+
+# ---------- SSE 输出 ----------
+
+def _format(seq, type_, data):
+    """data 为已序列化的 JSON 文本"""
+    return f"id: {seq}\nevent: {type_}\ndata: {data}\n\n"
+
+
+def stream(last_event_id, types, heartbeat, max_seconds):
+    """
+    SSE 生成器：types 为事件类型前缀（如 task / stock.move），空表示全部。
+    连接保持 max_seconds 后主动结束，浏览器 EventSource 会带 Last-Event-ID 自动重连续传。
+    只在 Last-Event-ID 比本进程已读位置还新时查一次库，之后不占数据库连接。
+    """
+    def wanted(type_):
+        return not types or any(type_ == t or type_.startswith(t + ".") for t in types)
+
+    after, reset = event_bus.position(last_event_id)
+    event_bus.add_subscriber(1)
+    try:
+        yield "retry: 3000\n\n"
+        if reset:
+            yield _format(after, "reset", "{}")
+        deadline = time.monotonic() + max_seconds
+        while time.monotonic() < deadline:
+            items, gap = event_bus.wait(after, heartbeat)
+            if gap:
+                yield _format(after, "reset", "{}")
+            if not items:
+                yield ": ping\n\n"
+                continue
+            chunk = []
+            for seq, type_, data in items:
+                after = seq
+                if wanted(type_):
+                    chunk.append(_format(seq, type_, data))
+            if chunk:
+                yield "".join(chunk)
+    finally:
+        event_bus.add_subscriber(-1)
+
+
+# ---------- 常用事件载荷 ----------
+
+def task_payload(t):
+    return {"id": t.id, "task_no": t.task_no, "mold_id": t.mold_id, "product_id": t.product_id,
+            "operator_name": t.operator_name, "done_qty": t.done_qty, "target_qty": t.target_qty,
+            "status": t.status}
@@ -0,0 +1,193 @@
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, request, make_response
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from dbutil import increment_upsert, write_lane
+from models import db, Material, Product, Mold, BOMItem, TableVersion
+
+try:
+    import brotli
+except ImportError:  # 可选依赖，没有就只用 gzip
+    brotli = None
+
+# =========================
+# 主数据的条件 GET 与响应缓存
+#
+# 1. 版本号：物料/产品/模具/BOM 表在某个事务里有写入（ORM flush 或批量 INSERT/UPDATE/DELETE），
+#    就在同一事务里把 table_versions 中该表的版本号 +1，多进程共享、随事务一起提交/回滚。
+# 2. ETag：由 路径 + 查询参数 + 相关表版本号 算出；If-None-Match 命中直接 304，不查业务表。
+# 3. 响应缓存：同样的键缓存整份响应体（LRU，按条数和字节数淘汰），
+#    大于 HTTP_COMPRESS_MIN_BYTES 的按 Accept-Encoding 预压缩为 br / gzip 后一并缓存。
+# 只有通过 ORM Session 的写入会更新版本号；直接用 Connection 执行的 SQL 需自行调用 bump()。
+# =========================
+
+VERSIONED_MODELS = (Material, Product, Mold, BOMItem)
+VERSIONED_TABLES = {m.__tablename__ for m in VERSIONED_MODELS}
+
+
+# ---------- 版本号 ----------
+
+def bump(session, tables):
+    """当前事务内给 tables 的版本号 +1，同一事务每张表只加一次"""
+    done = session.info.setdefault("bumped_tables", set())
+    tables = set(tables) - done
+    if not tables:
+        return
+    write_lane.acquire(session)
+    conn = session.connection()
+    stmt = increment_upsert(TableVersion.__table__, ("table_name",), ("version",), conn.dialect.name)
+    conn.execute(stmt, [{"table_name": t, "version": 1} for t in sorted(tables)])
+    done |= tables
+
+
+@event.listens_for(Session, "after_flush")
+def _bump_after_flush(session, flush_context):
+    tables = {obj.__tablename__ for obj in list(session.new) + list(session.dirty) + list(session.deleted)
+              if isinstance(obj, VERSIONED_MODELS)}
+    bump(session, tables)
+
+
+@event.listens_for(Session, "do_orm_execute")
+def _bump_bulk(orm_execute_state):
+    if orm_execute_state.is_select:
+        return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is not None and mapper.class_ in VERSIONED_MODELS:
+        bump(orm_execute_state.session, {mapper.class_.__tablename__})
+
+
+@event.listens_for(Session, "after_transaction_end")
+def _reset(session, transaction):
+    if transaction.parent is None:
+        session.info.pop("bumped_tables", None)
+
+
+def table_versions(tables):
+    rows = dict(db.session.execute(
+        select(TableVersion.table_name, TableVersion.version).where(TableVersion.table_name.in_(tables))
+    ).all())
+    return tuple(rows.get(t, 0) for t in tables)
+
+
+# ---------- 响应缓存 ----------
+
+class ResponseCache:
+    """线程安全的 LRU：key -> {"body", "headers", "gzip", "br"}"""
+
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._data = OrderedDict()
+        self._bytes = 0
+        self.hits = self.misses = 0
+
+    def init_app(self, app):
+        self.max_entries = app.config["HTTP_CACHE_MAX_ENTRIES"]
+        self.max_bytes = app.config["HTTP_CACHE_MAX_BYTES"]
+        app.extensions["mes_http_cache"] = self
+
+    @staticmethod
+    def _size(entry):
+        return sum(len(entry[k]) for k in ("body", "gzip", "br") if entry.get(k))
+
+    def get(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        size = self._size(entry)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._bytes -= self._size(old)
+            self._data[key] = entry
+            self._bytes += size
+            while len(self._data) > self.max_entries or self._bytes > self.max_bytes:
+                _, evicted = self._data.popitem(last=False)
+                self._bytes -= self._size(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._data), "bytes": self._bytes, "hits": self.hits, "misses": self.misses}
+
+
+response_cache = ResponseCache()
+
+_KEEP_HEADERS = ("Content-Type", "X-Next-Cursor")
+
+
+def _compress(body):
+    entry = {"gzip": gzip.compress(body, compresslevel=6)}
+    if brotli is not None:
+        entry["br"] = brotli.compress(body, quality=5)
+    return entry
+
+
+def _pick_encoding(entry):
+    accepted = request.accept_encodings
+    for enc in ("br", "gzip"):
+        if entry.get(enc) and accepted[enc]:
+            return enc
+    return None
+
+
+def cached_get(*models):
+    """
+    GET 接口装饰器：响应只取决于 models 对应的表和查询参数时使用。
+    仅缓存 200 响应；错误响应照常返回。
+    """
+    tables = tuple(sorted(m.__tablename__ for m in models))
+
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            versions = table_versions(tables)
+            key = (request.path, tuple(sorted(request.args.items(multi=True))), tables, versions)
+            etag = hashlib.sha1(repr(key).encode()).hexdigest()[:24]
+
+            if request.if_none_match.contains_weak(etag):
+                resp = make_response("", 304)
+                resp.set_etag(etag, weak=True)
+                return resp
+
+            entry = response_cache.get(key)
+            if entry is None:
+                resp = make_response(fn(*args, **kwargs))
+                if resp.status_code != 200 or resp.is_streamed:
+                    return resp
+                body = resp.get_data()
+                entry = {"body": body, "headers": {h: resp.headers[h] for h in _KEEP_HEADERS if h in resp.headers}}
+                if len(body) >= current_app.config["HTTP_COMPRESS_MIN_BYTES"]:
+                    entry.update(_compress(body))
+                response_cache.put(key, entry)
+
+            enc = _pick_encoding(entry)
+            resp = make_response(entry[enc] if enc else entry["body"], 200, entry["headers"])
+            if enc:
+                resp.headers["Content-Encoding"] = enc
+            resp.headers["Vary"] = "Accept-Encoding"
+            resp.headers["Cache-Control"] = "no-cache"  # 允许缓存，但每次都要带 If-None-Match 回来确认
+            resp.set_etag(etag, weak=True)
+            return resp
+        return wrapper
+    return deco
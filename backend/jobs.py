@@ -0,0 +1,145 @@
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from sqlalchemy import inspect, update
+
+from events import emit
+from models import db, ImportJob
+from bom_import import import_rows, iter_text_rows, iter_xlsx_rows, MAX_ERRORS
+
+# =========================
+# 后台导入任务队列
+#
+# 提交时把文件落到 JOB_SPOOL_DIR，并在 import_jobs 表登记一行后立即返回；
+# 本进程线程池逐个执行，每批写库后 commit 并刷新进度。
+# 进程重启后，排队中的任务和心跳超时的执行中任务会重新排队执行
+# （导入是按编码 upsert 的，重跑是安全的）。
+# =========================
+
+FILE_FORMATS = {".csv": "csv", ".tsv": "tsv", ".txt": "tsv", ".xlsx": "xlsx"}
+
+
+class JobQueue:
+    def __init__(self, app=None):
+        self.app = None
+        self.executor = None
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        self.executor = ThreadPoolExecutor(max_workers=app.config["JOB_WORKERS"],
+                                           thread_name_prefix="mes-job")
+        app.extensions["mes_jobs"] = self
+        # 恢复上次未完成的任务，放进线程池里做，不阻塞启动
+        self.executor.submit(self._resume)
+
+    # ---------- 提交 ----------
+    def submit_file(self, fileobj, filename, encoding="utf-8-sig"):
+        """fileobj 为 werkzeug FileStorage"""
+        ext = os.path.splitext(filename or "")[1].lower()
+        fmt = FILE_FORMATS.get(ext)
+        if not fmt:
+            raise ValueError(f"不支持的文件类型：{ext or filename}")
+        path = self._spool_path(ext)
+        fileobj.save(path)
+        return self._create(filename, path, fmt, encoding)
+
+    def submit_text(self, text, filename="import.tsv"):
+        path = self._spool_path(".tsv")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        return self._create(filename, path, "tsv", "utf-8")
+
+    def _spool_path(self, ext):
+        spool = self.app.config["JOB_SPOOL_DIR"]
+        os.makedirs(spool, exist_ok=True)
+        return os.path.join(spool, uuid.uuid4().hex + ext)
+
+    def _create(self, filename, path, fmt, encoding):
+        job = ImportJob(kind="BOM_TREE", filename=filename, source_path=path,
+                        file_format=fmt, encoding=encoding, status="排队中")
+        db.session.add(job)
+        db.session.commit()
+        self.executor.submit(self._run, job.id)
+        return job
+
+    # ---------- 执行 ----------
+    def _claim(self, job_id):
+        """排队中 -> 执行中；多进程同时恢复时只有一个能抢到"""
+        now = datetime.utcnow()
+        res = db.session.execute(
+            update(ImportJob)
+            .where(ImportJob.id == job_id, ImportJob.status == "排队中")
+            .values(status="执行中", started_at=now, heartbeat_at=now, rows_processed=0,
+                    bom_created=0, bom_updated=0, skipped=0, errors=None, error=None)
+        )
+        db.session.commit()
+        return res.rowcount == 1
+
+    def _run(self, job_id):
+        with self.app.app_context():
+            if not self._claim(job_id):
+                return
+            job = db.session.get(ImportJob, job_id)
+
+            def progress(importer):
+                _record(job, importer)
+                job.heartbeat_at = datetime.utcnow()
+                db.session.commit()
+
+            try:
+                with open(job.source_path, "rb") as f:
+                    if job.file_format == "xlsx":
+                        rows = iter_xlsx_rows(f)
+                    else:
+                        rows = iter_text_rows(f, job.encoding)
+                    importer = import_rows(rows, self.app.config["IMPORT_BATCH_SIZE"], on_flush=progress)
+                _record(job, importer)
+                job.status = "已完成"
+                emit("bom.imported", {"job_id": job.id, **importer.summary()})
+            except Exception as e:
+                db.session.rollback()
+                job.status = "失败"
+                job.error = "文件编码错误" if isinstance(e, UnicodeDecodeError) else str(e)
+            job.finished_at = datetime.utcnow()
+            db.session.commit()
+            _remove(job.source_path)
+
+    def _resume(self):
+        with self.app.app_context():
+            if not inspect(db.engine).has_table(ImportJob.__tablename__):
+                return
+            stale = datetime.utcnow() - timedelta(seconds=self.app.config["JOB_STALE_SECONDS"])
+            db.session.execute(
+                update(ImportJob)
+                .where(ImportJob.status == "执行中",
+                       ImportJob.heartbeat_at.is_(None) | (ImportJob.heartbeat_at < stale))
+                .values(status="排队中")
+            )
+            db.session.commit()
+            ids = [i for (i,) in db.session.query(ImportJob.id)
+                   .filter(ImportJob.status == "排队中").order_by(ImportJob.id)]
+        for job_id in ids:
+            self.executor.submit(self._run, job_id)
+
+
+def _record(job, importer):
+    job.rows_processed = importer.rows
+    job.bom_created = importer.created_bom
+    job.bom_updated = importer.updated_bom
+    job.skipped = importer.skipped
+    job.errors = json.dumps(importer.errors[:MAX_ERRORS], ensure_ascii=False)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+job_queue = JobQueue()
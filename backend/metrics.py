@@ -0,0 +1,194 @@
+import bisect
+import threading
+import time
+
+from flask import request, has_request_context
+from sqlalchemy import event
+
+from models import db
+
+# =========================
+# 请求级性能埋点
+#
+#   - before/after_request 计时，按 (方法, 路由模板) 累加延迟直方图，按状态码计数
+#   - 引擎 before/after_cursor_execute 统计每个请求的 SQL 条数与耗时，
+#     写进 Server-Timing 响应头（浏览器开发者工具 Timing 页可直接看到），并按路由累加
+#   - 单条 SQL 超过 SLOW_QUERY_MS 记 WARNING 日志；请求结束后另开连接取执行计划
+#     （SQLite 为 EXPLAIN QUERY PLAN，PostgreSQL 为 EXPLAIN，都不真正执行语句）一起记下
+#   - GET /api/metrics 输出 Prometheus 文本格式
+#
+# 开销：每条 SQL 两次 perf_counter + 一次线程局部变量读取，每个请求一次加锁累加，常开即可。
+# 路由按 url_rule 模板聚合（/api/tasks/<int:task_id>），标签个数固定，不随 id 增长；
+# 后台线程（导入任务、快照）的 SQL 不属于任何请求，只参与慢查询统计。
+# 计数在进程内，多进程部署时 Prometheus 按实例分别抓取。
+# =========================
+
+# 每个请求最多对几条慢查询取执行计划
+MAX_EXPLAIN = 3
+
+_local = threading.local()
+
+
+class _Route:
+    __slots__ = ("buckets", "count", "seconds", "sql_count", "sql_seconds", "status")
+
+    def __init__(self, n_buckets):
+        self.buckets = [0] * (n_buckets + 1)  # 最后一格为 +Inf
+        self.count, self.seconds = 0, 0.0
+        self.sql_count, self.sql_seconds = 0, 0.0
+        self.status = {}
+
+
+class Metrics:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.enabled = False
+        self.buckets = ()
+        self.slow_seconds = None
+        self.routes = {}  # (method, 路由模板) -> _Route
+        self.slow_queries = 0
+        self.started = time.time()
+        self.logger = None
+
+    def init_app(self, app):
+        self.enabled = app.config["METRICS_ENABLED"]
+        self.buckets = tuple(sorted(app.config["METRICS_BUCKETS"]))
+        slow_ms = app.config["SLOW_QUERY_MS"]
+        self.slow_seconds = slow_ms / 1000 if slow_ms > 0 else None
+        self.logger = app.logger
+        app.extensions["mes_metrics"] = self
+        if not self.enabled:
+            return
+
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, "before_cursor_execute", _before_cursor)
+        event.listen(engine, "after_cursor_execute", self._after_cursor)
+        app.before_request(self._start)
+        app.after_request(self._finish)
+        app.teardown_request(self._teardown)
+
+    # ---------- 请求 ----------
+    def _start(self):
+        # [开始时间, SQL 条数, SQL 秒数, 待取执行计划的慢查询]
+        _local.req = [time.perf_counter(), 0, 0.0, []]
+
+    def _finish(self, response):
+        req = getattr(_local, "req", None)
+        if req is None:
+            return response
+        elapsed = time.perf_counter() - req[0]
+        rule = request.url_rule.rule if request.url_rule is not None else "<unmatched>"
+        key = (request.method, rule)
+        i = bisect.bisect_left(self.buckets, elapsed)
+        with self._lock:
+            r = self.routes.get(key)
+            if r is None:
+                r = self.routes[key] = _Route(len(self.buckets))
+            r.buckets[i] += 1
+            r.count += 1
+            r.seconds += elapsed
+            r.sql_count += req[1]
+            r.sql_seconds += req[2]
+            r.status[response.status_code] = r.status.get(response.status_code, 0) + 1
+        response.headers["Server-Timing"] = (
+            f'app;dur={elapsed * 1000:.1f}, db;dur={req[2] * 1000:.1f};desc="{req[1]} queries"'
+        )
+        return response
+
+    def _teardown(self, exc):
+        req = _local.__dict__.pop("req", None)
+        if req and req[3]:
+            for statement, params, seconds in req[3]:
+                self._log_slow(statement, seconds, self._explain(statement, params))
+
+    # ---------- SQL ----------
+    def _after_cursor(self, conn, cursor, statement, parameters, context, executemany):
+        started = conn.info.pop("metrics_started", None)
+        if started is None:
+            return
+        seconds = time.perf_counter() - started
+        req = getattr(_local, "req", None)
+        if req is not None:
+            req[1] += 1
+            req[2] += seconds
+        if self.slow_seconds is None or seconds < self.slow_seconds or statement.startswith("EXPLAIN"):
+            return
+        with self._lock:
+            self.slow_queries += 1
+        if executemany:
+            parameters = parameters[0] if parameters else None
+        if req is not None and len(req[3]) < MAX_EXPLAIN:
+            req[3].append((statement, parameters, seconds))
+        else:
+            self._log_slow(statement, seconds, None)
+
+    def _explain(self, statement, params):
+        prefix = "EXPLAIN QUERY PLAN " if db.engine.dialect.name == "sqlite" else "EXPLAIN "
+        try:
+            with db.engine.connect() as conn:
+                return [str(row[-1]) for row in conn.exec_driver_sql(prefix + statement, params or ())]
+        except Exception as e:  # 临时表、已回滚的结构等取不到计划，不影响请求
+            return [f"（无法取得执行计划：{e.__class__.__name__}）"]
+
+    def _log_slow(self, statement, seconds, plan):
+        where = f"{request.method} {request.path}" if has_request_context() else "后台线程"
+        lines = [f"慢查询 {seconds * 1000:.1f} ms（{where}）：{' '.join(statement.split())}"]
+        if plan:
+            lines += ["  计划：" + p for p in plan]
+        self.logger.warning("\n".join(lines))
+
+    # ---------- Prometheus ----------
+    def render(self):
+        with self._lock:
+            routes = [(k, r.buckets[:], r.count, r.seconds, r.sql_count, r.sql_seconds, dict(r.status))
+                      for k, r in sorted(self.routes.items())]
+            slow = self.slow_queries
+
+        out = [
+            "# HELP mes_http_request_duration_seconds 请求耗时（到生成响应为止，SSE 等流式响应不含推送时间）",
+            "# TYPE mes_http_request_duration_seconds histogram",
+        ]
+        for (method, rule), buckets, count, seconds, _, _, _ in routes:
+            labels = f'method="{method}",route="{_escape(rule)}"'
+            cumulative = 0
+            for le, n in zip(self.buckets, buckets):
+                cumulative += n
+                out.append(f'mes_http_request_duration_seconds_bucket{{{labels},le="{le}"}} {cumulative}')
+            out.append(f'mes_http_request_duration_seconds_bucket{{{labels},le="+Inf"}} {count}')
+            out.append(f"mes_http_request_duration_seconds_sum{{{labels}}} {seconds:.6f}")
+            out.append(f"mes_http_request_duration_seconds_count{{{labels}}} {count}")
+
+        out += ["# HELP mes_http_requests_total 请求数（按状态码）", "# TYPE mes_http_requests_total counter"]
+        for (method, rule), _, _, _, _, _, status in routes:
+            for code, n in sorted(status.items()):
+                out.append(f'mes_http_requests_total{{method="{method}",route="{_escape(rule)}",'
+                           f'status="{code}"}} {n}')
+
+        out += ["# HELP mes_db_queries_total 请求内执行的 SQL 条数", "# TYPE mes_db_queries_total counter"]
+        out += [f'mes_db_queries_total{{method="{m}",route="{_escape(rule)}"}} {n}'
+                for (m, rule), _, _, _, n, _, _ in routes]
+        out += ["# HELP mes_db_query_seconds_total 请求内 SQL 累计耗时", "# TYPE mes_db_query_seconds_total counter"]
+        out += [f'mes_db_query_seconds_total{{method="{m}",route="{_escape(rule)}"}} {s:.6f}'
+                for (m, rule), _, _, _, _, s, _ in routes]
+
+        out += [
+            "# HELP mes_db_slow_queries_total 超过 SLOW_QUERY_MS 的 SQL 条数（含后台线程）",
+            "# TYPE mes_db_slow_queries_total counter",
+            f"mes_db_slow_queries_total {slow}",
+            "# HELP mes_process_start_time_seconds 进程启动时间（Unix 秒）",
+            "# TYPE mes_process_start_time_seconds gauge",
+            f"mes_process_start_time_seconds {self.started:.3f}",
+        ]
+        return "\n".join(out) + "\n"
+
+
+def _before_cursor(conn, cursor, statement, parameters, context, executemany):
+    conn.info["metrics_started"] = time.perf_counter()
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = Metrics()
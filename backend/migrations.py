@@ -0,0 +1,133 @@
+import sys
+from datetime import datetime
+
+from sqlalchemy import text, select, insert, inspect
+from sqlalchemy.exc import OperationalError
+
+import rollups
+import search
+import task_numbers
+from config import Config
+from models import db, SchemaMigration
+
+# =========================
+# 数据库迁移：db.create_all() 只会建缺失的表，已有库的新索引/数据变更写在这里。
+# 每个迁移一个版本号，执行过的记录在 schema_migrations；DDL 必须可重复执行。
+#
+#   python migrations.py            升级到最新
+#   python migrations.py status     查看已执行/待执行
+# db_init.py 和 app.py 直接运行时会自动升级。
+# =========================
+
+MIGRATIONS = []
+
+
+def migration(version, description):
+    def deco(fn):
+        MIGRATIONS.append((version, description, fn))
+        return fn
+    return deco
+
+
+def _create_indexes(conn, specs):
+    for name, table, cols in specs:
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({', '.join(cols)})"))
+
+
+@migration(1, "列表过滤 + id 倒序分页索引")
+def _list_indexes(conn):
+    _create_indexes(conn, [
+        ("ix_materials_type_id", "materials", ["material_type", "id"]),
+        ("ix_molds_status_id", "molds", ["status", "id"]),
+        ("ix_tasks_status_id", "tasks", ["status", "id"]),
+        ("ix_tasks_operator_id", "tasks", ["operator_name", "id"]),
+        ("ix_tasks_mold_id", "tasks", ["mold_id", "id"]),
+        ("ix_tasks_created_at", "tasks", ["created_at"]),
+    ])
+
+
+@migration(2, "报工/库存流水/物料需求/BOM 反查索引")
+def _hot_lookup_indexes(conn):
+    _create_indexes(conn, [
+        ("ix_reports_task_created", "reports", ["task_id", "created_at"]),
+        ("ix_stock_moves_material_created", "stock_moves", ["material_id", "created_at"]),
+        ("ix_stock_moves_ref", "stock_moves", ["ref_type", "ref_id"]),
+        ("ix_stock_moves_created_at", "stock_moves", ["created_at"]),
+        ("ix_tmr_material_task", "task_material_requirements", ["material_id", "task_id"]),
+        ("ix_bom_items_material_product", "bom_items", ["material_id", "product_id"]),
+    ])
+
+
+@migration(3, "看板汇总表回填")
+def _backfill_rollups(conn):
+    rollups.rebuild(conn)
+
+
+@migration(4, "物料/模具/产品搜索索引（FTS5 trigram + 同步触发器）")
+def _search_index(conn):
+    if conn.dialect.name != "sqlite":
+        return  # 其他数据库走 LIKE 退路
+    try:
+        search.install(conn)
+    except OperationalError as e:
+        # SQLite 编译时没带 FTS5 或版本低于 3.34（无 trigram）：搜索退回 LIKE，升级后可 python search.py rebuild
+        print(f"skip search index: {e.orig}", file=sys.stderr)
+
+
+@migration(5, "任务单号计数器回填")
+def _task_sequences(conn):
+    task_numbers.rebuild(conn, Config.TASK_NO_PREFIX)
+
+
+@migration(6, "tasks 增加交期 due_date，排产用的 产品-模具 索引")
+def _task_due_date(conn):
+    if "due_date" not in {c["name"] for c in inspect(conn).get_columns("tasks")}:
+        conn.execute(text("ALTER TABLE tasks ADD COLUMN due_date TIMESTAMP"))
+    _create_indexes(conn, [("ix_tasks_product_mold", "tasks", ["product_id", "mold_id"])])
+
+
+def applied_versions(engine):
+    with engine.connect() as conn:
+        return set(conn.execute(select(SchemaMigration.version)).scalars())
+
+
+def upgrade(engine, target=None):
+    """建缺失的表，再按版本号执行未执行过的迁移；返回本次执行的版本号"""
+    db.metadata.create_all(engine)
+    applied = applied_versions(engine)
+    done = []
+    for version, description, fn in sorted(MIGRATIONS, key=lambda m: m[0]):
+        if version in applied or (target is not None and version > target):
+            continue
+        with engine.begin() as conn:
+            fn(conn)
+            conn.execute(insert(SchemaMigration).values(
+                version=version, description=description, applied_at=datetime.utcnow()
+            ))
+        done.append(version)
+    if done:
+        # 新索引建好后刷新统计信息，让查询规划器用上
+        with engine.begin() as conn:
+            conn.execute(text("ANALYZE"))
+    return done
+
+
+def status(engine):
+    applied = applied_versions(engine)
+    return [
+        {"version": v, "description": d, "applied": v in applied}
+        for v, d, _ in sorted(MIGRATIONS, key=lambda m: m[0])
+    ]
+
+
+if __name__ == "__main__":
+    from db_init import create_app
+
+    app = create_app()
+    with app.app_context():
+        if len(sys.argv) > 1 and sys.argv[1] == "status":
+            db.metadata.create_all(db.engine)
+            for m in status(db.engine):
+                print(f"{m['version']:>4}  {'已执行' if m['applied'] else '待执行'}  {m['description']}")
+        else:
+            print("applied:", upgrade(db.engine) or "nothing to do")
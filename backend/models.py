@@ -1,5 +1,6 @@
 from flask_sqlalchemy import SQLAlchemy
 from datetime import datetime
+import json
 
 db = SQLAlchemy()
 
@@ -21,6 +22,10 @@ class Material(db.Model):
     unit = db.Column(db.String(16), nullable=False, default="pcs")
     safety_stock = db.Column(db.Integer, nullable=False, default=0)
 
+    __table_args__ = (
+        db.Index("ix_materials_type_id", "material_type", "id"),
+    )
+
     def to_dict(self):
         return {
             "id": self.id,
@@ -89,6 +94,7 @@ class BOMItem(db.Model):
 
     __table_args__ = (
         db.UniqueConstraint("product_id", "material_id", name="uq_bom_product_material"),
+        db.Index("ix_bom_items_material_product", "material_id", "product_id"),  # where-used 反查
     )
 
     def to_dict(self):
@@ -112,12 +118,18 @@ class StockMove(db.Model):
     material_id = db.Column(db.Integer, db.ForeignKey("materials.id"), nullable=False)
     qty = db.Column(db.Integer, nullable=False)              # +入库 / -出库
     move_type = db.Column(db.String(16), nullable=False)     # IN / OUT / ADJUST
-    ref_type = db.Column(db.String(32), nullable=True)       # TASK / MANUAL
+    ref_type = db.Column(db.String(32), nullable=True)       # TASK / MANUAL / RECEIPT / COUNT
     ref_id = db.Column(db.String(64), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
     material = db.relationship("Material")
 
+    __table_args__ = (
+        db.Index("ix_stock_moves_material_created", "material_id", "created_at"),
+        db.Index("ix_stock_moves_ref", "ref_type", "ref_id"),
+        db.Index("ix_stock_moves_created_at", "created_at"),
+    )
+
     def to_dict(self):
         return {
             "id": self.id,
@@ -131,6 +143,35 @@ class StockMove(db.Model):
         }
 
 
+class InventorySnapshot(db.Model):
+    """库存快照：cutoff 时刻（含）之前所有流水累加后的各物料结存，见 snapshots.py"""
+    __tablename__ = "inventory_snapshots"
+    id = db.Column(db.Integer, primary_key=True)
+
+    cutoff = db.Column(db.DateTime, unique=True, nullable=False)
+    base_snapshot_id = db.Column(db.Integer, nullable=True)   # 在哪个快照基础上累加得到
+    material_count = db.Column(db.Integer, nullable=False, default=0)
+    move_count = db.Column(db.Integer, nullable=False, default=0)  # 本次累加的流水条数
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "cutoff": self.cutoff.isoformat(),
+            "base_snapshot_id": self.base_snapshot_id,
+            "material_count": self.material_count,
+            "move_count": self.move_count,
+            "created_at": self.created_at.isoformat(),
+        }
+
+
+class InventorySnapshotLine(db.Model):
+    __tablename__ = "inventory_snapshot_lines"
+    snapshot_id = db.Column(db.Integer, db.ForeignKey("inventory_snapshots.id"), primary_key=True)
+    material_id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    on_hand = db.Column(db.Integer, nullable=False, default=0)
+
+
 # =========================
 # Phase 1: Mold / Task / Report
 # =========================
@@ -146,6 +187,10 @@ class Mold(db.Model):
     status = db.Column(db.String(16), nullable=False, default="空闲")  # 使用中/空闲/维修
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
+    __table_args__ = (
+        db.Index("ix_molds_status_id", "status", "id"),
+    )
+
     def to_dict(self):
         return {
             "id": self.id,
@@ -173,10 +218,21 @@ class Task(db.Model):
     done_qty = db.Column(db.Integer, nullable=False, default=0)
     status = db.Column(db.String(16), nullable=False, default="进行中")
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # 交期（UTC，可选）：排产按拖期最小化时使用
+    due_date = db.Column(db.DateTime, nullable=True)
 
     mold = db.relationship("Mold")
     product = db.relationship("Product")
 
+    # 列表过滤 + id 倒序分页的访问路径
+    __table_args__ = (
+        db.Index("ix_tasks_status_id", "status", "id"),
+        db.Index("ix_tasks_operator_id", "operator_name", "id"),
+        db.Index("ix_tasks_mold_id", "mold_id", "id"),
+        db.Index("ix_tasks_created_at", "created_at"),
+        db.Index("ix_tasks_product_mold", "product_id", "mold_id"),  # 排产：做过同一产品的模具
+    )
+
     def to_dict(self):
         return {
             "id": self.id,
@@ -192,6 +248,7 @@ class Task(db.Model):
             "done_qty": self.done_qty,
             "status": self.status,
             "created_at": self.created_at.isoformat(),
+            "due_date": self.due_date.isoformat() if self.due_date else None,
         }
 
 
@@ -207,8 +264,10 @@ class TaskMaterialRequirement(db.Model):
     task = db.relationship("Task")
     material = db.relationship("Material")
 
+    # 按任务查询走 uq_task_material 的前缀，按物料汇总/反查另建索引
     __table_args__ = (
         db.UniqueConstraint("task_id", "material_id", name="uq_task_material"),
+        db.Index("ix_tmr_material_task", "material_id", "task_id"),
     )
 
     def to_dict(self):
@@ -236,6 +295,10 @@ class Report(db.Model):
 
     task = db.relationship("Task")
 
+    __table_args__ = (
+        db.Index("ix_reports_task_created", "task_id", "created_at"),
+    )
+
     def to_dict(self):
         return {
             "id": self.id,
@@ -244,3 +307,147 @@ class Report(db.Model):
             "qty": self.qty,
             "created_at": self.created_at.isoformat(),
         }
+
+
+class ReportKey(db.Model):
+    """离线终端批量补报的幂等键：同一 key 只入账一次"""
+    __tablename__ = "report_keys"
+    key = db.Column(db.String(64), primary_key=True)
+    report_id = db.Column(db.Integer, db.ForeignKey("reports.id"), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+# =========================
+# 看板汇总表（rollups.py 在报工/出入库事务内增量维护）
+# =========================
+
+class ProductionRollup(db.Model):
+    """按 生产日 + 班次 + 操作员 + 模具 汇总的报工数量"""
+    __tablename__ = "rollup_production"
+    id = db.Column(db.Integer, primary_key=True)
+
+    day = db.Column(db.Date, nullable=False)                 # 生产日（跨零点的夜班算前一天）
+    shift = db.Column(db.String(16), nullable=False)
+    operator_name = db.Column(db.String(64), nullable=False)
+    mold_id = db.Column(db.Integer, nullable=False)
+    qty = db.Column(db.Integer, nullable=False, default=0)
+    report_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint("day", "shift", "operator_name", "mold_id", name="uq_rollup_production"),
+        db.Index("ix_rollup_production_mold_day", "mold_id", "day"),
+    )
+
+
+class StockRollup(db.Model):
+    """按 生产日 + 物料 汇总的出入库数量"""
+    __tablename__ = "rollup_stock_daily"
+    id = db.Column(db.Integer, primary_key=True)
+
+    day = db.Column(db.Date, nullable=False)
+    material_id = db.Column(db.Integer, nullable=False)
+    in_qty = db.Column(db.Integer, nullable=False, default=0)
+    out_qty = db.Column(db.Integer, nullable=False, default=0)
+    move_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint("day", "material_id", name="uq_rollup_stock_daily"),
+    )
+
+
+class TaskStatusCount(db.Model):
+    """各状态任务数"""
+    __tablename__ = "rollup_task_status"
+    status = db.Column(db.String(16), primary_key=True)
+    task_count = db.Column(db.Integer, nullable=False, default=0)
+
+
+class TableVersion(db.Model):
+    """主数据表的版本号：表有写入的事务里 +1，用作 ETag 和响应缓存的键（见 httpcache.py）"""
+    __tablename__ = "table_versions"
+    table_name = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+
+class TaskSequence(db.Model):
+    """任务单号计数器：每个前缀（如 T-20260301）一行，分配时原子 +1（见 task_numbers.py）"""
+    __tablename__ = "task_sequences"
+    prefix = db.Column(db.String(32), primary_key=True)
+    last_no = db.Column(db.Integer, nullable=False, default=0)
+
+
+class ChangeEvent(db.Model):
+    """变更推送事件：与业务写入同一事务落库，id 是全局递增序号（SSE 的 Last-Event-ID），各 worker 轮询分发（见 events.py）"""
+    __tablename__ = "change_events"
+    id = db.Column(db.Integer, primary_key=True)
+    type = db.Column(db.String(64), nullable=False)
+    data = db.Column(db.Text, nullable=False)  # JSON
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow, index=True)
+
+    # SQLite：删掉的最大 id 也不复用，序号只增不减
+    __table_args__ = {"sqlite_autoincrement": True}
+
+
+# =========================
+# 数据库版本（migrations.py 维护）
+# =========================
+
+class SchemaMigration(db.Model):
+    __tablename__ = "schema_migrations"
+    version = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    description = db.Column(db.String(255), nullable=False)
+    applied_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+
+# =========================
+# 后台导入任务
+# =========================
+
+class ImportJob(db.Model):
+    __tablename__ = "import_jobs"
+    id = db.Column(db.Integer, primary_key=True)
+
+    kind = db.Column(db.String(32), nullable=False, default="BOM_TREE")
+    filename = db.Column(db.String(255), nullable=True)       # 原始文件名
+    source_path = db.Column(db.String(512), nullable=True)    # 暂存文件路径（重启后据此重跑）
+    file_format = db.Column(db.String(8), nullable=False)     # csv / tsv / xlsx
+    encoding = db.Column(db.String(32), nullable=False, default="utf-8-sig")
+    status = db.Column(db.String(16), nullable=False, default="排队中")  # 排队中/执行中/已完成/失败
+
+    rows_processed = db.Column(db.Integer, nullable=False, default=0)
+    bom_created = db.Column(db.Integer, nullable=False, default=0)
+    bom_updated = db.Column(db.Integer, nullable=False, default=0)
+    skipped = db.Column(db.Integer, nullable=False, default=0)
+    errors = db.Column(db.Text, nullable=True)                # JSON: 跳过行的原因
+    error = db.Column(db.Text, nullable=True)                 # 整体失败原因
+
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime, nullable=True)
+    heartbeat_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index("ix_import_jobs_status", "status"),
+    )
+
+    def to_dict(self):
+        rows_per_sec = None
+        end = self.finished_at or self.heartbeat_at
+        if self.started_at and end and end > self.started_at:
+            rows_per_sec = round(self.rows_processed / (end - self.started_at).total_seconds(), 1)
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "filename": self.filename,
+            "status": self.status,
+            "rows_processed": self.rows_processed,
+            "bom_created": self.bom_created,
+            "bom_updated": self.bom_updated,
+            "skipped": self.skipped,
+            "errors": json.loads(self.errors) if self.errors else [],
+            "error": self.error,
+            "rows_per_sec": rows_per_sec,
+            "created_at": self.created_at.isoformat(),
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
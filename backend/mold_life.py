@@ -0,0 +1,112 @@
+from datetime import timedelta
+
+from flask import current_app
+from sqlalchemy import select, func, and_, case
+
+import rollups
+from models import db, Mold, Task, ProductionRollup
+
+# =========================
+# 模具寿命预测
+#
+#   日均冲次   = 最近 MOLD_LIFE_WINDOW_DAYS 个生产日的报工数 / 天数（模具首次报工晚于窗口起点时从首次报工算起）
+#   剩余寿命   = total_life - used_count
+#   排队数量   = 该模具进行中任务的 Σ(target_qty - done_qty)
+#   预计到寿日 = 今天 + 剩余寿命 / 日均冲次
+# 报工数取自看板汇总表 rollup_production（报工时增量累加），读取量只和窗口天数×班次×操作员有关，
+# 不扫 reports 明细；排队数量走 (status, id) 索引只读进行中任务。
+#
+# 等级：到寿（used_count >= total_life）/ 预警（剩余比例或剩余天数低于阈值，或排队任务做完就会超寿命）/ 正常。
+# 报工累加 used_count 时达到寿命的模具在同一条 UPDATE 里切到 维修（MOLD_AUTO_MAINTENANCE，见 production.py）。
+# total_life <= 0 视为未设寿命，不参与预测。
+# =========================
+
+LEVELS = ("到寿", "预警", "正常")
+
+
+def shot_rates(mold_ids, today, window_days):
+    """{mold_id: (窗口内报工数, 实际天数)}"""
+    start = today - timedelta(days=window_days - 1)
+    q = (
+        select(ProductionRollup.mold_id, func.sum(ProductionRollup.qty), func.min(ProductionRollup.day))
+        .where(ProductionRollup.day >= start, ProductionRollup.day <= today)
+        .group_by(ProductionRollup.mold_id)
+    )
+    if mold_ids is not None:
+        q = q.where(ProductionRollup.mold_id.in_(mold_ids))
+    return {mid: (qty, (today - first).days + 1) for mid, qty, first in db.session.execute(q)}
+
+
+def _queued(mold_ids):
+    remaining = case((Task.target_qty > Task.done_qty, Task.target_qty - Task.done_qty), else_=0)
+    q = (
+        select(Task.mold_id, func.sum(remaining), func.count())
+        .where(Task.status == "进行中")
+        .group_by(Task.mold_id)
+    )
+    if mold_ids is not None:
+        q = q.where(Task.mold_id.in_(mold_ids))
+    return {mid: (qty, n) for mid, qty, n in db.session.execute(q)}
+
+
+def _level(used, life, days_left, queued_qty, cfg):
+    remaining = life - used
+    if remaining <= 0:
+        return "到寿"
+    if (remaining / life <= cfg["MOLD_LIFE_WARN_PCT"] or queued_qty >= remaining
+            or (days_left is not None and days_left <= cfg["MOLD_LIFE_WARN_DAYS"])):
+        return "预警"
+    return "正常"
+
+
+def forecast(mold_ids=None, level=None, limit=None):
+    """按预计到寿从早到晚排列；mold_ids 为 None 时取全部设了寿命的模具"""
+    cfg = current_app.config
+    window = cfg["MOLD_LIFE_WINDOW_DAYS"]
+    today = rollups.production_day()
+
+    q = select(Mold.id, Mold.mold_code, Mold.mold_name, Mold.status, Mold.total_life, Mold.used_count) \
+        .where(Mold.total_life > 0)
+    if mold_ids is not None:
+        q = q.where(Mold.id.in_(mold_ids))
+    molds = db.session.execute(q).all()
+    ids = [m[0] for m in molds] if mold_ids is not None else None
+    rates = shot_rates(ids, today, window)
+    queued = _queued(ids)
+
+    result = []
+    for mid, code, name, status, life, used in molds:
+        qty, days = rates.get(mid, (0, window))
+        rate = qty / days if qty else 0.0
+        remaining = max(life - used, 0)
+        queued_qty, queued_tasks = queued.get(mid, (0, 0))
+        days_left = remaining / rate if rate else None
+        item = {
+            "mold_id": mid, "mold_code": code, "mold_name": name, "status": status,
+            "total_life": life, "used_count": used, "remaining": remaining,
+            "remaining_pct": round(remaining / life, 4),
+            "shots_per_day": round(rate, 2),
+            "queued_qty": queued_qty, "queued_tasks": queued_tasks,
+            "exhausted_by_queue": queued_qty >= remaining,
+            "days_left": round(days_left, 1) if days_left is not None else None,
+            "eol_date": (today + timedelta(days=int(days_left))).isoformat() if days_left is not None else None,
+            "level": _level(used, life, days_left, queued_qty, cfg),
+        }
+        if level is None or item["level"] == level:
+            result.append(item)
+
+    result.sort(key=lambda x: (LEVELS.index(x["level"]),
+                               x["days_left"] if x["days_left"] is not None else float("inf"),
+                               x["remaining_pct"], x["mold_id"]))
+    return result[:limit] if limit else result
+
+
+def next_status(qty, current):
+    """
+    报工累加 qty 后模具状态的 SQL 表达式：到寿自动切 维修（开关打开时），否则为 current。
+    current 为不考虑寿命时的目标状态表达式
+    """
+    if not current_app.config["MOLD_AUTO_MAINTENANCE"]:
+        return current
+    reached = and_(Mold.total_life > 0, Mold.used_count + qty >= Mold.total_life)
+    return case((reached, "维修"), else_=current)
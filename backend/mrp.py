@@ -0,0 +1,69 @@
+from sqlalchemy import select, func, case
+
+from models import db, Material, Inventory, Task, TaskMaterialRequirement
+
+# =========================
+# MRP 运算：所有进行中任务的未发料需求按物料汇总，与库存净额比对
+#
+#   demand     = Σ max(required_qty - issued_qty, 0)   （进行中任务）
+#   available  = on_hand - reserved
+#   shortage   = max(demand - available, 0)             缺料数
+#   suggest    = max(demand + safety_stock - available, 0)  建议采购数（补足安全库存）
+#
+# 汇总在数据库里一次 GROUP BY 完成，Python 只处理每个物料一行的结果
+# =========================
+
+
+def _demand_subquery():
+    req = TaskMaterialRequirement
+    outstanding = case((req.required_qty > req.issued_qty, req.required_qty - req.issued_qty), else_=0)
+    return (
+        select(
+            req.material_id.label("material_id"),
+            func.sum(outstanding).label("demand"),
+            func.count(case((req.required_qty > req.issued_qty, req.task_id))).label("task_count"),
+        )
+        .join(Task, Task.id == req.task_id)
+        .where(Task.status == "进行中")
+        .group_by(req.material_id)
+        .subquery()
+    )
+
+
+def run_mrp(include_all=False):
+    d = _demand_subquery()
+    on_hand = func.coalesce(Inventory.on_hand, 0)
+    reserved = func.coalesce(Inventory.reserved, 0)
+    rows = db.session.execute(
+        select(
+            Material.id, Material.material_code, Material.material_name, Material.unit,
+            Material.safety_stock, on_hand, reserved, d.c.demand, d.c.task_count,
+        )
+        .join(d, d.c.material_id == Material.id)
+        .outerjoin(Inventory, Inventory.material_id == Material.id)
+        .where(d.c.demand > 0)
+    )
+
+    result = []
+    for mid, code, name, unit, safety, oh, rs, demand, task_count in rows:
+        available = oh - rs
+        shortage = max(demand - available, 0)
+        suggest = max(demand + safety - available, 0)
+        if not include_all and suggest <= 0:
+            continue
+        result.append({
+            "material_id": mid,
+            "material_code": code,
+            "material_name": name,
+            "unit": unit,
+            "demand_qty": demand,
+            "task_count": task_count,
+            "on_hand": oh,
+            "reserved": rs,
+            "available": available,
+            "safety_stock": safety,
+            "shortage_qty": shortage,
+            "suggest_purchase_qty": suggest,
+        })
+    result.sort(key=lambda x: (-x["shortage_qty"], -x["suggest_purchase_qty"], x["material_code"]))
+    return result
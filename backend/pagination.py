@@ -0,0 +1,120 @@
+from datetime import datetime
+
+from flask import current_app, request, jsonify
+
+from serializers import dump_list
+
+# =========================
+# 列表接口统一契约（keyset 分页 + 过滤 + 字段投影）
+#
+#   ?limit=200            每页条数，上限 API_MAX_PAGE_SIZE
+#   ?cursor=<id>          上一页响应头 X-Next-Cursor 的值，返回 id < cursor 的下一页（不带 limit 时每页 API_PAGE_SIZE 条）
+#   ?status= / operator_name= / mold_id= / product_id= / material_type=
+#   ?created_from= / created_to=   ISO 日期或时间，按 created_at 过滤
+#   ?fields=id,task_no    只返回指定字段（id 始终返回）
+#
+# 响应体仍是数组；还有下一页时带 X-Next-Cursor 响应头。
+# limit / cursor 都不带时不分页，返回全部（页面下拉框、老客户端一次 GET 取全量）
+# =========================
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+# 查询参数 -> 模型字段名；模型没有该字段时忽略
+EQ_FILTERS = {
+    "status": ("status", str),
+    "operator_name": ("operator_name", str),
+    "mold_id": ("mold_id", int),
+    "product_id": ("product_id", int),
+    "material_type": ("material_type", str),
+}
+
+
+def _parse_dt(name):
+    v = request.args.get(name, "").strip()
+    if not v:
+        return None
+    try:
+        return datetime.fromisoformat(v)
+    except ValueError:
+        raise ValueError(f"{name} 必须为 ISO 日期/时间")
+
+
+def _parse_int(name, default=None):
+    v = request.args.get(name, "").strip()
+    if not v:
+        return default
+    try:
+        return int(v)
+    except ValueError:
+        raise ValueError(f"{name} 必须为整数")
+
+
+def apply_filters(query, model, extra_columns=None):
+    """按请求参数追加过滤条件；extra_columns 用于关联表字段（如库存按物料类型过滤）"""
+    columns = dict(extra_columns or {})
+    for arg, (attr, _) in EQ_FILTERS.items():
+        if arg in columns or not hasattr(model, attr):
+            continue
+        columns[arg] = getattr(model, attr)
+
+    for arg, col in columns.items():
+        v = request.args.get(arg, "").strip()
+        if not v:
+            continue
+        cast = EQ_FILTERS.get(arg, (None, str))[1]
+        try:
+            v = cast(v)
+        except ValueError:
+            raise ValueError(f"{arg} 格式错误")
+        query = query.filter(col == v)
+
+    if hasattr(model, "created_at"):
+        start, end = _parse_dt("created_from"), _parse_dt("created_to")
+        if start:
+            query = query.filter(model.created_at >= start)
+        if end:
+            query = query.filter(model.created_at <= end)
+    return query
+
+
+def project(rows):
+    fields = [f.strip() for f in request.args.get("fields", "").split(",") if f.strip()]
+    if not fields:
+        return rows
+    keep = set(fields) | {"id"}
+    return [{k: v for k, v in r.items() if k in keep} for r in rows]
+
+
+def list_response(query, model, extra_columns=None, transform=None):
+    """
+    过滤 + id 倒序（带 limit/cursor 时 keyset 分页）+ 投影，返回 Flask 响应
+    transform(rows, items)：投影前改写本页序列化结果（如按时点替换库存数）
+    """
+    try:
+        query = apply_filters(query, model, extra_columns)
+        limit = _parse_int("limit")
+        cursor = _parse_int("cursor")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    query = query.order_by(model.id.desc())
+    if limit is None and cursor is None:
+        rows, has_more = query.all(), False
+    else:
+        if limit is None:
+            limit = current_app.config["API_PAGE_SIZE"]
+        limit = max(1, min(limit, current_app.config["API_MAX_PAGE_SIZE"]))
+        if cursor is not None:
+            query = query.filter(model.id < cursor)
+        # 多取一行判断是否还有下一页
+        rows = query.limit(limit + 1).all()
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+
+    items = dump_list(rows)
+    if transform is not None:
+        items = transform(rows, items)
+    resp = jsonify(project(items))
+    if has_more:
+        resp.headers[NEXT_CURSOR_HEADER] = str(rows[-1].id)
+    return resp
@@ -0,0 +1,192 @@
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+
+from flask import current_app
+from sqlalchemy import update, select, insert, case
+
+import mold_life
+import rollups
+from dbutil import chunks
+from events import emit, task_payload
+from models import db, Task, Mold, Report, ReportKey
+
+# =========================
+# 报工原子操作：完成数、模具次数在数据库里累加
+# 只 flush 不 commit，事务边界由调用方决定
+# =========================
+
+
+def advance_tasks(deltas):
+    """
+    deltas: {task_id: 报工数量}，同一任务的多条报工先合并再更新
+      done_qty   = min(done_qty + qty, target_qty)，达到目标即置为 已完成
+      used_count = used_count + qty（按模具合并），有任务完成的模具置为 空闲，达到寿命的置为 维修
+    返回刷新后的 {task_id: Task}
+    """
+    for task_id, qty in deltas.items():
+        reached = Task.done_qty + qty >= Task.target_qty
+        db.session.execute(
+            update(Task)
+            .where(Task.id == task_id)
+            .values(done_qty=case((reached, Task.target_qty), else_=Task.done_qty + qty))
+            .execution_options(synchronize_session=False)
+        )
+
+    # 达到目标的置为 已完成；上面的 UPDATE 已锁住这些行，先按原状态计数再改，用于看板任务数
+    status_deltas, finished = defaultdict(int), set()
+    for chunk in chunks(deltas):
+        finishing = (Task.id.in_(chunk), Task.done_qty >= Task.target_qty, Task.status != "已完成")
+        for task_id, status in db.session.execute(select(Task.id, Task.status).where(*finishing)):
+            status_deltas[status] -= 1
+            status_deltas["已完成"] += 1
+            finished.add(task_id)
+        db.session.execute(
+            update(Task).where(*finishing).values(status="已完成")
+            .execution_options(synchronize_session=False)
+        )
+    rollups.bump_task_status(status_deltas)
+
+    tasks = {t.id: t for t in db.session.execute(
+        select(Task).where(Task.id.in_(list(deltas))).execution_options(populate_existing=True)
+    ).scalars()}
+
+    mold_qty, released = defaultdict(int), set()
+    for t in tasks.values():
+        mold_qty[t.mold_id] += deltas[t.id]
+        if t.done_qty >= t.target_qty:
+            released.add(t.mold_id)
+        emit("task.progress", task_payload(t))
+        if t.id in finished:
+            emit("task.completed", task_payload(t))
+    for mold_id, qty in mold_qty.items():
+        # 任务完成的模具置为 空闲（维修中的不动）；累计次数达到寿命的切到 维修
+        status = case((Mold.status == "维修", Mold.status), else_="空闲") if mold_id in released else Mold.status
+        row = db.session.execute(
+            update(Mold).where(Mold.id == mold_id)
+            .values(used_count=Mold.used_count + qty, status=mold_life.next_status(qty, status))
+            .returning(Mold.id, Mold.mold_code, Mold.mold_name, Mold.status, Mold.used_count, Mold.total_life)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if row:
+            emit("mold.updated", row._asdict())
+            if 0 < row.total_life <= row.used_count < row.total_life + qty:
+                emit("mold.life_reached", row._asdict())
+    return tasks
+
+
+def apply_report(task, qty):
+    """单条报工，返回刷新后的 (task, mold)"""
+    task = advance_tasks({task.id: qty})[task.id]
+    now = datetime.utcnow()
+    db.session.add(Report(task_id=task.id, qty=qty, created_at=now))
+    rollups.record_reports([(task, qty, now)])
+    mold = db.session.get(Mold, task.mold_id, populate_existing=True)
+    return task, mold
+
+
+def ingest_report_batch(items):
+    """
+    离线终端批量补报：items 为 [{"key", "task_no", "qty", "reported_at"(可选 ISO 时间)}]
+    - key 为终端生成的幂等键，已入账过的返回 duplicate，不重复累加
+    - 按任务合并数量后一次性更新任务/模具，每条仍各写一行 Report
+    - reported_at 带时区的转成 UTC 存储（不带时区按 UTC），晚于当前时间或早于
+      REPORT_BACKDATE_DAYS 天前的该条报错
+    返回与 items 一一对应的结果列表；只 flush 不 commit
+    """
+    now = datetime.utcnow()
+    results = [None] * len(items)
+    pending = []  # (序号, key, task_no, qty, reported_at)
+    seen = set()
+    for i, it in enumerate(items):
+        it = it if isinstance(it, dict) else {}
+        key = str(it.get("key", "")).strip()
+        task_no = str(it.get("task_no", "")).strip()
+        try:
+            qty = int(it.get("qty", 0) or 0)
+        except (TypeError, ValueError):
+            results[i] = _error(key, task_no, "qty 格式错误")
+            continue
+        try:
+            reported_at = _parse_reported_at(it.get("reported_at"), now)
+        except ValueError as e:
+            results[i] = _error(key, task_no, str(e))
+            continue
+        if not key or len(key) > 64:
+            results[i] = _error(key, task_no, "key 必填且不超过 64 字符")
+        elif not task_no or qty <= 0:
+            results[i] = _error(key, task_no, "task_no 必填且 qty>0")
+        elif key in seen:
+            results[i] = {"key": key, "task_no": task_no, "status": "duplicate"}
+        else:
+            seen.add(key)
+            pending.append((i, key, task_no, qty, reported_at))
+
+    done_keys = {}
+    for chunk in chunks(seen):
+        done_keys.update(db.session.execute(
+            select(ReportKey.key, ReportKey.report_id).where(ReportKey.key.in_(chunk))
+        ).all())
+
+    task_nos = {p[2] for p in pending if p[1] not in done_keys}
+    tasks = {}
+    for chunk in chunks(task_nos):
+        for tid, no, mold_id in db.session.execute(
+            select(Task.id, Task.task_no, Mold.id)
+            .outerjoin(Mold, Mold.id == Task.mold_id)
+            .where(Task.task_no.in_(chunk))
+        ):
+            tasks[no] = (tid, mold_id)
+
+    accepted, deltas = [], defaultdict(int)
+    for i, key, task_no, qty, reported_at in pending:
+        if key in done_keys:
+            results[i] = {"key": key, "task_no": task_no, "status": "duplicate", "report_id": done_keys[key]}
+        elif task_no not in tasks:
+            results[i] = _error(key, task_no, "任务单号不存在")
+        elif tasks[task_no][1] is None:
+            results[i] = _error(key, task_no, "关联模具不存在")
+        else:
+            task_id = tasks[task_no][0]
+            deltas[task_id] += qty
+            accepted.append((i, key, task_no, task_id, qty, reported_at))
+
+    if not accepted:
+        return results
+
+    tasks_by_id = advance_tasks(deltas)
+    report_ids = db.session.execute(
+        insert(Report).returning(Report.id, sort_by_parameter_order=True),
+        [{"task_id": task_id, "qty": qty, "created_at": reported_at or now}
+         for _, _, _, task_id, qty, reported_at in accepted],
+    ).scalars().all()
+    db.session.execute(insert(ReportKey), [
+        {"key": key, "report_id": rid, "created_at": now}
+        for (_, key, *_), rid in zip(accepted, report_ids)
+    ])
+    rollups.record_reports([(tasks_by_id[task_id], qty, reported_at or now)
+                            for _, _, _, task_id, qty, reported_at in accepted])
+    for (i, key, task_no, *_), rid in zip(accepted, report_ids):
+        results[i] = {"key": key, "task_no": task_no, "status": "ok", "report_id": rid}
+    return results
+
+
+def _parse_reported_at(value, now):
+    """ISO 时间 -> 不带时区的 UTC（与 created_at 一致，rollups.bucket 也按 UTC 分桶）；空值返回 None"""
+    if not value:
+        return None
+    try:
+        at = datetime.fromisoformat(str(value))
+    except ValueError:
+        raise ValueError("reported_at 需为 ISO 时间，如 2026-03-01T10:00:00+08:00") from None
+    if at.tzinfo is not None:
+        at = at.astimezone(timezone.utc).replace(tzinfo=None)
+    if at > now + timedelta(seconds=current_app.config["REPORT_CLOCK_SKEW_SECONDS"]):
+        raise ValueError("reported_at 晚于当前时间")
+    days = current_app.config["REPORT_BACKDATE_DAYS"]
+    if at < now - timedelta(days=days):
+        raise ValueError(f"reported_at 早于 {days} 天前，不能补报")
+    return at
+
+
+def _error(key, task_no, message):
+    return {"key": key, "task_no": task_no, "status": "error", "error": message}
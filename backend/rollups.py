@@ -0,0 +1,278 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone
+
+from flask import current_app, has_app_context
+from sqlalchemy import select, insert, delete, func, literal, true, Date
+
+from config import Config
+from dbutil import chunks, increment_upsert
+from models import (
+    db, Mold, Material, Inventory, Task, Report, StockMove,
+    ProductionRollup, StockRollup, TaskStatusCount,
+)
+
+# =========================
+# 看板汇总表：在报工/出入库/建删任务的同一事务里做增量累加（upsert + 加法），
+# 看板只读汇总表，读取量只和查询的天数、操作员/模具/物料个数有关，和历史记录条数无关。
+#
+#   rollup_production   生产日 × 班次 × 操作员 × 模具：报工数量、报工次数
+#   rollup_stock_daily  生产日 × 物料：入库数、出库数、流水条数
+#   rollup_task_status  状态：任务数
+#
+# 已有库由迁移调用 rebuild() 从 reports / stock_moves / tasks 回填一次。
+# =========================
+
+DIMENSIONS = {
+    "day": ProductionRollup.day,
+    "shift": ProductionRollup.shift,
+    "operator": ProductionRollup.operator_name,
+    "mold": ProductionRollup.mold_id,
+}
+
+
+def _setting(name):
+    return current_app.config[name] if has_app_context() else getattr(Config, name)
+
+
+def bucket(at):
+    """UTC 时间 -> (生产日, 班次)；第一个班次开始前的时间算前一个生产日的最后一个班次"""
+    if at.tzinfo is not None:
+        at = at.astimezone(timezone.utc).replace(tzinfo=None)
+    local = at + timedelta(hours=_setting("PLANT_UTC_OFFSET_HOURS"))
+    shifts = sorted(_setting("SHIFTS"), key=lambda s: s[1])
+    day_start = shifts[0][1]
+    hour = local.hour + local.minute / 60
+    shift = shifts[-1][0]
+    for name, start in shifts:
+        if hour >= start:
+            shift = name
+    day = local.date() if hour >= day_start else local.date() - timedelta(days=1)
+    return day, shift
+
+
+def production_day(at=None):
+    return bucket(at or datetime.utcnow())[0]
+
+
+# ---------- 增量写入（只 flush 不 commit） ----------
+
+def _upsert_add(model, keys, rows, counters):
+    """rows 按 keys 合并后 INSERT ... ON CONFLICT DO UPDATE SET c = c + excluded.c"""
+    merged = {}
+    for row in rows:
+        k = tuple(row[c] for c in keys)
+        if k in merged:
+            for c in counters:
+                merged[k][c] += row[c]
+        else:
+            merged[k] = dict(row)
+    if not merged:
+        return
+
+    stmt = increment_upsert(model.__table__, keys, counters, db.session.get_bind().dialect.name)
+    for chunk in chunks(merged.values()):
+        db.session.execute(stmt, chunk)
+
+
+def record_reports(entries):
+    """entries: [(task, qty, 报工时间)]，task 需带 operator_name / mold_id"""
+    rows = []
+    for task, qty, at in entries:
+        day, shift = bucket(at)
+        rows.append({"day": day, "shift": shift, "operator_name": task.operator_name,
+                     "mold_id": task.mold_id, "qty": qty, "report_count": 1})
+    _upsert_add(ProductionRollup, ("day", "shift", "operator_name", "mold_id"), rows, ("qty", "report_count"))
+
+
+def record_moves(entries):
+    """entries: [(material_id, 带符号数量, 发生时间)]，正数计入库，负数计出库"""
+    rows = [{"day": bucket(at)[0], "material_id": mid, "in_qty": max(qty, 0),
+             "out_qty": max(-qty, 0), "move_count": 1}
+            for mid, qty, at in entries]
+    _upsert_add(StockRollup, ("day", "material_id"), rows, ("in_qty", "out_qty", "move_count"))
+
+
+def record_move_totals(at, totals):
+    """
+    批量流水已按物料合计好、发生时间相同：totals 为含 material_id / in_qty / out_qty / move_count 列的
+    表或子查询（批量导入用临时表），INSERT ... SELECT 一条语句累加，不逐行传参
+    """
+    cols = ("in_qty", "out_qty", "move_count")
+    stmt = increment_upsert(StockRollup.__table__, ("day", "material_id"), cols,
+                            db.session.get_bind().dialect.name)
+    # WHERE true：SQLite 要求 INSERT ... SELECT ... ON CONFLICT 的 SELECT 带 WHERE，否则 ON 被当成 JOIN 条件
+    src = select(literal(bucket(at)[0], Date()), totals.c.material_id, *(totals.c[c] for c in cols)).where(true())
+    db.session.execute(stmt.from_select(["day", "material_id", *cols], src))
+
+
+def bump_task_status(deltas):
+    """deltas: {状态: 增减数}"""
+    rows = [{"status": s, "task_count": n} for s, n in deltas.items() if n]
+    _upsert_add(TaskStatusCount, ("status",), rows, ("task_count",))
+
+
+# ---------- 回填 ----------
+
+def rebuild(conn):
+    """清空汇总表并从明细表重新计算；conn 为 Connection（迁移里调用）"""
+    for model in (ProductionRollup, StockRollup, TaskStatusCount):
+        conn.execute(delete(model))
+
+    prod = defaultdict(lambda: [0, 0])
+    rows = conn.execution_options(stream_results=True).execute(
+        select(Report.created_at, Report.qty, Task.operator_name, Task.mold_id)
+        .join(Task, Task.id == Report.task_id)
+    )
+    for at, qty, operator, mold_id in rows:
+        if at is None:
+            continue
+        agg = prod[bucket(at) + (operator, mold_id)]
+        agg[0] += qty
+        agg[1] += 1
+    _bulk_insert(conn, ProductionRollup, [
+        {"day": d, "shift": s, "operator_name": o, "mold_id": m, "qty": q, "report_count": n}
+        for (d, s, o, m), (q, n) in prod.items()
+    ])
+
+    moves = defaultdict(lambda: [0, 0, 0])
+    rows = conn.execution_options(stream_results=True).execute(
+        select(StockMove.created_at, StockMove.material_id, StockMove.qty)
+    )
+    for at, mid, qty in rows:
+        if at is None:
+            continue
+        agg = moves[(bucket(at)[0], mid)]
+        agg[0] += max(qty, 0)
+        agg[1] += max(-qty, 0)
+        agg[2] += 1
+    _bulk_insert(conn, StockRollup, [
+        {"day": d, "material_id": m, "in_qty": i, "out_qty": o, "move_count": n}
+        for (d, m), (i, o, n) in moves.items()
+    ])
+
+    _bulk_insert(conn, TaskStatusCount, [
+        {"status": s, "task_count": n}
+        for s, n in conn.execute(select(Task.status, func.count()).group_by(Task.status))
+    ])
+
+
+def _bulk_insert(conn, model, rows):
+    for chunk in chunks(rows, 5000):
+        conn.execute(insert(model), chunk)
+
+
+# ---------- 看板查询 ----------
+
+def production(day_from, day_to, group_by=("day",)):
+    """按维度汇总报工数量；group_by 取 DIMENSIONS 的键"""
+    cols = [DIMENSIONS[g].label(g) for g in group_by]
+    q = (
+        select(*cols, func.sum(ProductionRollup.qty), func.sum(ProductionRollup.report_count))
+        .where(ProductionRollup.day >= day_from, ProductionRollup.day <= day_to)
+        .group_by(*cols)
+        .order_by(*cols)
+    )
+    result = []
+    for row in db.session.execute(q):
+        item = dict(zip(group_by, row[:len(group_by)]))
+        if "day" in item:
+            item["day"] = item["day"].isoformat()
+        item["qty"], item["report_count"] = row[-2], row[-1]
+        result.append(item)
+
+    if "mold" in group_by and result:
+        codes = dict(db.session.execute(
+            select(Mold.id, Mold.mold_code).where(Mold.id.in_({r["mold"] for r in result}))
+        ).all())
+        for r in result:
+            r["mold_code"] = codes.get(r["mold"])
+    return result
+
+
+def stock_by_day(day_from, day_to):
+    q = (
+        select(StockRollup.day, func.sum(StockRollup.in_qty), func.sum(StockRollup.out_qty),
+               func.sum(StockRollup.move_count))
+        .where(StockRollup.day >= day_from, StockRollup.day <= day_to)
+        .group_by(StockRollup.day)
+        .order_by(StockRollup.day)
+    )
+    return [{"day": d.isoformat(), "in_qty": i, "out_qty": o, "move_count": n}
+            for d, i, o, n in db.session.execute(q)]
+
+
+def task_summary():
+    counts = {s: n for s, n in db.session.execute(select(TaskStatusCount.status, TaskStatusCount.task_count))
+              if n}
+    total = sum(counts.values())
+    completed = counts.get("已完成", 0)
+    return {
+        "by_status": counts,
+        "total": total,
+        "completed": completed,
+        "completion_rate": round(completed / total, 4) if total else None,
+    }
+
+
+def mold_life(limit=20):
+    """剩余寿命比例最低的模具（total_life<=0 视为未设寿命，不参与）"""
+    remaining = Mold.total_life - Mold.used_count
+    rows = db.session.execute(
+        select(Mold.id, Mold.mold_code, Mold.mold_name, Mold.status, Mold.total_life, Mold.used_count)
+        .where(Mold.total_life > 0)
+        .order_by(remaining * 1.0 / Mold.total_life, Mold.id)
+        .limit(limit)
+    )
+    return [{
+        "mold_id": mid, "mold_code": code, "mold_name": name, "status": status,
+        "total_life": life, "used_count": used, "remaining": max(life - used, 0),
+        "remaining_pct": round(max(life - used, 0) / life, 4),
+    } for mid, code, name, status, life, used in rows]
+
+
+def below_safety(limit=50):
+    """可用量低于安全库存的物料：数量按物料主数据计，不随流水增长"""
+    available = Inventory.on_hand - Inventory.reserved
+    rows = db.session.execute(
+        select(Material.id, Material.material_code, Material.material_name, Material.unit,
+               Material.safety_stock, Inventory.on_hand, Inventory.reserved)
+        .join(Inventory, Inventory.material_id == Material.id)
+        .where(available < Material.safety_stock)
+        .order_by((Material.safety_stock - available).desc(), Material.id)
+        .limit(limit)
+    )
+    return [{
+        "material_id": mid, "material_code": code, "material_name": name, "unit": unit,
+        "safety_stock": safety, "on_hand": oh, "reserved": rs, "available": oh - rs,
+        "gap": safety - (oh - rs),
+    } for mid, code, name, unit, safety, oh, rs in rows]
+
+
+def dashboard(day_from, day_to):
+    by_day = production(day_from, day_to, ("day",))
+    return {
+        "from": day_from.isoformat(),
+        "to": day_to.isoformat(),
+        "production": {
+            "total_qty": sum(r["qty"] for r in by_day),
+            "report_count": sum(r["report_count"] for r in by_day),
+            "by_day": by_day,
+            "by_shift": production(day_from, day_to, ("shift",)),
+            "by_operator": production(day_from, day_to, ("operator",)),
+            "by_mold": production(day_from, day_to, ("mold",)),
+        },
+        "stock": {"by_day": stock_by_day(day_from, day_to)},
+        "tasks": task_summary(),
+        "molds": mold_life(),
+        "below_safety": below_safety(),
+    }
+
+
+def parse_range(args, default_days=7):
+    """?from=YYYY-MM-DD&to=YYYY-MM-DD，默认最近 default_days 个生产日；格式错误抛 ValueError"""
+    day_to = date.fromisoformat(args["to"]) if args.get("to") else production_day()
+    day_from = (date.fromisoformat(args["from"]) if args.get("from")
+                else day_to - timedelta(days=default_days - 1))
+    if day_from > day_to:
+        raise ValueError("from 不能晚于 to")
+    return day_from, day_to
@@ -0,0 +1,225 @@
+import sys
+import threading
+
+from sqlalchemy import text, select, or_
+from sqlalchemy.exc import OperationalError
+
+from models import db, Mold, Material, Product
+
+# =========================
+# 物料 / 模具 / 产品 搜索（SQLite FTS5 trigram）
+#
+# search_index 为 FTS5 虚表，trigram 分词：任意 3 个字符以上的子串都走索引，中文名称、编码、图号通用。
+# 由基表上的触发器同步（建在迁移里），ORM、批量导入、手工 SQL 的写入都会同步，
+# rowid = 基表 id * 4 + 类型号，增删改按 rowid 直接定位。
+#
+# 查询顺序：
+#   1. 编码前缀命中（走基表唯一索引的范围扫描），完全相同的排最前
+#   2. FTS 子串匹配，按 bm25 排序（编码 > 图号/版本 > 名称）；命中过多时不排序（见 RANK_CAP）
+#   不足 3 个字符的词 trigram 用不上，只做编码前缀 + 带 LIMIT 的子串扫描
+# 非 SQLite 或 SQLite 没有 FTS5 时退回 LIKE。
+# 触发器逐行维护索引，几十万行的一次性导入先删触发器再 rebuild 会快得多。
+#
+#   python search.py rebuild    建表/触发器并重建索引
+# =========================
+
+KINDS = {
+    # 类型: (类型号, 模型, 编码列, 名称列, 附加列表达式（{p} 为 new./old./空）)
+    "mold": (1, Mold, "mold_code", "mold_name", "''"),
+    "material": (2, Material, "material_code", "material_name",
+                 "trim(coalesce({p}drawing_no, '') || ' ' || coalesce({p}material_type, '') || ' ' "
+                 "|| coalesce({p}remark, ''))"),
+    "product": (3, Product, "product_code", "product_name", "coalesce({p}version, '')"),
+}
+# 附加列依赖的字段：只有这些字段变化时触发器才重建索引行（避免模具报工时每次都改 FTS）
+_WATCH = {
+    "mold": ("mold_code", "mold_name"),
+    "material": ("material_code", "material_name", "drawing_no", "material_type", "remark"),
+    "product": ("product_code", "product_name", "version"),
+}
+MIN_TRIGRAM = 3
+RANK_CAP = 2000  # 命中超过这么多行时不算 bm25（常见词整表排序要上百毫秒），按 rowid 顺序取前几条
+_RANK = "bm25(0, 0, 10.0, 3.0, 5.0)"  # kind, ref_id, code, name, extra
+
+
+# ---------- 建表 / 触发器 / 回填 ----------
+
+def _values(kind, p):
+    n, model, code, name, extra = KINDS[kind]
+    return (f"{p}id * 4 + {n}, '{kind}', {p}id, {p}{code}, {p}{name}, "
+            f"{extra.format(p=p)}")
+
+
+def install(conn):
+    """建 FTS 表与触发器并回填，可重复执行；SQLite 没有 FTS5/trigram 时抛 OperationalError"""
+    conn.execute(text(
+        "CREATE VIRTUAL TABLE IF NOT EXISTS search_index "
+        "USING fts5(kind UNINDEXED, ref_id UNINDEXED, code, name, extra, tokenize='trigram')"
+    ))
+    conn.execute(text(f"INSERT INTO search_index(search_index, rank) VALUES('rank', '{_RANK}')"))
+    cols = "rowid, kind, ref_id, code, name, extra"
+    for kind, (n, model, *_rest) in KINDS.items():
+        table = model.__tablename__
+        watch = ", ".join(_WATCH[kind])
+        for name in ("ai", "au", "ad"):
+            conn.execute(text(f"DROP TRIGGER IF EXISTS trg_search_{table}_{name}"))
+        conn.execute(text(
+            f"CREATE TRIGGER trg_search_{table}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO search_index({cols}) VALUES ({_values(kind, 'new.')}); END"
+        ))
+        conn.execute(text(
+            f"CREATE TRIGGER trg_search_{table}_au AFTER UPDATE OF {watch} ON {table} BEGIN "
+            f"DELETE FROM search_index WHERE rowid = old.id * 4 + {n}; "
+            f"INSERT INTO search_index({cols}) VALUES ({_values(kind, 'new.')}); END"
+        ))
+        conn.execute(text(
+            f"CREATE TRIGGER trg_search_{table}_ad AFTER DELETE ON {table} BEGIN "
+            f"DELETE FROM search_index WHERE rowid = old.id * 4 + {n}; END"
+        ))
+    rebuild(conn)
+
+
+def rebuild(conn):
+    conn.execute(text("DELETE FROM search_index"))
+    for kind, (n, model, *_rest) in KINDS.items():
+        conn.execute(text(
+            f"INSERT INTO search_index(rowid, kind, ref_id, code, name, extra) "
+            f"SELECT {_values(kind, '')} FROM {model.__tablename__}"
+        ))
+    conn.execute(text("INSERT INTO search_index(search_index) VALUES('optimize')"))
+
+
+_available = {}
+_lock = threading.Lock()
+
+
+def available():
+    engine = db.engine
+    with _lock:
+        if engine not in _available:
+            ok = engine.dialect.name == "sqlite"
+            if ok:
+                with engine.connect() as conn:
+                    ok = conn.execute(text(
+                        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'search_index'"
+                    )).first() is not None
+            _available[engine] = ok
+        return _available[engine]
+
+
+# ---------- 查询 ----------
+
+def _phrase(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+def _like(term):
+    return "%" + term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+
+
+def _code_prefix(kind, q, limit):
+    n, model, code, name, _ = KINDS[kind]
+    col = getattr(model, code)
+    rows = db.session.execute(
+        select(model.id, col, getattr(model, name))
+        .where(col >= q, col < q + "\U0010ffff")
+        .order_by(col)
+        .limit(limit)
+    )
+    return [(kind, i, c, nm) for i, c, nm in rows]
+
+
+def _fts(q, kinds, limit):
+    terms = q.split()
+    long_terms = [t for t in terms if len(t) >= MIN_TRIGRAM]
+    short_terms = [t for t in terms if len(t) < MIN_TRIGRAM]
+    where, params = ["kind IN (" + ", ".join(f":k{i}" for i in range(len(kinds))) + ")"], {}
+    params.update({f"k{i}": k for i, k in enumerate(kinds)})
+    if long_terms:
+        where.append("search_index MATCH :match")
+        params["match"] = " AND ".join(_phrase(t) for t in long_terms)
+    for i, t in enumerate(short_terms):
+        where.append(f"(code LIKE :s{i} ESCAPE '\\' OR name LIKE :s{i} ESCAPE '\\' OR extra LIKE :s{i} ESCAPE '\\')")
+        params[f"s{i}"] = _like(t)
+    where = " AND ".join(where)
+    order = ""
+    if long_terms:
+        hits = db.session.execute(text(
+            "SELECT count(*) FROM (SELECT 1 FROM search_index WHERE search_index MATCH :match LIMIT :cap)"
+        ), {"match": params["match"], "cap": RANK_CAP + 1}).scalar()
+        if hits <= RANK_CAP:
+            order = "ORDER BY rank"
+    rows = db.session.execute(text(
+        f"SELECT kind, ref_id, code, name, extra FROM search_index WHERE {where} {order} LIMIT :limit"
+    ), {**params, "limit": limit})
+    return [tuple(r) for r in rows]
+
+
+def _like_fallback(q, kinds, limit):
+    out = []
+    for kind in kinds:
+        n, model, code, name, _ = KINDS[kind]
+        conds = [or_(getattr(model, code).contains(t, autoescape=True),
+                     getattr(model, name).contains(t, autoescape=True)) for t in q.split()]
+        rows = db.session.execute(
+            select(model.id, getattr(model, code), getattr(model, name)).where(*conds).limit(limit)
+        )
+        out.extend((kind, i, c, nm, None) for i, c, nm in rows)
+    return out[:limit]
+
+
+def search(q, kinds=None, limit=20):
+    """返回 [{"type", "id", "code", "name", "extra", "match"}]，match 为 exact / prefix / text"""
+    q = " ".join(q.split())
+    kinds = [k for k in (kinds or KINDS) if k in KINDS]
+    if not q or not kinds:
+        return []
+
+    results, seen = [], set()
+
+    def add(kind, ref_id, code, name, extra, match):
+        if (kind, ref_id) in seen or len(results) >= limit:
+            return
+        seen.add((kind, ref_id))
+        results.append({"type": kind, "id": ref_id, "code": code, "name": name,
+                         "extra": extra or None, "match": match})
+
+    if " " not in q:
+        prefix = [r for k in kinds for r in _code_prefix(k, q, limit)]
+        prefix.sort(key=lambda r: (r[2] != q, len(r[2]), r[2]))
+        for kind, ref_id, code, name in prefix:
+            add(kind, ref_id, code, name, None, "exact" if code == q else "prefix")
+
+    if len(results) < limit:
+        rows = _fts(q, kinds, limit + len(results)) if available() else _like_fallback(q, kinds, limit)
+        for kind, ref_id, code, name, extra in rows:
+            add(kind, ref_id, code, name, extra, "text")
+    return results
+
+
+def matching_ids(kind, q):
+    """list 接口的 ?q= 过滤：返回匹配 id 的子查询；不适用 FTS 时返回 None（调用方退回 LIKE）"""
+    q = " ".join(q.split())
+    if not available() or len(q) < MIN_TRIGRAM or any(len(t) < MIN_TRIGRAM for t in q.split()):
+        return None
+    return text(
+        "SELECT ref_id FROM search_index WHERE search_index MATCH :match AND kind = :kind"
+    ).bindparams(match=" AND ".join(_phrase(t) for t in q.split()), kind=kind).columns(ref_id=db.Integer)
+
+
+if __name__ == "__main__":
+    from db_init import create_app
+
+    app = create_app()
+    with app.app_context():
+        if len(sys.argv) > 1 and sys.argv[1] == "rebuild":
+            try:
+                with db.engine.begin() as conn:
+                    install(conn)
+            except OperationalError as e:
+                sys.exit(f"当前 SQLite 不支持 FTS5 trigram：{e.orig}")
+            print("search_index rebuilt")
+        else:
+            q = " ".join(sys.argv[1:])
+            for r in search(q, limit=20):
+                print(r)
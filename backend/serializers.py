@@ -0,0 +1,29 @@
+from sqlalchemy.orm import joinedload
+
+from models import (
+    Task, Report,
+    Inventory, BOMItem, StockMove,
+    TaskMaterialRequirement
+)
+
+# =========================
+# 列表序列化：to_dict() 会访问的关系统一在这里预加载
+# 多对一关系用 joinedload，一条 SELECT 取回整页数据，避免逐行懒加载（N+1）
+# =========================
+EAGER_LOADS = {
+    Task: (joinedload(Task.mold), joinedload(Task.product)),
+    Inventory: (joinedload(Inventory.material),),
+    BOMItem: (joinedload(BOMItem.product), joinedload(BOMItem.material)),
+    TaskMaterialRequirement: (joinedload(TaskMaterialRequirement.material),),
+    StockMove: (joinedload(StockMove.material),),
+    Report: (joinedload(Report.task),),
+}
+
+
+def eager_query(model):
+    """返回已挂好预加载选项的 model.query，序列化时不会再触发额外 SELECT"""
+    return model.query.options(*EAGER_LOADS.get(model, ()))
+
+
+def dump_list(rows):
+    return [x.to_dict() for x in rows]
@@ -0,0 +1,233 @@
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, insert, func, literal, union_all, inspect
+from sqlalchemy.exc import IntegrityError
+
+from dbutil import chunks
+from models import db, Material, Inventory, StockMove, InventorySnapshot, InventorySnapshotLine
+
+# =========================
+# 库存快照与按时点查询
+#
+# 快照 = cutoff（含）之前全部流水按物料累加的结存。新快照在上一个快照的基础上
+# 只累加两次 cutoff 之间的流水（走 stock_moves.created_at 索引），不重放整个流水账。
+#
+#   某时点 T 的结存 = T 之前最近的快照 + (快照 cutoff, T] 之间的流水
+#   对账：Inventory.on_hand 与 最近快照 + 之后流水（或 --full 全量流水）逐物料比对
+#
+#   python snapshots.py take [--at 2026-01-31T16:00:00]
+#   python snapshots.py reconcile [--full]
+#   python snapshots.py list
+# 时间均为 UTC，与 created_at 一致。
+# =========================
+
+
+def _settle_limit(app_config):
+    return datetime.utcnow() - timedelta(seconds=app_config["INVENTORY_SNAPSHOT_SETTLE_SECONDS"])
+
+
+def check_cutoff(at, app_config):
+    """手动取快照的时刻：默认取到 settle 时间之前，不允许更晚（可能还有未提交的流水）"""
+    limit = _settle_limit(app_config)
+    if at is None:
+        return limit
+    if at > limit:
+        raise ValueError(f"快照时刻不能晚于 {limit.isoformat(timespec='seconds')}（UTC）")
+    return at
+
+
+def nearest_snapshot(at):
+    """cutoff <= at 的最近一个快照，没有则 None"""
+    return db.session.execute(
+        select(InventorySnapshot).where(InventorySnapshot.cutoff <= at)
+        .order_by(InventorySnapshot.cutoff.desc()).limit(1)
+    ).scalar()
+
+
+def _moves_between(after, until):
+    conds = [StockMove.created_at <= until]
+    if after is not None:
+        conds.append(StockMove.created_at > after)
+    return conds
+
+
+def take_snapshot(cutoff):
+    """取 cutoff 时刻的快照（已存在则直接返回）；只 flush 不 commit"""
+    existing = db.session.execute(
+        select(InventorySnapshot).where(InventorySnapshot.cutoff == cutoff)
+    ).scalar()
+    if existing:
+        return existing
+
+    base = db.session.execute(
+        select(InventorySnapshot).where(InventorySnapshot.cutoff < cutoff)
+        .order_by(InventorySnapshot.cutoff.desc()).limit(1)
+    ).scalar()
+    moves = _moves_between(base.cutoff if base else None, cutoff)
+
+    snap = InventorySnapshot(cutoff=cutoff, base_snapshot_id=base.id if base else None)
+    db.session.add(snap)
+    db.session.flush()
+
+    parts = [select(StockMove.material_id.label("material_id"), StockMove.qty.label("qty")).where(*moves)]
+    if base:
+        parts.append(select(InventorySnapshotLine.material_id, InventorySnapshotLine.on_hand)
+                     .where(InventorySnapshotLine.snapshot_id == base.id))
+    src = union_all(*parts).subquery()
+    res = db.session.execute(
+        insert(InventorySnapshotLine).from_select(
+            ["snapshot_id", "material_id", "on_hand"],
+            select(literal(snap.id), src.c.material_id, func.sum(src.c.qty)).group_by(src.c.material_id),
+        )
+    )
+    snap.material_count = res.rowcount
+    snap.move_count = db.session.execute(select(func.count()).where(*moves)).scalar()
+    return snap
+
+
+def stock_as_of(at, material_ids):
+    """返回 (使用的快照, {material_id: at 时刻结存})，只算给定物料"""
+    snap = nearest_snapshot(at)
+    result = dict.fromkeys(material_ids, 0)
+    for chunk in chunks(material_ids):
+        if snap:
+            result.update(db.session.execute(
+                select(InventorySnapshotLine.material_id, InventorySnapshotLine.on_hand)
+                .where(InventorySnapshotLine.snapshot_id == snap.id,
+                       InventorySnapshotLine.material_id.in_(chunk))
+            ).all())
+        for mid, qty in db.session.execute(
+            select(StockMove.material_id, func.sum(StockMove.qty))
+            .where(StockMove.material_id.in_(chunk), *_moves_between(snap.cutoff if snap else None, at))
+            .group_by(StockMove.material_id)
+        ):
+            result[mid] += qty
+    return snap, result
+
+
+def reconcile(full=False, limit=100):
+    """
+    逐物料比对 Inventory.on_hand 与流水账结存，一条语句流式读取，只返回不一致的物料。
+    full=False：最近快照 + 之后的流水；full=True：从头累加全部流水（同时校验快照本身）
+    """
+    started = time.perf_counter()
+    snap = None if full else nearest_snapshot(datetime.utcnow())
+    moves = select(StockMove.material_id.label("material_id"), StockMove.qty.label("qty"))
+    parts = [moves]
+    if snap:
+        parts[0] = moves.where(StockMove.created_at > snap.cutoff)
+        parts.append(select(InventorySnapshotLine.material_id, InventorySnapshotLine.on_hand)
+                     .where(InventorySnapshotLine.snapshot_id == snap.id))
+    src = union_all(*parts).subquery()
+    ledger = (
+        select(src.c.material_id, func.sum(src.c.qty).label("qty"))
+        .group_by(src.c.material_id)
+        .subquery()
+    )
+    ledger_qty = func.coalesce(ledger.c.qty, 0)
+
+    checked = db.session.execute(select(func.count()).select_from(Inventory)).scalar()
+    rows = db.session.execute(
+        select(Inventory.material_id, Material.material_code, Material.material_name,
+               Inventory.on_hand, ledger_qty)
+        .join(Material, Material.id == Inventory.material_id)
+        .outerjoin(ledger, ledger.c.material_id == Inventory.material_id)
+        .where(Inventory.on_hand != ledger_qty)
+        .order_by(Inventory.material_id)
+        .execution_options(yield_per=1000)
+    )
+    mismatches, count = [], 0
+    for mid, code, name, on_hand, qty in rows:
+        count += 1
+        if len(mismatches) < limit:
+            mismatches.append({"material_id": mid, "material_code": code, "material_name": name,
+                               "on_hand": on_hand, "ledger_qty": qty, "diff": on_hand - qty})
+    return {
+        "mode": "full" if full else "snapshot",
+        "snapshot": snap.to_dict() if snap else None,
+        "checked": checked,
+        "mismatch_count": count,
+        "mismatches": mismatches,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+# =========================
+# 定时快照：进程内后台线程，按工厂当地时间每 INVENTORY_SNAPSHOT_HOURS 小时对齐取一次。
+# 多个进程同时取同一 cutoff 时由唯一约束去重。
+# =========================
+_TICK_SECONDS = 600
+
+
+class SnapshotScheduler:
+    def __init__(self):
+        self.app = None
+        self._thread = None
+
+    def init_app(self, app):
+        self.app = app
+        if app.config["INVENTORY_SNAPSHOT_HOURS"] <= 0 or self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._loop, name="mes-snapshot", daemon=True)
+        self._thread.start()
+
+    def due_cutoff(self):
+        """最近一个已过 settle 时间的对齐时刻（UTC）"""
+        cfg = self.app.config
+        offset = timedelta(hours=cfg["PLANT_UTC_OFFSET_HOURS"])
+        step = cfg["INVENTORY_SNAPSHOT_HOURS"] * 3600
+        epoch = datetime(1970, 1, 1)
+        local = (_settle_limit(cfg) + offset - epoch).total_seconds()
+        return epoch + timedelta(seconds=local - local % step) - offset
+
+    def run_once(self):
+        with self.app.app_context():
+            if not inspect(db.engine).has_table(InventorySnapshot.__tablename__):
+                return None
+            try:
+                snap = take_snapshot(self.due_cutoff())
+                db.session.commit()
+                return snap.id
+            except IntegrityError:
+                db.session.rollback()  # 其他进程已取过
+                return None
+
+    def _loop(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception:
+                self.app.logger.exception("库存快照失败")
+            time.sleep(_TICK_SECONDS)
+
+
+snapshot_scheduler = SnapshotScheduler()
+
+
+if __name__ == "__main__":
+    from db_init import create_app
+
+    app = create_app()
+    args = sys.argv[1:] or ["list"]
+    with app.app_context():
+        if args[0] == "take":
+            at = datetime.fromisoformat(args[2]) if len(args) > 2 and args[1] == "--at" else None
+            try:
+                snap = take_snapshot(check_cutoff(at, app.config))
+            except ValueError as e:
+                sys.exit(str(e))
+            db.session.commit()
+            print(snap.to_dict())
+        elif args[0] == "reconcile":
+            r = reconcile(full="--full" in args, limit=sys.maxsize)
+            print(f"{r['mode']}: checked {r['checked']} materials, "
+                  f"{r['mismatch_count']} mismatches in {r['elapsed_ms']} ms")
+            for m in r["mismatches"]:
+                print(f"  {m['material_code']}: on_hand={m['on_hand']} ledger={m['ledger_qty']} diff={m['diff']}")
+            sys.exit(1 if r["mismatch_count"] else 0)
+        else:
+            for s in db.session.execute(select(InventorySnapshot).order_by(InventorySnapshot.cutoff)).scalars():
+                print(s.to_dict())
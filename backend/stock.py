@@ -0,0 +1,83 @@
+from datetime import datetime
+
+from sqlalchemy import update, select
+
+import rollups
+from events import emit
+from models import db, Inventory, StockMove, TaskMaterialRequirement
+
+# =========================
+# 库存原子操作：数量变化都用条件 UPDATE 在数据库里完成，不在 Python 里读-改-写
+# 只 flush 不 commit，事务边界由调用方决定
+# =========================
+
+
+class StockError(ValueError):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def _inventory_exists(material_id):
+    return db.session.execute(
+        select(Inventory.id).where(Inventory.material_id == material_id)
+    ).first() is not None
+
+
+def receive(material_id, qty, ref_type="MANUAL", ref_id=None):
+    """入库：on_hand = on_hand + qty"""
+    inv = db.session.execute(
+        update(Inventory)
+        .where(Inventory.material_id == material_id)
+        .values(on_hand=Inventory.on_hand + qty)
+        .returning(Inventory.on_hand, Inventory.reserved)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if inv is None:
+        raise StockError("库存行不存在", 404)
+    _add_move(material_id, qty, "IN", ref_type, ref_id, inv)
+
+
+def issue_to_task(task, material_id, qty):
+    """
+    按任务发料：
+      inventory.on_hand = on_hand - qty  WHERE on_hand >= qty
+      requirement.issued_qty = issued_qty + qty
+    """
+    inv = db.session.execute(
+        update(Inventory)
+        .where(Inventory.material_id == material_id, Inventory.on_hand >= qty)
+        .values(on_hand=Inventory.on_hand - qty)
+        .returning(Inventory.on_hand, Inventory.reserved)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if inv is None:
+        if not _inventory_exists(material_id):
+            raise StockError("库存行不存在", 404)
+        raise StockError("库存不足")
+
+    req = db.session.execute(
+        update(TaskMaterialRequirement)
+        .where(TaskMaterialRequirement.task_id == task.id, TaskMaterialRequirement.material_id == material_id)
+        .values(issued_qty=TaskMaterialRequirement.issued_qty + qty)
+        .returning(TaskMaterialRequirement.required_qty, TaskMaterialRequirement.issued_qty)
+        .execution_options(synchronize_session=False)
+    ).first()
+    if req is None:
+        raise StockError("该任务未生成此物料需求")
+
+    _add_move(material_id, -qty, "OUT", "TASK", task.task_no, inv,
+              {"task_id": task.id, "required_qty": req.required_qty, "issued_qty": req.issued_qty})
+
+
+def _add_move(material_id, qty, move_type, ref_type, ref_id, inv, extra=None):
+    """写一条库存流水，计入看板的出入库日汇总，提交后推送 stock.move（inv 为变动后的 on_hand/reserved）"""
+    now = datetime.utcnow()
+    db.session.add(StockMove(material_id=material_id, qty=qty, move_type=move_type,
+                             ref_type=ref_type, ref_id=ref_id, created_at=now))
+    rollups.record_moves([(material_id, qty, now)])
+    emit("stock.move", {
+        "material_id": material_id, "qty": qty, "move_type": move_type, "ref_type": ref_type,
+        "ref_id": ref_id, "on_hand": inv.on_hand, "reserved": inv.reserved,
+        "available": inv.on_hand - inv.reserved, **(extra or {}),
+    })
@@ -0,0 +1,277 @@
+import time
+from datetime import datetime
+
+from sqlalchemy import select, update, delete, Table, Column, Integer, MetaData
+
+import rollups
+from bom_import import _cell
+from dbutil import chunks, executemany, bind_value
+from models import db, Material, Inventory, StockMove
+
+# =========================
+# 批量出入库 / 盘点导入
+#
+# 逐行喂入，按批写库（IMPORT_BATCH_SIZE 行一批）：
+#   - 启动时把 物料编码 -> id 一次性读入内存，逐行校验不查库
+#   - 每批：stock_moves 一条 executemany INSERT（编译一次直接交给驱动，不逐行组装参数）；
+#           各物料的合计先写进临时表 stock_move_batch，再用一条
+#           UPDATE inventory ... FROM stock_move_batch 完成全部库存变动（有出库时再查一次是否出现负库存），
+#           出入库日汇总也从临时表 INSERT ... SELECT 一条语句累加
+#   - 盘点（COUNT）行先按批读出当前 on_hand，差额记为 ADJUST 流水，差额为 0 不记
+# 全有或全无：有任何一行不合法（物料不存在、数量不对、出库后库存为负）就只继续校验不再写库，
+# 结束后由调用方回滚，返回出错行。只 flush 不 commit，事务边界由调用方决定。
+# =========================
+
+MOVE_TYPES = ("IN", "OUT", "ADJUST", "COUNT")
+
+# 出错原因最多记录的条数
+MAX_ERRORS = 100
+
+# 每批的物料合计增减，只在当前事务内使用
+_batch = Table(
+    "stock_move_batch", MetaData(),
+    Column("material_id", Integer, primary_key=True),
+    Column("delta", Integer, nullable=False),
+    Column("in_qty", Integer, nullable=False),
+    Column("out_qty", Integer, nullable=False),
+    Column("move_count", Integer, nullable=False),
+    prefixes=["TEMPORARY"],
+)
+_BATCH_COLUMNS = ("material_id", "delta", "in_qty", "out_qty", "move_count")
+_MOVE_COLUMNS = ("material_id", "qty", "move_type", "ref_type", "ref_id", "created_at")
+
+
+class StockMoveImporter:
+    def __init__(self, ref_type="MANUAL", session=None, batch_size=5000):
+        self.session = session or db.session
+        self.ref_type = ref_type
+        self.batch_size = batch_size
+
+        self.material_ids = dict(self.session.execute(select(Material.material_code, Material.id)).all())
+        self.known_ids = set(self.material_ids.values())
+        self._codes = None
+
+        self.counted, self.moved = set(), set()  # 盘点与其他流水不能出现在同一次导入的同一物料上
+        self.rows = 0
+        self.moves, self.in_qty, self.out_qty = 0, 0, 0
+        self.adjusted, self.unchanged = 0, 0
+        self.failed = 0
+        self.errors = []  # [{"row": 数据行号, "error": 原因}]，最多 MAX_ERRORS 条
+        self.started = time.perf_counter()
+        self._ready = False
+        self._reset_batch()
+
+    def _reset_batch(self):
+        self._moves = []   # (material_id, 带符号数量, move_type, ref_id)
+        self._counts = {}  # material_id -> (行号, 盘点数, ref_id)
+        self._pending = 0
+
+    # ---------- 逐行 ----------
+    def add(self, material, move_type, qty, ref_id=None):
+        """
+        material：物料 id（int）或物料编码（str）
+        move_type：IN / OUT 数量 > 0；ADJUST 为带符号差额；COUNT 为盘点数（>= 0），按差额记 ADJUST
+        """
+        self.rows += 1
+        mid = material if isinstance(material, int) else self.material_ids.get(material)
+        if mid is None or mid not in self.known_ids:
+            return self._fail(f"物料 {material} 不存在")
+        if move_type not in MOVE_TYPES:
+            return self._fail(f"类型必须为 {'/'.join(MOVE_TYPES)}")
+        if not isinstance(qty, int):
+            return self._fail("数量必须为整数")
+        if (move_type in ("IN", "OUT") and qty <= 0) or (move_type == "ADJUST" and qty == 0) \
+                or (move_type == "COUNT" and qty < 0):
+            return self._fail("IN/OUT 数量须 > 0，ADJUST 不能为 0，盘点数不能为负")
+
+        if move_type == "COUNT":
+            if mid in self.counted or mid in self.moved:
+                return self._fail(f"物料 {material} 重复盘点或同时有其他出入库")
+            self.counted.add(mid)
+            self._counts[mid] = (self.rows, qty, ref_id)
+        else:
+            if mid in self.counted:
+                return self._fail(f"物料 {material} 已盘点，不能同时有其他出入库")
+            self.moved.add(mid)
+            self._moves.append((mid, -qty if move_type == "OUT" else qty, move_type, ref_id))
+
+        self._pending += 1
+        if self._pending >= self.batch_size:
+            self.flush()
+
+    def _fail(self, reason):
+        self._record(self.rows, reason)
+
+    def _record(self, row, reason):
+        """row 为 None 表示按物料合计后才发现的问题（没有库存行、出库后为负）"""
+        self.failed += 1
+        if len(self.errors) < MAX_ERRORS:
+            self.errors.append({"row": row, "error": reason})
+
+    def _code(self, mid):
+        if self._codes is None:
+            self._codes = {v: k for k, v in self.material_ids.items()}
+        return self._codes.get(mid, mid)
+
+    # ---------- 批量落库 ----------
+    def flush(self):
+        if not self._pending or self.failed:
+            return self._reset_batch()
+        if not self._ready:
+            _batch.create(self.session.connection(), checkfirst=True)
+            self._ready = True
+
+        moves = self._moves
+        if self._counts:
+            on_hand = {}
+            for chunk in chunks(self._counts):
+                on_hand.update(self.session.execute(
+                    select(Inventory.material_id, Inventory.on_hand)
+                    .where(Inventory.material_id.in_(chunk)).with_for_update()
+                ).all())
+            for mid, (row, counted, ref_id) in self._counts.items():
+                if mid not in on_hand:
+                    self._record(row, f"物料 {self._code(mid)} 没有库存行")
+                elif counted != on_hand[mid]:
+                    moves.append((mid, counted - on_hand[mid], "ADJUST", ref_id))
+                    self.adjusted += 1
+                else:
+                    self.unchanged += 1
+
+        totals = {}  # material_id -> [增减, 入库, 出库, 条数]
+        for mid, qty, _, _ in moves:
+            t = totals.get(mid)
+            if t is None:
+                t = totals[mid] = [0, 0, 0, 0]
+            t[0] += qty
+            t[1 if qty > 0 else 2] += abs(qty)
+            t[3] += 1
+
+        if not totals or self.failed:
+            return self._reset_batch()
+
+        now = datetime.utcnow()
+        executemany(self.session, _batch, _BATCH_COLUMNS, [(mid, *t) for mid, t in totals.items()])
+        self._update_inventory(len(totals), any(t[2] for t in totals.values()))
+        if not self.failed:
+            at, ref_type = bind_value(self.session, StockMove.created_at, now), self.ref_type
+            executemany(self.session, StockMove.__table__, _MOVE_COLUMNS,
+                        [(mid, qty, mt, ref_type, ref_id, at) for mid, qty, mt, ref_id in moves])
+            rollups.record_move_totals(now, _batch)
+            self.moves += len(moves)
+            for t in totals.values():
+                self.in_qty += t[1]
+                self.out_qty += t[2]
+        self.session.execute(delete(_batch))
+        self._reset_batch()
+
+    def _update_inventory(self, expected, has_out):
+        updated = self.session.execute(
+            update(Inventory)
+            .where(Inventory.material_id == _batch.c.material_id)
+            .values(on_hand=Inventory.on_hand + _batch.c.delta)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+        if updated != expected:
+            for mid in self.session.execute(
+                select(_batch.c.material_id)
+                .outerjoin(Inventory, Inventory.material_id == _batch.c.material_id)
+                .where(Inventory.id.is_(None))
+            ).scalars():
+                self._record(None, f"物料 {self._code(mid)} 没有库存行")
+        if has_out:
+            for mid, on_hand in self.session.execute(
+                select(Inventory.material_id, Inventory.on_hand)
+                .join(_batch, _batch.c.material_id == Inventory.material_id)
+                .where(_batch.c.out_qty > 0, Inventory.on_hand < 0)
+            ):
+                self._record(None, f"物料 {self._code(mid)} 库存不足（出库后为 {on_hand}）")
+
+    # ---------- 汇总 ----------
+    def summary(self):
+        elapsed = time.perf_counter() - self.started
+        return {
+            "ref_type": self.ref_type,
+            "rows": self.rows,
+            "moves": self.moves,
+            "in_qty": self.in_qty,
+            "out_qty": self.out_qty,
+            "adjusted": self.adjusted,
+            "unchanged": self.unchanged,
+            "materials": len(self.counted | self.moved),
+            "failed": self.failed,
+            "elapsed_ms": round(elapsed * 1000, 1),
+            "moves_per_sec": round(self.moves / elapsed, 1) if elapsed > 0 else None,
+        }
+
+
+def _int(v):
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return None
+
+
+def import_moves(items, ref_type="MANUAL", batch_size=5000):
+    """
+    JSON 批量：[{"material_id" 或 "material_code", "move_type", "qty", "counted", "ref_id"}]
+    move_type 为 ADJUST 且给了 counted 时按盘点处理
+    """
+    importer = StockMoveImporter(ref_type, batch_size=batch_size)
+    for it in items:
+        if not isinstance(it, dict):
+            importer.rows += 1
+            importer._fail("格式错误")
+            continue
+        material = _int(it.get("material_id")) or str(it.get("material_code") or "").strip()
+        move_type = str(it.get("move_type") or "").strip().upper()
+        qty = _int(it.get("qty"))
+        if move_type == "ADJUST" and it.get("counted") is not None:
+            move_type, qty = "COUNT", _int(it.get("counted"))
+        ref_id = str(it.get("ref_id") or "").strip() or None
+        importer.add(material, move_type, qty, ref_id)
+    importer.flush()
+    return importer
+
+
+# =========================
+# CSV / TSV 导入：表头含 物料编码、数量，可选 单号
+#   mode=in     收货，数量为入库数
+#   mode=count  盘点，数量为实盘数
+# =========================
+CSV_MODES = {"in": ("IN", "RECEIPT"), "count": ("COUNT", "COUNT")}
+
+
+def import_csv_rows(rows, mode, batch_size=5000):
+    """
+    rows 为 iter_text_rows 产出的字符串列表，首个非空行为表头；物料编码和数量都为空的行忽略。
+    表头不合法时抛 ValueError，调用方负责 commit / rollback
+    """
+    move_type, ref_type = CSV_MODES[mode]
+    rows = iter(rows)
+    header = [_cell(h) for h in next((r for r in rows if any(_cell(c) for c in r)), None) or []]
+    if "物料编码" not in header or "数量" not in header:
+        raise ValueError("表头必须包含：物料编码、数量（可选：单号）")
+    ci, qi = header.index("物料编码"), header.index("数量")
+    ri = header.index("单号") if "单号" in header else None
+    width = max(ci, qi) + 1
+
+    importer = StockMoveImporter(ref_type, batch_size=batch_size)
+    add = importer.add
+    for r in rows:
+        if len(r) < width:
+            if any(c.strip() for c in r):
+                importer.rows += 1
+                importer._fail("列数不足")
+            continue
+        code, qty = r[ci].strip(), r[qi].strip()
+        if not code and not qty:
+            continue
+        try:
+            qty = int(qty)
+        except ValueError:
+            qty = None
+        ref_id = (r[ri].strip() or None) if ri is not None and ri < len(r) else None
+        add(code, move_type, qty, ref_id)
+    importer.flush()
+    return importer
@@ -0,0 +1,74 @@
+import re
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import select, case
+
+from dbutil import upsert, increment_upsert
+from models import db, Task, TaskSequence
+
+# =========================
+# 任务单号自动生成：{前缀}-{工厂当地日期}-{当天序号}，如 T-20260301-001
+#
+# task_sequences 每个 "前缀-日期" 一行，分配时在当前事务里
+#   INSERT ... ON CONFLICT DO UPDATE SET last_no = last_no + 1 RETURNING last_no
+# 一条语句完成取号，行锁（SQLite 为写锁）保证并发下不重号，不需要 SELECT max(task_no)。
+# 事务回滚时序号一并回滚，不留空号。
+# 手工填写的单号若符合同一格式，用 observe() 把计数器推到不小于该序号，之后自动分配不会撞号。
+# =========================
+
+SEQ_DIGITS = 3
+
+
+def _pattern(prefix):
+    return re.compile(rf"^({re.escape(prefix)}-\d{{8}})-(\d+)$")
+
+
+def day_prefix(at=None):
+    cfg = current_app.config
+    local = (at or datetime.utcnow()) + timedelta(hours=cfg["PLANT_UTC_OFFSET_HOURS"])
+    return f"{cfg['TASK_NO_PREFIX']}-{local:%Y%m%d}"
+
+
+def allocate(at=None):
+    """取下一个任务单号（只 flush 不 commit，随调用方事务提交/回滚）"""
+    prefix = day_prefix(at)
+    table = TaskSequence.__table__
+    stmt = increment_upsert(table, ("prefix",), ("last_no",), db.session.get_bind().dialect.name)
+    n = db.session.execute(stmt.returning(table.c.last_no), {"prefix": prefix, "last_no": 1}).scalar_one()
+    return f"{prefix}-{n:0{SEQ_DIGITS}d}"
+
+
+def _raise_to(conn_or_session, dialect_name, seen):
+    """seen: {前缀: 序号}，计数器取 max(原值, 序号)"""
+    if not seen:
+        return
+    table = TaskSequence.__table__
+    stmt = upsert(table, dialect_name)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["prefix"],
+        set_={"last_no": case((table.c.last_no < stmt.excluded.last_no, stmt.excluded.last_no),
+                              else_=table.c.last_no)},
+    )
+    conn_or_session.execute(stmt, [{"prefix": p, "last_no": n} for p, n in seen.items()])
+
+
+def observe(task_no):
+    """手工单号符合自动格式时推进对应计数器"""
+    m = _pattern(current_app.config["TASK_NO_PREFIX"]).match(task_no)
+    if m:
+        _raise_to(db.session, db.session.get_bind().dialect.name, {m.group(1): int(m.group(2))})
+
+
+def rebuild(conn, prefix):
+    """按已有任务单号回填计数器；conn 为 Connection（迁移里调用）"""
+    pattern = _pattern(prefix)
+    seen = defaultdict(int)
+    for (task_no,) in conn.execution_options(stream_results=True).execute(
+        select(Task.task_no).where(Task.task_no.like(f"{prefix}-%"))
+    ):
+        m = pattern.match(task_no)
+        if m:
+            seen[m.group(1)] = max(seen[m.group(1)], int(m.group(2)))
+    _raise_to(conn, conn.dialect.name, seen)
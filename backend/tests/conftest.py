@@ -0,0 +1,69 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# 定时快照线程会在测试中途抢写锁
+os.environ.setdefault("MES_INVENTORY_SNAPSHOT_HOURS", "0")
+
+import pytest
+from sqlalchemy import event
+
+from config import Config, _engine_options
+
+
+@pytest.fixture
+def app(tmp_path, monkeypatch):
+    """每个测试一个临时 SQLite 文件库（建表 + 迁移），不会动 mes.sqlite3"""
+    uri = "sqlite:///" + str(tmp_path / "test.sqlite3")
+    monkeypatch.setattr(Config, "SQLALCHEMY_DATABASE_URI", uri)
+    monkeypatch.setattr(Config, "SQLALCHEMY_ENGINE_OPTIONS", _engine_options(uri))
+    monkeypatch.setattr(Config, "JOB_SPOOL_DIR", str(tmp_path / "job_spool"))
+
+    from app import create_app
+    from bom_explode import bom_exploder
+    from httpcache import response_cache
+    from models import db
+    import migrations
+
+    app = create_app()
+    app.config["TESTING"] = True
+    with app.app_context():
+        db.create_all()
+        migrations.upgrade(db.engine)
+    # 进程级缓存按表版本号区分，换库后版本号会重新从 0 开始
+    bom_exploder.clear()
+    response_cache.clear()
+    yield app
+    with app.app_context():
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+@pytest.fixture
+def count_queries(app):
+    """count_queries(fn) -> fn 执行期间发出的 SQL 条数"""
+    from models import db
+
+    with app.app_context():
+        engine = db.engine
+
+    def count(fn):
+        n = 0
+
+        def on_execute(*args):
+            nonlocal n
+            n += 1
+
+        event.listen(engine, "before_cursor_execute", on_execute)
+        try:
+            fn()
+        finally:
+            event.remove(engine, "before_cursor_execute", on_execute)
+        return n
+
+    return count
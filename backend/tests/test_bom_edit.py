@@ -0,0 +1,56 @@
+import threading
+
+import pytest
+
+
+def seed(client, n):
+    ids = [client.post("/api/materials", json={"material_code": f"X{i}", "material_name": "物料"}).get_json()["id"]
+           for i in range(n)]
+    pid = client.post("/api/products", json={"product_code": "P1", "product_name": "产品"}).get_json()["id"]
+    return pid, ids
+
+
+@pytest.mark.parametrize("value, dry_run", [(True, True), (1, True), ("1", True), ("true", True),
+                                            (False, False), (0, False), ("0", False), ("false", False)])
+def test_dry_run_flag(client, value, dry_run):
+    pid, ids = seed(client, 1)
+    r = client.put(f"/api/products/{pid}/bom", json={"items": [{"material_id": ids[0], "qty_per_unit": 2}],
+                                                    "dry_run": value})
+    assert r.status_code == 200
+    assert r.get_json()["dry_run"] is dry_run
+    assert len(client.get(f"/api/products/{pid}/bom").get_json()) == (0 if dry_run else 1)
+
+
+@pytest.mark.parametrize("value", [2, 1.0, "yes", [], {}])
+def test_dry_run_flag_rejects_other_values(client, value):
+    pid, ids = seed(client, 1)
+    r = client.put(f"/api/products/{pid}/bom", json={"items": [{"material_id": ids[0], "qty_per_unit": 2}],
+                                                    "dry_run": value})
+    assert r.status_code == 400
+
+
+def test_concurrent_full_bom_puts_return_200_or_409(app, client):
+    """同一产品并发整张提交：后到的要么成功要么 409，不出 500，最终 BOM 是某一次提交的完整结果"""
+    pid, ids = seed(client, 20)
+    codes, submitted = [], []
+    lock = threading.Lock()
+
+    def worker(k):
+        c = app.test_client()
+        for j in range(10):
+            items = [{"material_id": m, "qty_per_unit": 1 + (j + k) % 3} for m in ids[(j * k) % 7:]]
+            r = c.put(f"/api/products/{pid}/bom", json={"items": items})
+            with lock:
+                codes.append(r.status_code)
+                if r.status_code == 200:
+                    submitted.append({(it["material_id"], it["qty_per_unit"]) for it in items})
+
+    threads = [threading.Thread(target=worker, args=(k,)) for k in range(4)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+
+    assert set(codes) <= {200, 409}
+    final = {(b["material_id"], b["qty_per_unit"]) for b in client.get(f"/api/products/{pid}/bom").get_json()}
+    assert final in submitted
@@ -0,0 +1,79 @@
+import random
+import threading
+
+from sqlalchemy import func, select
+
+from models import db, Task, Mold, Inventory, TaskMaterialRequirement, StockMove, Report
+
+THREADS = 8
+REQUESTS = 25
+INITIAL_STOCK = 100
+
+
+def seed(client):
+    mold = client.post("/api/molds", json={"mold_code": "M1", "mold_name": "模具", "total_life": 10 ** 9})
+    mat = client.post("/api/materials", json={"material_code": "X1", "material_name": "物料"}).get_json()
+    prod = client.post("/api/products", json={"product_code": "P1", "product_name": "产品"}).get_json()
+    client.post(f"/api/products/{prod['id']}/bom", json={"material_id": mat["id"], "qty_per_unit": 1})
+    client.post("/api/inventory/in", json={"material_id": mat["id"], "qty": INITIAL_STOCK})
+    task = client.post("/api/tasks", json={
+        "task_no": "T1", "mold_id": mold.get_json()["id"], "operator_name": "张三",
+        "target_qty": 10 ** 9, "product_id": prod["id"],
+    }).get_json()
+    return task["id"], mat["id"]
+
+
+def test_concurrent_report_receive_issue_keep_counters_consistent(app, client):
+    """多线程同时报工/入库/发料，结束后各计数都等于成功请求之和（不丢更新、库存不为负）"""
+    task_id, material_id = seed(client)
+    totals = {"done": 0, "received": 0, "issued": 0}
+    lock, errors = threading.Lock(), []
+
+    def worker(n):
+        c, rng = app.test_client(), random.Random(n)
+        done = received = issued = 0
+        for _ in range(REQUESTS):
+            op, qty = rng.choice(("report", "in", "issue")), rng.randint(1, 5)
+            if op == "report":
+                r = c.post("/api/report", json={"task_no": "T1", "qty": qty})
+                ok = r.status_code == 201
+                done += qty if ok else 0
+            elif op == "in":
+                r = c.post("/api/inventory/in", json={"material_id": material_id, "qty": qty})
+                ok = r.status_code == 200
+                received += qty if ok else 0
+            else:
+                r = c.post(f"/api/tasks/{task_id}/issue", json={"material_id": material_id, "qty": qty})
+                # 库存不足是合法的业务拒绝
+                ok = r.status_code == 200 or (r.status_code == 400 and r.get_json()["error"] == "库存不足")
+                issued += qty if r.status_code == 200 else 0
+            if not ok:
+                errors.append((op, r.status_code, r.get_data(as_text=True)[:200]))
+        with lock:
+            totals["done"] += done
+            totals["received"] += received
+            totals["issued"] += issued
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(THREADS)]
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+
+    assert errors == []
+    with app.app_context():
+        task = db.session.get(Task, task_id)
+        mold = db.session.get(Mold, task.mold_id)
+        on_hand = db.session.scalar(select(Inventory.on_hand).where(Inventory.material_id == material_id))
+        issued_qty = db.session.scalar(select(TaskMaterialRequirement.issued_qty).where(
+            TaskMaterialRequirement.task_id == task_id, TaskMaterialRequirement.material_id == material_id))
+        ledger = db.session.scalar(select(func.sum(StockMove.qty)).where(StockMove.material_id == material_id))
+        reported = db.session.scalar(select(func.coalesce(func.sum(Report.qty), 0)).where(Report.task_id == task_id))
+
+    assert task.done_qty == totals["done"]
+    assert mold.used_count == totals["done"]
+    assert reported == totals["done"]
+    assert on_hand == INITIAL_STOCK + totals["received"] - totals["issued"]
+    assert on_hand >= 0
+    assert ledger == on_hand
+    assert issued_qty == totals["issued"]
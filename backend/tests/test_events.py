@@ -0,0 +1,76 @@
+import json
+import os
+import subprocess
+import sys
+import time
+
+import events
+from events import event_bus
+
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 另一个 worker 进程：同一个库上建一个模具
+OTHER_WORKER = """
+from app import create_app
+c = create_app().test_client()
+r = c.post("/api/molds", json={"mold_code": "M2", "mold_name": "另一进程", "total_life": 100})
+assert r.status_code == 201, r.get_data(as_text=True)
+"""
+
+
+def read_events(last_event_id, types, until):
+    """读 SSE 直到 until(已读事件列表) 为真或超时，返回 [(id, type, data)]"""
+    got = []
+    for chunk in events.stream(last_event_id, types, 0.2, 10):
+        for block in chunk.strip().split("\n\n"):
+            fields = dict(line.split(": ", 1) for line in block.split("\n") if ": " in line)
+            if "event" in fields:
+                got.append((fields["id"], fields["event"], json.loads(fields["data"])))
+        if until(got):
+            break
+    return got
+
+
+def wait_seq(n, timeout=5):
+    deadline = time.monotonic() + timeout
+    while event_bus.last_seq < n and time.monotonic() < deadline:
+        time.sleep(0.05)
+    return event_bus.last_seq
+
+
+def test_events_from_other_process_resume_by_global_id(app, client):
+    """其他进程提交的事件经 change_events 到达本进程，Last-Event-ID 是全局序号"""
+    r = client.post("/api/molds", json={"mold_code": "M1", "mold_name": "本进程", "total_life": 100})
+    assert r.status_code == 201
+    first = wait_seq(1)
+    assert first >= 1
+
+    env = dict(os.environ, MES_DATABASE_URL=app.config["SQLALCHEMY_DATABASE_URI"],
+               MES_EVENTS_POLL_SECONDS="0", MES_INVENTORY_SNAPSHOT_HOURS="0")
+    subprocess.run([sys.executable, "-c", OTHER_WORKER], cwd=BACKEND, env=env, check=True, timeout=60)
+
+    got = read_events(str(first), ["mold"], lambda g: any(t == "mold.created" for _, t, _ in g))
+    created = [(i, d) for i, t, d in got if t == "mold.created"]
+    assert [d["mold_code"] for _, d in created] == ["M2"]
+    assert int(created[0][0]) > first
+    assert all(t != "reset" for _, t, _ in got)
+
+
+def test_unknown_last_event_id_gets_reset(app, client):
+    client.post("/api/molds", json={"mold_code": "M1", "mold_name": "模具", "total_life": 100})
+    wait_seq(1)
+    for last_id in ("abcd1234-5", str(event_bus.last_seq + 1000)):
+        got = read_events(last_id, [], lambda g: bool(g))
+        assert got[0][1] == "reset"
+
+
+def test_rolled_back_events_are_not_stored(app):
+    from models import db, ChangeEvent, Mold
+
+    with app.app_context():
+        db.session.add(Mold(mold_code="M1", mold_name="模具", total_life=100))
+        db.session.flush()
+        events.emit("mold.created", {"id": 1})
+        db.session.rollback()
+        db.session.commit()
+        assert db.session.query(ChangeEvent).count() == 0
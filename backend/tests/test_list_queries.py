@@ -0,0 +1,44 @@
+import pytest
+from sqlalchemy import func, insert, select
+
+from models import db, Mold, Material, Inventory, Product, BOMItem, Task, TaskMaterialRequirement
+
+N = 5
+
+
+def seed(app, n):
+    """
+    再追加 n 个带模具/产品/物料关联的任务、产品、库存行，
+    并给 1 号产品追加 n 行 BOM、给 1 号任务追加 n 行用料需求（嵌套列表的子行，各指向不同物料）
+    """
+    with app.app_context():
+        start = db.session.scalar(select(func.count()).select_from(Mold)) + 1
+        ids = range(start, start + n)
+        db.session.execute(insert(Mold), [{"mold_code": f"M{i}", "mold_name": "模具", "total_life": 1000}
+                                          for i in ids])
+        db.session.execute(insert(Material), [{"material_code": f"X{i}", "material_name": "物料"} for i in ids])
+        db.session.execute(insert(Inventory), [{"material_id": i, "on_hand": 10, "reserved": 0} for i in ids])
+        db.session.execute(insert(Product), [{"product_code": f"P{i}", "product_name": "产品"} for i in ids])
+        db.session.execute(insert(BOMItem), [{"product_id": 1, "material_id": i, "qty_per_unit": 1} for i in ids])
+        db.session.execute(insert(Task), [{"task_no": f"T{i}", "mold_id": i, "product_id": i,
+                                           "operator_name": "张三", "target_qty": 100} for i in ids])
+        db.session.execute(insert(TaskMaterialRequirement), [
+            {"task_id": 1, "material_id": i, "required_qty": 100, "issued_qty": 0} for i in ids
+        ])
+        db.session.commit()
+
+
+@pytest.mark.parametrize("url", [
+    "/api/tasks", "/api/products", "/api/inventory",
+    "/api/products/1/bom", "/api/tasks/1/materials",
+])
+def test_list_query_count_does_not_grow_with_rows(app, client, count_queries, url):
+    seed(app, N)
+    small = count_queries(lambda: client.get(url))
+    assert len(client.get(url).get_json()) == N
+
+    seed(app, 9 * N)
+    large = count_queries(lambda: client.get(url))
+    assert len(client.get(url).get_json()) == 10 * N
+
+    assert large == small
@@ -0,0 +1,55 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import select
+
+import rollups
+from models import db, Report, ProductionRollup
+
+PLUS8 = timezone(timedelta(hours=8))
+
+
+def seed(client):
+    mold = client.post("/api/molds", json={"mold_code": "M1", "mold_name": "模具", "total_life": 10 ** 9}).get_json()
+    client.post("/api/tasks", json={"task_no": "T1", "mold_id": mold["id"], "operator_name": "张三",
+                                    "target_qty": 10 ** 6})
+
+
+def rollup_rows():
+    return sorted(db.session.execute(select(
+        ProductionRollup.day, ProductionRollup.shift, ProductionRollup.operator_name,
+        ProductionRollup.mold_id, ProductionRollup.qty, ProductionRollup.report_count,
+    )).all())
+
+
+def test_offset_reported_at_stored_as_utc_and_rebuild_matches(app, client):
+    seed(client)
+    # +08:00 的 19:00 = UTC 11:00；若丢掉时区按 19:00 UTC 存，会落到另一个班次
+    at = datetime.now(PLUS8).replace(hour=19, minute=0, second=0, microsecond=0) - timedelta(days=1)
+    r = client.post("/api/reports/batch", json={"reports": [
+        {"key": "k1", "task_no": "T1", "qty": 7, "reported_at": at.isoformat()},
+        {"key": "k2", "task_no": "T1", "qty": 3},
+    ]})
+    assert r.status_code == 200
+    assert [x["status"] for x in r.get_json()["results"]] == ["ok", "ok"]
+
+    with app.app_context():
+        stored = db.session.scalar(select(Report.created_at).where(Report.qty == 7))
+        assert stored == at.astimezone(timezone.utc).replace(tzinfo=None)
+
+        live = rollup_rows()
+        rollups.rebuild(db.session.connection())
+        db.session.commit()
+        assert rollup_rows() == live
+
+
+def test_reported_at_out_of_range_is_rejected_per_row(app, client):
+    seed(client)
+    now = datetime.now(timezone.utc)
+    r = client.post("/api/reports/batch", json={"reports": [
+        {"key": "future", "task_no": "T1", "qty": 1, "reported_at": (now + timedelta(hours=2)).isoformat()},
+        {"key": "old", "task_no": "T1", "qty": 1,
+         "reported_at": (now - timedelta(days=app.config["REPORT_BACKDATE_DAYS"] + 1)).isoformat()},
+        {"key": "bad", "task_no": "T1", "qty": 1, "reported_at": "yesterday"},
+        {"key": "ok", "task_no": "T1", "qty": 1, "reported_at": (now - timedelta(hours=1)).isoformat()},
+    ]})
+    assert [x["status"] for x in r.get_json()["results"]] == ["error", "error", "error", "ok"]
@@ -0,0 +1,113 @@
+from sqlalchemy import select, func, literal
+
+from models import db, Material, Product, BOMItem, Task, TaskMaterialRequirement
+
+# =========================
+# 物料反查（where-used）：某个物料被哪些产品/半成品用到，以及受影响的进行中任务
+#
+# 与 bom_explode 相同的父子关联：BOM 子件的物料编码等于某产品编码时，该子件是半成品。
+# 反查时逐层向上：
+#   物料 m --bom_items(material_id)--> 产品 p --同编码--> 物料 m' --bom_items--> 上层产品 ...
+# 用一条递归 CTE 完成，每一步都走索引：
+#   bom_items (material_id, product_id)     ix_bom_items_material_product
+#   products.product_code / materials.material_code 唯一索引
+# 读取量只和受影响的那部分 BOM 有关，与 BOM 总行数无关。
+# CTE 按 (产品, 层级) 去重并限制最大层数，循环 BOM 也会停下来；产品、任务查询直接 JOIN 这个 CTE。
+# =========================
+
+MAX_LEVELS = 50
+
+
+def _parents_cte(material_id, max_levels):
+    base = (
+        select(BOMItem.product_id.label("product_id"), literal(1).label("level"))
+        .where(BOMItem.material_id == material_id)
+    )
+    up = base.cte("up", recursive=True)
+    step = (
+        select(BOMItem.product_id, (up.c.level + 1))
+        .select_from(up)
+        .join(Product, Product.id == up.c.product_id)
+        .join(Material, Material.material_code == Product.product_code)
+        .join(BOMItem, BOMItem.material_id == Material.id)
+        .where(up.c.level < max_levels)
+    )
+    return up.union(step)
+
+
+def _levels(material_id, max_levels):
+    """(product_id, 最浅层级) 子查询，1 = 直接用到该物料"""
+    up = _parents_cte(material_id, max_levels)
+    return (
+        select(up.c.product_id.label("product_id"), func.min(up.c.level).label("level"))
+        .group_by(up.c.product_id)
+        .subquery("affected")
+    )
+
+
+def affected_products(material_id, max_levels=MAX_LEVELS):
+    """逐层向上用到该物料的全部产品 id"""
+    affected = _levels(material_id, max_levels)
+    return set(db.session.execute(select(affected.c.product_id)).scalars())
+
+
+def where_used(material_id, max_levels=MAX_LEVELS):
+    affected = _levels(material_id, max_levels)
+
+    direct = dict(db.session.execute(
+        select(BOMItem.product_id, BOMItem.qty_per_unit).where(BOMItem.material_id == material_id)
+    ).all())
+    # 还被更上层用到的（没有即成品）
+    used_above = set(db.session.execute(
+        select(affected.c.product_id)
+        .join(Product, Product.id == affected.c.product_id)
+        .join(Material, Material.material_code == Product.product_code)
+        .join(BOMItem, BOMItem.material_id == Material.id)
+        .distinct()
+    ).scalars())
+    products = [{
+        "product_id": pid, "product_code": code, "product_name": name, "version": version,
+        "level": level, "qty_per_unit": direct.get(pid), "top_level": pid not in used_above,
+    } for pid, code, name, version, level in db.session.execute(
+        select(Product.id, Product.product_code, Product.product_name, Product.version, affected.c.level)
+        .join(affected, affected.c.product_id == Product.id)
+        .order_by(affected.c.level, Product.product_code)
+    )]
+
+    # 受影响的进行中任务，附带本物料的需求（半成品不会出现在需求里，为 null）
+    req = TaskMaterialRequirement
+    tasks = [{
+        "task_id": tid, "task_no": no, "product_id": pid, "target_qty": target, "done_qty": done,
+        "required_qty": required, "issued_qty": issued,
+        "outstanding_qty": max(required - issued, 0) if required is not None else None,
+    } for tid, no, pid, target, done, required, issued in db.session.execute(
+        select(Task.id, Task.task_no, Task.product_id, Task.target_qty, Task.done_qty,
+               req.required_qty, req.issued_qty)
+        .join(affected, affected.c.product_id == Task.product_id)
+        .outerjoin(req, (req.task_id == Task.id) & (req.material_id == material_id))
+        .where(Task.status == "进行中")
+        .order_by(Task.id)
+    )]
+
+    return {
+        "material_id": material_id,
+        "product_count": len(products),
+        "top_level_count": sum(p["top_level"] for p in products),
+        "max_level": max((p["level"] for p in products), default=0),
+        "open_task_count": len(tasks),
+        "products": products,
+        "tasks": tasks,
+    }
+
+
+def usage_counts(material_id):
+    """删除前的快速检查：直接引用它的 BOM 行数、进行中任务的需求行数"""
+    bom = db.session.execute(
+        select(func.count()).select_from(BOMItem).where(BOMItem.material_id == material_id)
+    ).scalar()
+    reqs = db.session.execute(
+        select(func.count()).select_from(TaskMaterialRequirement)
+        .join(Task, Task.id == TaskMaterialRequirement.task_id)
+        .where(TaskMaterialRequirement.material_id == material_id, Task.status == "进行中")
+    ).scalar()
+    return {"bom_items": bom, "open_requirements": reqs}
@@ -1,8 +1,11 @@
 import axios from 'axios';
 
+// 后端地址（axios 和 SSE 推送共用）
+export const API_BASE = 'http://192.168.31.129:5001/api';
+
 // 创建 axios 实例，配置基础 URL
 const apiClient = axios.create({
-  baseURL: 'http://192.168.31.129:5001/api',  // 你的后端地址
+  baseURL: API_BASE,
   timeout: 10000,
   headers: { 'Content-Type': 'application/json' }
 });
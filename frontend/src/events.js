@@ -0,0 +1,55 @@
+import { onMounted, onUnmounted } from "vue";
+import { API_BASE } from "./api";
+
+// 后端 /api/events 变更推送：整个页面共用一条 EventSource，按事件类型分发给各组件。
+// 断线后浏览器自动重连并续传；收到 reset（中间有事件丢失）时通知订阅者重新拉取列表。
+const handlers = new Map(); // 事件类型 -> Set(回调)
+const resetHandlers = new Set();
+const listening = new Set(); // 当前 EventSource 上已注册的类型
+let source = null;
+
+function listen(type) {
+  if (listening.has(type)) return;
+  listening.add(type);
+  source.addEventListener(type, (e) => {
+    const data = JSON.parse(e.data);
+    for (const fn of handlers.get(type) || []) fn(data, type);
+  });
+}
+
+function connect() {
+  if (source) return;
+  source = new EventSource(`${API_BASE}/events`);
+  source.addEventListener("reset", () => resetHandlers.forEach((fn) => fn()));
+  for (const type of handlers.keys()) listen(type);
+}
+
+function disconnect() {
+  if (source && handlers.size === 0 && resetHandlers.size === 0) {
+    source.close();
+    source = null;
+    listening.clear();
+  }
+}
+
+// 组件内使用：useEvents({ "task.progress": (data) => ..., ... }, onReset)
+// 组件挂载时订阅，卸载时退订
+export function useEvents(map, onReset) {
+  onMounted(() => {
+    for (const [type, fn] of Object.entries(map)) {
+      if (!handlers.has(type)) handlers.set(type, new Set());
+      handlers.get(type).add(fn);
+      if (source) listen(type);
+    }
+    if (onReset) resetHandlers.add(onReset);
+    connect();
+  });
+  onUnmounted(() => {
+    for (const [type, fn] of Object.entries(map)) {
+      handlers.get(type)?.delete(fn);
+      if (handlers.get(type)?.size === 0) handlers.delete(type);
+    }
+    if (onReset) resetHandlers.delete(onReset);
+    disconnect();
+  });
+}